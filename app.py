@@ -6,6 +6,8 @@ load_dotenv()
 
 from routes.task_routes import task_bp
 from routes.ai_task_routes import ai_task_bp
+from routes.ai_job_routes import ai_job_bp
+from managers.job_manager import JobManager
 
 def create_app():
     app = Flask(__name__)
@@ -13,6 +15,10 @@ def create_app():
     # Registro de Blueprints
     app.register_blueprint(task_bp)
     app.register_blueprint(ai_task_bp)
+    app.register_blueprint(ai_job_bp)
+
+    # Reencolar los trabajos de IA que quedaron a medias en un proceso anterior
+    JobManager.resume()
 
     return app
 
@@ -0,0 +1,378 @@
+"""
+Benchmarks locales del proyecto.
+
+Trabajan sobre archivos temporales (nunca sobre el tasks.json real) y no
+necesitan el servidor Flask corriendo. Ejecutar todos o solo algunos:
+
+    python benchmark.py
+    python benchmark.py index
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+
+# Valores ficticios para poder crear la app sin credenciales reales
+os.environ.setdefault('AZURE_OPENAI_API_KEY', 'test')
+os.environ.setdefault('AZURE_OPENAI_ENDPOINT', 'https://localhost')
+os.environ.setdefault('AZURE_OPENAI_DEPLOYMENT', 'test')
+os.environ.setdefault('AZURE_OPENAI_API_VERSION', '2024-12-01-preview')
+
+from app import create_app
+from managers.task_manager import TaskManager
+from models.task import Task
+from routes import ai_task_routes
+from services.ai_service import AIService
+from services.async_ai_service import AsyncAIService
+from services.fake_llm_server import make_server
+from services.llm_cache import LLMCache
+from services.local_classifier import LocalClassifier
+from services.near_duplicate import NEAR_DUPLICATE_FIELDS, NearDuplicateIndex
+from services.llm_providers import AzureOpenAIProvider, FakeLLMProvider
+
+SIZES = [1_000, 10_000, 100_000]
+
+
+def print_separator(title):
+    print(f"\n{'='*20} {title} {'='*20}")
+
+
+def make_task(i):
+    """Genera una tarea sintética determinista."""
+    return Task(
+        id=str(uuid.UUID(int=i)),
+        title=f"Tarea {i}",
+        description=f"Descripción de la tarea número {i}",
+        priority=['baja', 'media', 'alta', 'bloqueante'][i % 4],
+        effort_hours=(i % 40) / 2,
+        status=['pendiente', 'en progreso', 'en revisión', 'completada'][i % 4],
+        assigned_to=['Pablo', 'Juan', 'María', 'Carlos'][i % 4]
+    )
+
+
+def setup_store(size):
+    """Apunta TaskManager a un tasks.json temporal con `size` tareas."""
+    tmp_dir = tempfile.mkdtemp()
+    TaskManager.configure(os.path.join(tmp_dir, 'tasks.json'))
+    TaskManager.save_tasks([make_task(i) for i in range(size)])
+    return [str(uuid.UUID(int=i)) for i in range(size)]
+
+
+def timeit(fn, repeat):
+    """Devuelve la latencia media de fn() en microsegundos."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def bench_index():
+    print_separator("BENCHMARK: BÚSQUEDA POR ID")
+    print(f"{'tareas':>10} {'get_task (µs)':>15} {'escaneo lineal (µs)':>22}")
+    for size in SIZES:
+        ids = setup_store(size)
+        target = ids[-1]
+        tasks = TaskManager.load_tasks()
+
+        indexed = timeit(lambda: TaskManager.get_task(target), 10_000)
+        linear = timeit(lambda: next((t for t in tasks if t.id == target), None), 20)
+        print(f"{size:>10} {indexed:>15.2f} {linear:>22.2f}")
+
+
+def bench_writes():
+    print_separator("BENCHMARK: ESCRITURA DE UNA TAREA")
+    print(f"{'tareas':>10} {'add_task (ms)':>15} {'reescritura completa (ms)':>28}")
+    for size in SIZES:
+        setup_store(size)
+        # Umbral alto para medir solo el append, sin compactación
+        TaskManager.journal_max_bytes = float('inf')
+        counter = iter(range(size, size * 2))
+
+        journal = timeit(lambda: TaskManager.add_task(make_task(next(counter))), 50) / 1000
+        tasks = TaskManager.load_tasks()
+        full = timeit(lambda: TaskManager._dump_snapshot([t.to_dict() for t in tasks], TaskManager.tasks_file + '.bench'), 3) / 1000
+        print(f"{size:>10} {journal:>15.3f} {full:>28.3f}")
+
+
+def bench_group_commit():
+    print_separator("BENCHMARK: GROUP COMMIT (ESCRITURAS CONCURRENTES)")
+    threads, per_thread = 32, 50
+    print(f"{threads} hilos x {per_thread} altas")
+    print(f"{'configuración':>28} {'altas/s':>10} {'escrituras':>12}")
+    for label, max_batch in [("sin agrupar (lote=1)", 1), ("group commit", 256)]:
+        setup_store(1_000)
+        TaskManager.journal_max_bytes = float('inf')
+        TaskManager._submit(lambda: None)
+        TaskManager._committer.max_batch = max_batch
+
+        appends = []
+        original_append = TaskManager._journal.append
+        TaskManager._journal.append = lambda records: appends.append(1) or original_append(records)
+
+        counter = iter(range(10_000, 10_000 + threads * per_thread))
+        lock = threading.Lock()
+
+        def worker():
+            for _ in range(per_thread):
+                with lock:
+                    i = next(counter)
+                TaskManager.add_task(make_task(i))
+
+        start = time.perf_counter()
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+
+        assert len(TaskManager.load_tasks()) == 1_000 + threads * per_thread
+        print(f"{label:>28} {threads * per_thread / elapsed:>10.0f} {len(appends):>12}")
+        TaskManager._committer.max_batch = 256
+
+
+def bench_query():
+    print_separator("BENCHMARK: CONSULTA FILTRADA (PRIMERA PÁGINA)")
+    print(f"{'tareas':>10} {'query_tasks (µs)':>18} {'filtrar lista (µs)':>20} {'ordenada (µs)':>15}")
+    filters = {"priority": "alta", "status": "en revisión", "assigned_to": "María"}
+    for size in SIZES:
+        setup_store(size)
+        # Las tareas con prioridad 'alta' son el 1% del total
+        tasks = TaskManager.load_tasks()
+        for i, task in enumerate(tasks):
+            task.priority = 'alta' if i % 100 == 2 else 'media'
+        TaskManager.save_tasks(tasks)
+
+        indexed = timeit(lambda: TaskManager.query_tasks(filters, limit=20), 200)
+        linear = timeit(lambda: [t for t in tasks if all(getattr(t, f) == v for f, v in filters.items())][:20], 5)
+        ordered = timeit(lambda: TaskManager.query_tasks({"priority": "media"}, sort='effort_hours',
+                                                         descending=True, limit=20), 200)
+        print(f"{size:>10} {indexed:>18.1f} {linear:>20.1f} {ordered:>15.1f}")
+
+
+def bench_stream():
+    print_separator("BENCHMARK: GET /tasks NORMAL VS STREAMING")
+    client = create_app().test_client()
+    print(f"{'tareas':>10} {'modo':>10} {'1er byte (ms)':>14} {'total (ms)':>11} {'pico memoria (MB)':>18}")
+    for size in SIZES:
+        setup_store(size)
+        TaskManager.load_tasks()
+        for mode, url, headers in [("normal", "/tasks", {}),
+                                   ("stream", "/tasks?stream=true", {}),
+                                   ("ndjson", "/tasks", {"Accept": "application/x-ndjson"})]:
+            tracemalloc.start()
+            start = time.perf_counter()
+            response = client.get(url, headers=headers, buffered=False)
+            chunks = iter(response.response)
+            next(chunks)
+            first_byte = time.perf_counter() - start
+            for _ in chunks:
+                pass
+            total = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            response.close()
+            print(f"{size:>10} {mode:>10} {first_byte * 1000:>14.1f} {total * 1000:>11.1f} {peak / 1e6:>18.1f}")
+
+
+def bench_bulk():
+    print_separator("BENCHMARK: 5.000 POST /tasks VS 1 POST /tasks/bulk")
+    client = create_app().test_client()
+    count = 5_000
+    payload = [make_task(i).to_dict() for i in range(count)]
+
+    setup_store(0)
+    start = time.perf_counter()
+    for data in payload:
+        client.post('/tasks', json=data)
+    single = time.perf_counter() - start
+
+    setup_store(0)
+    start = time.perf_counter()
+    client.post('/tasks/bulk', json=payload)
+    bulk = time.perf_counter() - start
+
+    assert len(TaskManager.load_tasks()) == count
+    print(f"{count} altas individuales: {single:.2f} s")
+    print(f"1 alta bulk de {count}:    {bulk:.2f} s  ({single / bulk:.0f}x)")
+
+
+class LegacyTask:
+    """Copia de la clase Task original (sin __slots__) para comparar."""
+    def __init__(self, title, description, priority, effort_hours, status, assigned_to,
+                 id=None, category=None, risk_analysis=None, risk_mitigation=None):
+        self.id = id if id else str(uuid.uuid4())
+        self.title = title
+        self.description = description
+        self.priority = priority
+        self.effort_hours = float(effort_hours)
+        self.status = status
+        self.assigned_to = assigned_to
+        self.category = category
+        self.risk_analysis = risk_analysis
+        self.risk_mitigation = risk_mitigation
+
+    def to_dict(self):
+        return {
+            "id": self.id, "title": self.title, "description": self.description,
+            "priority": self.priority, "effort_hours": self.effort_hours,
+            "status": self.status, "assigned_to": self.assigned_to,
+            "category": self.category, "risk_analysis": self.risk_analysis,
+            "risk_mitigation": self.risk_mitigation
+        }
+
+    @staticmethod
+    def from_dict(data):
+        return LegacyTask(
+            id=data.get("id"), title=data.get("title"), description=data.get("description"),
+            priority=data.get("priority"), effort_hours=data.get("effort_hours"),
+            status=data.get("status"), assigned_to=data.get("assigned_to"),
+            category=data.get("category"), risk_analysis=data.get("risk_analysis"),
+            risk_mitigation=data.get("risk_mitigation")
+        )
+
+
+def bench_model():
+    print_separator("BENCHMARK: MODELO Task (100.000 TAREAS)")
+    size = 100_000
+    data = [make_task(i).to_dict() for i in range(size)]
+    print(f"{'clase':>14} {'carga (ms)':>11} {'to_dict (ms)':>13} {'memoria (MB)':>13}")
+    for label, load in [("original", lambda: [LegacyTask.from_dict(item) for item in data]),
+                        ("con slots", lambda: Task.from_dicts(data))]:
+        start = time.perf_counter()
+        tasks = load()
+        load_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        for task in tasks:
+            task.to_dict()
+        to_dict_ms = (time.perf_counter() - start) * 1000
+
+        del tasks
+        tracemalloc.start()
+        tasks = load()
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del tasks
+        print(f"{label:>14} {load_ms:>11.1f} {to_dict_ms:>13.1f} {memory / 1e6:>13.1f}")
+
+
+def bench_ai():
+    print_separator("BENCHMARK: IA CON PROVEEDOR SIMULADO (500 TAREAS)")
+    task = {"title": "Crear tests unitarios", "description": "Suite de pruebas de la API"}
+
+    # Sobrecarga propia por llamada (proveedor sin latencia, sin caché ni clasificador local)
+    service = AIService(cache=LLMCache(max_entries=0), provider=FakeLLMProvider(),
+                        classifier=LocalClassifier(threshold=1), near_duplicates={})
+    print(f"AIService.categorize_task:         {timeit(lambda: service.categorize_task(task), 2000):8.1f} µs")
+    local = AIService(cache=LLMCache(max_entries=0), provider=FakeLLMProvider(latency=0.1))
+    print(f"  resuelta por el clasificador local: {timeit(lambda: local.categorize_task(task), 2000):7.1f} µs")
+
+    # Búsqueda de tareas casi iguales con 100 000 respuestas guardadas
+    index = NearDuplicateIndex(NEAR_DUPLICATE_FIELDS['categorize'])
+    for i in range(100000):
+        index.set({"title": f"Tarea {i} del módulo {i % 97}", "description": f"Detalle {i * 7919 % 100003}"}, "Backend")
+    queries = iter([{"title": f"Tarea {i} del modulo {i % 97}", "description": f"Detalle {i}"}
+                    for i in range(2000)])
+    print(f"NearDuplicateIndex.get (100k):     {timeit(lambda: index.get(next(queries)), 2000):8.1f} µs")
+
+    # Auditoría encadenada frente a una sola llamada con 100 ms por llamada
+    auditor = AIService(cache=LLMCache(max_entries=0), provider=FakeLLMProvider(latency=0.1))
+    for mode in ('chain', 'structured'):
+        for i in range(5):
+            auditor.audit_risks(dict(task, title=f"Auditoría {i}"), mode=mode)
+    audit = auditor.get_status()["audit"]
+    print(f"audit_risks chain / structured:    {audit['chain']['avg_latency_ms']:.0f} / "
+          f"{audit['structured']['avg_latency_ms']:.0f} ms, {audit['chain']['avg_estimated_tokens']} / "
+          f"{audit['structured']['avg_estimated_tokens']} tokens (ahorro {audit['savings']})")
+
+    client = create_app().test_client()
+    ai_task_routes.ai_service = service
+    print(f"POST /ai/tasks/categorize:         "
+          f"{timeit(lambda: client.post('/ai/tasks/categorize', json=task), 2000):8.1f} µs")
+
+    # Concurrencia con 100 ms por llamada: proveedor en proceso y cliente real
+    # de Azure contra el servidor simulado (que corre en este mismo proceso)
+    server = make_server(port=0, provider=FakeLLMProvider(latency=0.1))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    http_provider = AzureOpenAIProvider('test', f"http://127.0.0.1:{server.server_port}", 'fake', '2024-12-01-preview')
+    services = [AsyncAIService(cache=LLMCache(max_entries=0), provider=provider,
+                               classifier=LocalClassifier(threshold=1), near_duplicates={})
+                for provider in (FakeLLMProvider(latency=0.1), http_provider)]
+    tasks = [dict(task, title=f"Tarea {i}") for i in range(500)]
+    print(f"\n{'concurrencia':>12} {'en proceso (s)':>15} {'HTTP (s)':>10} {'ideal (s)':>10}")
+    for concurrency in (8, 64, 256):
+        times = []
+        for async_service in services:
+            start = time.perf_counter()
+            results = async_service.run(async_service.run_batch('categorize', tasks, concurrency))
+            times.append(time.perf_counter() - start)
+            assert all("task" in result for result in results)
+        print(f"{concurrency:>12} {times[0]:>15.2f} {times[1]:>10.2f} {len(tasks) / concurrency * 0.1:>10.2f}")
+    server.shutdown()
+    server.server_close()
+
+
+STARTUP_SNIPPET = '''
+import sys, time
+start = time.perf_counter()
+from app import create_app
+create_app()
+boot = time.perf_counter() - start
+openai_loaded = 'openai' in sys.modules
+start = time.perf_counter()
+from routes.ai_task_routes import get_ai_service
+try:
+    get_ai_service()
+    first_use = time.perf_counter() - start
+except ValueError:
+    first_use = float('nan')
+print(boot, first_use, openai_loaded)
+'''
+
+
+def bench_startup():
+    print_separator("BENCHMARK: ARRANQUE DE create_app() (PROCESO NUEVO)")
+    runs = 5
+    base_env = {key: value for key, value in os.environ.items()
+                if not key.startswith('AZURE_OPENAI_') and key != 'LLM_PROVIDER'}
+    cases = [
+        ("Azure configurado", dict(base_env, **{key: os.environ[key] for key in os.environ
+                                              if key.startswith('AZURE_OPENAI_')})),
+        ("sin variables Azure", base_env),
+    ]
+    print(f"{'caso':>20} {'create_app (ms)':>16} {'openai cargado':>15} {'1er uso IA (ms)':>16}")
+    for label, env in cases:
+        boots, first_uses = [], []
+        for _ in range(runs):
+            output = subprocess.run([sys.executable, '-c', STARTUP_SNIPPET], env=env, capture_output=True,
+                                    text=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+            boot, first_use, openai_loaded = output.stdout.split()
+            boots.append(float(boot) * 1000)
+            first_uses.append(float(first_use) * 1000)
+        first_use_ms = statistics.median(first_uses)
+        first_use_text = f"{first_use_ms:.0f}" if first_use_ms == first_use_ms else "error 500 (JSON)"
+        print(f"{label:>20} {statistics.median(boots):>16.0f} {openai_loaded:>15} {first_use_text:>16}")
+
+
+BENCHMARKS = {
+    'index': bench_index,
+    'writes': bench_writes,
+    'group_commit': bench_group_commit,
+    'query': bench_query,
+    'stream': bench_stream,
+    'bulk': bench_bulk,
+    'model': bench_model,
+    'ai': bench_ai,
+    'startup': bench_startup,
+}
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        BENCHMARKS[name]()
@@ -0,0 +1,70 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+
+class FileLock:
+    """
+    Bloqueo entre procesos (fcntl.flock) sobre un archivo .lock.
+
+    - shared(): varios lectores a la vez; solo espera a los escritores.
+    - exclusive(): un único escritor; espera a lectores y escritores.
+
+    Es reentrante dentro del proceso: si ya se tiene el bloqueo exclusivo,
+    pedir cualquiera de los dos no hace nada. No es seguro entre hilos por
+    sí mismo; quien lo usa debe protegerlo con su propio lock de hilos.
+    En sistemas sin fcntl (Windows) no bloquea.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._pid = None
+        self._mode = None
+        self._depth = 0
+
+    def _ensure_open(self):
+        # Tras un fork el descriptor es compartido con el padre (y también su
+        # bloqueo), así que cada proceso abre el suyo
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+            self._mode = None
+            self._depth = 0
+
+    @contextmanager
+    def _hold(self, mode):
+        if fcntl is None:
+            yield
+            return
+
+        self._ensure_open()
+        if self._depth and (self._mode == fcntl.LOCK_EX or mode == self._mode):
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+            return
+        if self._depth:
+            raise RuntimeError("No se puede pasar de bloqueo compartido a exclusivo")
+
+        fcntl.flock(self._fd, mode)
+        self._mode = mode
+        self._depth = 1
+        try:
+            yield
+        finally:
+            self._depth = 0
+            self._mode = None
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def shared(self):
+        return self._hold(fcntl.LOCK_SH if fcntl else None)
+
+    def exclusive(self):
+        return self._hold(fcntl.LOCK_EX if fcntl else None)
@@ -0,0 +1,86 @@
+import threading
+import time
+
+
+class _PendingOperation:
+    """Mutación encolada a la espera de que su lote se persista."""
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class GroupCommitter:
+    """
+    Agrupa mutaciones concurrentes en una sola escritura durable (group commit).
+
+    Cada hilo encola su operación y queda bloqueado hasta que el lote que la
+    contiene se ha escrito en disco. Un único hilo de volcado toma hasta
+    `max_batch` operaciones, esperando como mucho `max_delay` segundos a que
+    lleguen más, y se las entrega juntas a `flush_batch`.
+
+    `flush_batch(batch)` recibe la lista de _PendingOperation y debe rellenar
+    result o error en cada una.
+    """
+
+    def __init__(self, flush_batch, max_delay=0.002, max_batch=256):
+        self.flush_batch = flush_batch
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._queue = []
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def submit(self, operation):
+        """
+        Encola una operación y espera a que su lote se persista.
+        Devuelve el resultado de la operación o relanza su error.
+        """
+        pending = _PendingOperation(operation)
+        with self._condition:
+            self._queue.append(pending)
+            self._ensure_thread()
+            self._condition.notify()
+
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _ensure_thread(self):
+        # Se comprueba en cada envío porque el hilo no sobrevive a un fork
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _next_batch(self):
+        """Espera a que haya trabajo y forma el siguiente lote."""
+        with self._condition:
+            while not self._queue:
+                self._condition.wait()
+
+            deadline = time.monotonic() + self.max_delay
+            while len(self._queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch = self._queue[:self.max_batch]
+            del self._queue[:self.max_batch]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self.flush_batch(batch)
+            except Exception as e:
+                for pending in batch:
+                    if pending.error is None:
+                        pending.error = e
+            finally:
+                for pending in batch:
+                    pending.done.set()
@@ -0,0 +1,217 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from managers.file_lock import FileLock
+
+JOBS_FILE = os.getenv('AI_JOBS_FILE', 'jobs.json')
+
+# Hilos que procesan trabajos en cada proceso
+JOB_WORKERS = int(os.getenv('AI_JOB_WORKERS', 4))
+
+# Tiempo que se conservan los trabajos terminados antes de purgarlos
+JOB_RETENTION_SECONDS = float(os.getenv('AI_JOB_RETENTION_SECONDS', 24 * 3600))
+
+JOB_STATUSES = ('queued', 'running', 'succeeded', 'failed')
+FINISHED_STATUSES = ('succeeded', 'failed')
+
+
+class JobManager:
+    """
+    Cola de trabajos en segundo plano con su estado en jobs.json.
+
+    submit() registra el trabajo como 'queued' y lo entrega a un pool de
+    JOB_WORKERS hilos, que ejecuta el handler registrado para su tipo
+    (register_handler) y guarda el resultado ('succeeded') o el error
+    ('failed'). Cada cambio de estado se persiste.
+
+    jobs.json es compartido por todos los procesos (workers de gunicorn):
+    se escribe bajo un bloqueo exclusivo (jobs.json.lock) releyendo antes lo
+    que hayan guardado los demás, siempre en un archivo temporal que se
+    renombra. Cada trabajo guarda el pid del proceso que lo ejecuta; resume()
+    reencola los que quedaron 'queued' o 'running' en un proceso que ya no
+    existe, así que sobreviven a un reinicio.
+    """
+
+    jobs_file = JOBS_FILE
+    workers = JOB_WORKERS
+    retention_seconds = JOB_RETENTION_SECONDS
+
+    _jobs = {}  # id -> trabajo de este proceso (los de otros se leen del archivo)
+    _handlers = {}
+    _executor = None
+    _executor_pid = None
+    _file_lock = FileLock(JOBS_FILE + '.lock')
+    _lock = threading.RLock()
+
+    @classmethod
+    def configure(cls, jobs_file=JOBS_FILE, workers=JOB_WORKERS, retention_seconds=JOB_RETENTION_SECONDS):
+        """Cambia el archivo de persistencia y el pool; descarta el estado en memoria."""
+        with cls._lock:
+            if cls._executor is not None and cls._executor_pid == os.getpid():
+                cls._executor.shutdown(wait=True)
+            cls.jobs_file = jobs_file
+            cls.workers = workers
+            cls.retention_seconds = retention_seconds
+            cls._jobs = {}
+            cls._executor = None
+            cls._file_lock = FileLock(jobs_file + '.lock')
+
+    @classmethod
+    def register_handler(cls, kind, handler):
+        """Registra la función que procesa los trabajos de un tipo: handler(payload) -> resultado."""
+        cls._handlers[kind] = handler
+
+    @classmethod
+    def _read_jobs_file(cls):
+        """Lee jobs.json; un archivo ausente o ilegible cuenta como vacío."""
+        try:
+            with open(cls.jobs_file, 'r', encoding='utf-8') as f:
+                jobs = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+        return jobs if isinstance(jobs, dict) else {}
+
+    @classmethod
+    def _write_jobs_file(cls, jobs):
+        temp_path = f"{cls.jobs_file}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(jobs, f, indent=2, ensure_ascii=False)
+        os.replace(temp_path, cls.jobs_file)
+
+    @classmethod
+    def _is_expired(cls, job, now):
+        return job['status'] in FINISHED_STATUSES and now - job['finished_at'] > cls.retention_seconds
+
+    @classmethod
+    def _persist(cls, job):
+        """Guarda un trabajo en jobs.json (fusionando con el resto) y purga los caducados."""
+        with cls._lock, cls._file_lock.exclusive():
+            jobs = cls._read_jobs_file()
+            jobs[job['id']] = job
+            now = time.time()
+            expired = [job_id for job_id, stored in jobs.items() if cls._is_expired(stored, now)]
+            for job_id in expired:
+                del jobs[job_id]
+                cls._jobs.pop(job_id, None)
+            cls._write_jobs_file(jobs)
+
+    @classmethod
+    def _get_executor(cls):
+        with cls._lock:
+            # Tras un fork los hilos del pool no existen en el hijo
+            if cls._executor is None or cls._executor_pid != os.getpid():
+                cls._executor = ThreadPoolExecutor(max_workers=cls.workers, thread_name_prefix='ai-job')
+                cls._executor_pid = os.getpid()
+            return cls._executor
+
+    @classmethod
+    def submit(cls, kind, payload):
+        """
+        Encola un trabajo y devuelve una copia de su estado ('queued').
+
+        Raises:
+            ValueError: Si no hay handler para ese tipo de trabajo
+        """
+        if kind not in cls._handlers:
+            raise ValueError(f"Tipo de trabajo desconocido: {kind}")
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": "queued",
+            "payload": payload,
+            "result": None,
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "owner": os.getpid()
+        }
+        with cls._lock:
+            cls._jobs[job['id']] = job
+            cls._persist(job)
+            snapshot = dict(job)
+        cls._get_executor().submit(cls._run, job['id'])
+        return snapshot
+
+    @classmethod
+    def _update(cls, job_id, **fields):
+        with cls._lock:
+            job = cls._jobs[job_id]
+            job.update(fields)
+            cls._persist(job)
+
+    @classmethod
+    def _run(cls, job_id):
+        """Ejecuta un trabajo en un hilo del pool y guarda su resultado o su error."""
+        with cls._lock:
+            job = cls._jobs[job_id]
+            kind, payload = job['kind'], job['payload']
+        cls._update(job_id, status='running', started_at=time.time())
+        try:
+            result = cls._handlers[kind](payload)
+        except Exception as e:
+            cls._update(job_id, status='failed', error=str(e), finished_at=time.time())
+        else:
+            cls._update(job_id, status='succeeded', result=result, finished_at=time.time())
+
+    @classmethod
+    def get_job(cls, job_id):
+        """Devuelve una copia del trabajo (de cualquier proceso) o None si no existe."""
+        with cls._lock:
+            job = cls._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        with cls._file_lock.shared():
+            return cls._read_jobs_file().get(job_id)
+
+    @staticmethod
+    def _process_alive(pid):
+        if not pid or pid == os.getpid():
+            # Mismo pid que un proceso anterior (p. ej. pid 1 en un contenedor)
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    @classmethod
+    def resume(cls):
+        """
+        Reencola los trabajos pendientes cuyo proceso ya no existe (p. ej.
+        tras un reinicio). Devuelve cuántos se han reencolado.
+        """
+        if not os.path.exists(cls.jobs_file):
+            return 0
+
+        resumed = []
+        with cls._lock, cls._file_lock.exclusive():
+            jobs = cls._read_jobs_file()
+            for job in jobs.values():
+                if (job['status'] in FINISHED_STATUSES or job['id'] in cls._jobs
+                        or job['kind'] not in cls._handlers or cls._process_alive(job.get('owner'))):
+                    continue
+                job.update(status='queued', started_at=None, owner=os.getpid())
+                cls._jobs[job['id']] = job
+                resumed.append(job['id'])
+            if resumed:
+                cls._write_jobs_file(jobs)
+
+        for job_id in resumed:
+            cls._get_executor().submit(cls._run, job_id)
+        return len(resumed)
+
+    @classmethod
+    def wait_for_jobs(cls):
+        """Espera a que terminen los trabajos encolados en este proceso (tests, apagado)."""
+        with cls._lock:
+            executor = cls._executor if cls._executor_pid == os.getpid() else None
+            cls._executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,147 @@
+import bisect
+import math
+from models.task import VALID_PRIORITIES
+
+INDEXED_FIELDS = ('status', 'priority', 'assigned_to', 'category')
+
+# Campos por los que se puede ordenar (con un índice ordenado en cada sentido)
+SORTABLE_FIELDS = ('effort_hours', 'priority')
+
+# Con más cambios pendientes que tamaño / SORTED_REBUILD_RATIO, reordenar
+# todo de una vez es más barato que insertarlos uno a uno
+SORTED_REBUILD_RATIO = 32
+
+
+def sort_value(task, field):
+    """Valor numérico por el que se ordena una tarea (la prioridad, por su gravedad)."""
+    value = getattr(task, field)
+    if field == 'priority':
+        return VALID_PRIORITIES.index(value) if value in VALID_PRIORITIES else -1
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return -1
+    return value if math.isfinite(value) else -1
+
+
+class SortedIndex:
+    """
+    Ids ordenados por una clave (valor, posición de alta), en dos listas
+    paralelas (keys e ids) mantenidas con bisect.
+
+    Las altas, cambios y bajas solo se anotan (O(1) al escribir) y se
+    incorporan en la siguiente consulta: con bisect si son pocos, o
+    reordenando todo si son muchos (p. ej. tras una recarga o un alta
+    masiva).
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.ids = []
+        self._key_of = {}  # id -> clave ya incorporada a las listas
+        self._pending = {}  # id -> clave nueva (None = quitar)
+
+    def __len__(self):
+        self.merge()
+        return len(self.ids)
+
+    def set(self, task_id, key):
+        self._pending[task_id] = key
+
+    def discard(self, task_id):
+        self._pending[task_id] = None
+
+    def key(self, task_id):
+        """Clave de orden de un id ya incorporado."""
+        return self._key_of[task_id]
+
+    def merge(self):
+        """Incorpora los cambios pendientes a las listas ordenadas."""
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        if len(pending) * SORTED_REBUILD_RATIO > len(self.keys):
+            for task_id, key in pending.items():
+                if key is None:
+                    self._key_of.pop(task_id, None)
+                else:
+                    self._key_of[task_id] = key
+            entries = sorted((key, task_id) for task_id, key in self._key_of.items())
+            self.keys = [key for key, _ in entries]
+            self.ids = [task_id for _, task_id in entries]
+            return
+
+        for task_id, key in pending.items():
+            old_key = self._key_of.pop(task_id, None)
+            if old_key is not None:
+                i = bisect.bisect_left(self.keys, old_key)
+                del self.keys[i], self.ids[i]
+            if key is not None:
+                i = bisect.bisect_left(self.keys, key)
+                self.keys.insert(i, key)
+                self.ids.insert(i, task_id)
+                self._key_of[task_id] = key
+
+
+class TaskIndexes:
+    """
+    Índices secundarios del almacén en memoria.
+
+    Para cada campo de INDEXED_FIELDS guarda valor -> {id: None} (un dict
+    usado como conjunto ordenado), de modo que un filtro solo recorre las
+    tareas que coinciden. Además asigna a cada id una posición creciente
+    según el orden de alta, que sirve como orden por defecto y desempate,
+    y mantiene un SortedIndex por cada campo de SORTABLE_FIELDS y sentido.
+    """
+
+    def __init__(self):
+        self.by_field = {field: {} for field in INDEXED_FIELDS}
+        self.positions = {}
+        self.sorted = {(field, descending): SortedIndex()
+                       for field in SORTABLE_FIELDS for descending in (False, True)}
+        self._next_position = 0
+
+    def rebuild(self, tasks):
+        """Reconstruye todos los índices a partir de las tareas en orden."""
+        self.__init__()
+        for task in tasks:
+            self.add(task)
+
+    def add(self, task):
+        if task.id not in self.positions:
+            self.positions[task.id] = self._next_position
+            self._next_position += 1
+        for field, buckets in self.by_field.items():
+            buckets.setdefault(getattr(task, field), {})[task.id] = None
+        position = self.positions[task.id]
+        for (field, descending), index in self.sorted.items():
+            value = sort_value(task, field)
+            index.set(task.id, (-value if descending else value, position))
+
+    def remove(self, task, keep_position=False):
+        for field, buckets in self.by_field.items():
+            value = getattr(task, field)
+            bucket = buckets.get(value)
+            if bucket is not None:
+                bucket.pop(task.id, None)
+                if not bucket:
+                    del buckets[value]
+        if not keep_position:
+            self.positions.pop(task.id, None)
+            for index in self.sorted.values():
+                index.discard(task.id)
+
+    def replace(self, old_task, new_task):
+        """Actualiza los índices de una tarea modificada conservando su posición."""
+        self.remove(old_task, keep_position=True)
+        self.add(new_task)
+
+    def lookup(self, field, value):
+        """Ids (dict ordenado) de las tareas con field == value."""
+        return self.by_field[field].get(value, {})
+
+    def sorted_by(self, field, descending=False):
+        """SortedIndex de un campo de SORTABLE_FIELDS, con los cambios ya incorporados."""
+        index = self.sorted[(field, descending)]
+        index.merge()
+        return index
@@ -0,0 +1,108 @@
+import json
+import os
+
+
+class TaskJournal:
+    """
+    Registro de mutaciones (append-only) que acompaña a tasks.json.
+
+    Cada línea es un registro JSON independiente:
+        {"op": "create" | "update", "task": {...}}
+        {"op": "delete", "id": "..."}
+
+    El journal recuerda hasta qué byte se ha aplicado (offset), de modo que
+    solo hay que leer la cola nueva en cada refresco.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+
+    def size(self):
+        """Tamaño actual del archivo en bytes (0 si no existe)."""
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def has_unread(self):
+        """Indica si hay bytes escritos después del offset aplicado."""
+        return self.size() > self.offset
+
+    def read_new(self):
+        """
+        Lee los registros completos escritos después del offset y lo avanza.
+        Una última línea incompleta (escritura interrumpida) se ignora.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return []
+
+        end = chunk.rfind(b'\n') + 1
+        records = []
+        consumed = 0
+        for line in chunk[:end].splitlines(keepends=True):
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                print(f"Registro corrupto en {self.path}, se ignora el resto: {e}")
+                break
+            consumed += len(line)
+
+        self.offset += consumed
+        return records
+
+    def append(self, records):
+        """
+        Añade registros al final del journal con una única escritura
+        y la fuerza a disco. Devuelve el número de bytes escritos.
+        """
+        payload = b''.join(
+            json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+            for record in records
+        )
+
+        # Restos de una escritura interrumpida: se descartan antes de añadir
+        if self.size() > self.offset:
+            os.truncate(self.path, self.offset)
+
+        try:
+            with open(self.path, 'ab') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError:
+            # No dejar en disco registros de un lote que ha fallado
+            if self.size() > self.offset:
+                os.truncate(self.path, self.offset)
+            raise
+
+        self.offset += len(payload)
+        return len(payload)
+
+    def drop_prefix(self, length):
+        """
+        Elimina los primeros `length` bytes (ya volcados al snapshot)
+        conservando la cola, reemplazando el archivo de forma atómica.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(length)
+                tail = f.read()
+        except FileNotFoundError:
+            tail = b''
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(tail)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.offset = max(self.offset - length, 0)
+
+    def clear(self):
+        """Vacía el journal."""
+        self.drop_prefix(self.size())
@@ -1,43 +1,772 @@
+import base64
+import bisect
+import hashlib
+import itertools
 import json
+import math
 import os
-from models.task import Task
+import threading
+from managers.file_lock import FileLock
+from managers.group_commit import GroupCommitter
+from managers.task_indexes import TaskIndexes, SORTABLE_FIELDS
+from managers.task_journal import TaskJournal
+from models.task import Task, TASK_FIELDS
 
 TASKS_FILE = 'tasks.json'
 
+# Tamaño del journal a partir del cual se compacta en segundo plano
+JOURNAL_MAX_BYTES = int(os.getenv('TASKS_JOURNAL_MAX_BYTES', 1024 * 1024))
+
+# Group commit: espera máxima para agrupar escrituras y tamaño máximo del lote
+COMMIT_MAX_DELAY_MS = float(os.getenv('TASKS_COMMIT_MAX_DELAY_MS', 2))
+COMMIT_MAX_BATCH = int(os.getenv('TASKS_COMMIT_MAX_BATCH', 256))
+
+
+class TaskStorageError(Exception):
+    """Error al persistir las tareas en disco."""
+
+
+class TaskPreconditionError(Exception):
+    """La tarea cambió desde que el cliente la leyó (If-Match no coincide)."""
+
+
 class TaskManager:
     """
     Gestor de persistencia para las tareas.
     Se encarga de leer y escribir en el archivo JSON.
+
+    El almacenamiento se compone de:
+    - tasks.json: snapshot compactado con la lista de tareas.
+    - tasks.json.journal: registro append-only con las mutaciones posteriores
+      al snapshot (una línea JSON por create/update/delete).
+
+    Cada escritura solo añade su registro al journal (coste O(tamaño del
+    registro)); cuando el journal supera JOURNAL_MAX_BYTES se vuelca a un
+    nuevo snapshot en segundo plano.
+
+    Las mutaciones (add/update/delete) no escriben directamente: se encolan
+    en un GroupCommitter que las aplica en orden y las persiste por lotes
+    con una única escritura + fsync. Cada llamada vuelve cuando su lote ya
+    está en disco, y al aplicarse todas en el mismo hilo no hay carreras
+    de lectura-modificación-escritura entre peticiones.
+
+    Para varios procesos (p. ej. workers de gunicorn) se usa además un
+    bloqueo de archivo (tasks.json.lock): exclusivo para escribir/compactar,
+    en el que antes de aplicar un lote se incorporan los registros que hayan
+    escrito otros procesos; y compartido para leer, de modo que los lectores
+    no se esperan entre sí. El snapshot se escribe siempre en un archivo
+    temporal que se renombra sobre tasks.json, así que nunca queda a medias.
+
+    En memoria se mantiene un diccionario indexado por Task.id (en orden de
+    inserción) con el snapshot más el journal ya aplicados. Solo se vuelve a
+    leer el disco cuando cambia la firma del snapshot o crece el journal,
+    y buscar, actualizar o eliminar una tarea cuesta O(1). También se
+    mantienen índices secundarios (TaskIndexes) por status, priority,
+    assigned_to y category para filtrar sin recorrer todo el almacén, y
+    listas ordenadas por los campos de SORTABLE_FIELDS para paginar un
+    orden sin ordenar todas las candidatas en cada consulta.
+
+    Hay dos locks de hilos. _write_lock ordena a los que escriben (volcado
+    de lotes, refrescos desde disco, compactación) y se mantiene durante
+    la E/S. _lock solo protege la memoria: se toma para aplicar los cambios
+    ya escritos y para leer, nunca mientras se espera al disco, así que los
+    lectores no esperan a un fsync. Orden: _write_lock → bloqueo de
+    archivo → _lock.
     """
 
-    @staticmethod
-    def load_tasks():
+    tasks_file = TASKS_FILE
+    journal_max_bytes = JOURNAL_MAX_BYTES
+
+    # Caché residente del almacén: id -> Task
+    _tasks_by_id = None
+    _indexes = TaskIndexes()
+    _etags = {}  # id -> ETag calculado a partir del contenido (perezoso)
+    _ordered_ids = (None, [], [])  # (versión, ids en orden de alta, sus posiciones)
+    _snapshot_signature = None
+    _revision = (0, 0, 0, 0)  # (firma del snapshot, offset del journal) de lo que hay en memoria
+    _journal = TaskJournal(TASKS_FILE + '.journal')
+    _file_lock = FileLock(TASKS_FILE + '.lock')
+    _version = 0
+    _lock = threading.RLock()
+    _write_lock = threading.RLock()
+    _writing = False  # este proceso está escribiendo en disco (con el bloqueo exclusivo)
+    _compaction_thread = None
+    _committer = None
+    _staged = []  # registros del lote en curso: (registro, Task o None si es un borrado)
+    _staged_tasks = {}  # id -> estado de la tarea tras el lote en curso (None = borrada)
+    _listeners = []
+
+    @classmethod
+    def configure(cls, tasks_file=TASKS_FILE, journal_max_bytes=JOURNAL_MAX_BYTES):
         """
-        Lee las tareas desde tasks.json y devuelve una lista de objetos Task.
-        Si el archivo no existe o está vacío, devuelve una lista vacía.
+        Cambia el archivo de persistencia y descarta la caché en memoria.
         """
-        if not os.path.exists(TASKS_FILE):
+        cls.wait_for_compaction()
+        with cls._write_lock, cls._lock:
+            cls.tasks_file = tasks_file
+            cls.journal_max_bytes = journal_max_bytes
+            cls._journal = TaskJournal(tasks_file + '.journal')
+            cls._file_lock = FileLock(tasks_file + '.lock')
+            cls.invalidate_cache()
+
+    @classmethod
+    def invalidate_cache(cls):
+        """Descarta la copia en memoria; la próxima lectura irá al disco."""
+        with cls._lock:
+            cls._tasks_by_id = None
+            cls._snapshot_signature = None
+
+    @classmethod
+    def get_version(cls):
+        """Devuelve el contador de versión del almacén (cambia con cada recarga o escritura)."""
+        return cls._version
+
+    @classmethod
+    def _file_signature(cls):
+        """Firma barata del snapshot: (inodo, mtime en ns, tamaño) o None si no existe."""
+        try:
+            stat = os.stat(cls.tasks_file)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    @classmethod
+    def _temp_path(cls, suffix):
+        """Ruta temporal única por proceso junto a tasks.json."""
+        return f"{cls.tasks_file}.{os.getpid()}.{suffix}.tmp"
+
+    @classmethod
+    def _read_tasks_file(cls):
+        """
+        Lee y parsea el snapshot tasks.json completo.
+        Un snapshot ilegible no se trata como vacío (se perderían todas las
+        tareas en la siguiente compactación): se lanza TaskStorageError.
+        """
+        if not os.path.exists(cls.tasks_file):
             return []
 
         try:
-            with open(TASKS_FILE, 'r', encoding='utf-8') as f:
+            with open(cls.tasks_file, 'r', encoding='utf-8') as f:
                 content = f.read().strip()
                 if not content:
                     return []
                 data = json.loads(content)
-                return [Task.from_dict(item) for item in data]
+                return Task.from_dicts(data)
         except (json.JSONDecodeError, IOError) as e:
-            print(f"Error al leer tasks.json: {e}")
-            return []
+            raise TaskStorageError(f"Error al leer tasks.json: {e}")
 
     @staticmethod
-    def save_tasks(tasks):
+    def _dump_snapshot(data, path):
+        """Escribe una lista de diccionarios en `path` y la fuerza a disco."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _record_id(record):
+        """Id de la tarea a la que se refiere un registro del journal."""
+        return record['id'] if record['op'] == 'delete' else record['task']['id']
+
+    @classmethod
+    def _apply_record(cls, record, task=None):
+        """
+        Aplica un registro del journal sobre el índice en memoria.
+        Devuelve el cambio (tarea anterior, tarea nueva) para los listeners,
+        con None como tarea nueva en un borrado, o None si no cambió nada.
+        """
+        cls._etags.pop(cls._record_id(record), None)
+        cls._version += 1
+        if record['op'] == 'delete':
+            old_task = cls._tasks_by_id.pop(record['id'], None)
+            if old_task is None:
+                return None
+            cls._indexes.remove(old_task)
+            return old_task, None
+
+        task = task or Task.from_dict(record['task'])
+        old_task = cls._tasks_by_id.get(task.id)
+        cls._tasks_by_id[task.id] = task
+        if old_task is not None:
+            cls._indexes.replace(old_task, task)
+        else:
+            cls._indexes.add(task)
+        return old_task, task
+
+    @classmethod
+    def _notify_listeners(cls, changes):
+        """
+        Avisa a los listeners de cambios que ya están en disco. Un listener
+        que falla no afecta a la escritura ni al resto: el error se registra
+        y se sigue con el siguiente cambio.
+        """
+        for listener in cls._listeners:
+            for change in changes:
+                if change is None:
+                    continue
+                old_task, task = change
+                try:
+                    if task is None:
+                        listener.remove(old_task)
+                    elif old_task is None:
+                        listener.add(task)
+                    else:
+                        listener.replace(old_task, task)
+                except Exception as e:
+                    print(f"Error en el listener {type(listener).__name__} de TaskManager: {e}")
+
+    @classmethod
+    def _set_tasks(cls, tasks):
+        """Reemplaza el contenido en memoria y reconstruye los índices."""
+        cls._tasks_by_id = {task.id: task for task in tasks}
+        cls._indexes.rebuild(cls._tasks_by_id.values())
+        cls._etags = {}
+
+    @classmethod
+    def _publish_revision(cls):
+        """Fija la revisión que corresponde a la memoria. Se llama con _lock tomado."""
+        cls._revision = (*(cls._snapshot_signature or (0, 0, 0)), cls._journal.offset)
+
+    @classmethod
+    def _rebuild_listeners(cls, listeners=None):
+        """Rellena los listeners con las tareas actuales; sus errores se registran."""
+        for listener in cls._listeners if listeners is None else listeners:
+            try:
+                listener.rebuild(cls._tasks_by_id.values())
+            except Exception as e:
+                print(f"Error en el listener {type(listener).__name__} de TaskManager: {e}")
+
+    @classmethod
+    def add_listener(cls, listener):
+        """
+        Registra un índice externo que se mantiene al día con el almacén.
+        Recibe las mismas llamadas que TaskIndexes (rebuild, add, replace,
+        remove) con cada cambio ya escrito en disco, tanto de este proceso
+        como los leídos del journal de otros, dentro del lock de escritura:
+        deben ser rápidas. Sus errores se registran y no hacen fallar la
+        escritura. Al registrarse recibe un rebuild con las tareas actuales.
+        """
+        with cls._write_lock:
+            cls._get_index()
+            cls._listeners.append(listener)
+            cls._rebuild_listeners([listener])
+
+    @classmethod
+    def remove_listener(cls, listener):
+        with cls._write_lock:
+            cls._listeners.remove(listener)
+
+    @classmethod
+    def _is_current(cls):
+        """Comprueba (solo con stat) si la copia en memoria refleja el disco."""
+        return (cls._tasks_by_id is not None
+                and cls._file_signature() == cls._snapshot_signature
+                and cls._journal.size() == cls._journal.offset)
+
+    @classmethod
+    def _refresh(cls, force_reload=False):
+        """
+        Sincroniza la memoria con el disco. Si la firma del snapshot cambió
+        (o se fuerza la recarga) se relee el snapshot y se reproduce el
+        journal completo; si no, solo se aplican los registros nuevos.
+        Debe llamarse con _write_lock y el bloqueo de archivo tomados; la
+        lectura del disco se hace fuera de _lock.
+        """
+        signature = cls._file_signature()
+        journal = cls._journal
+        reloaded = (force_reload or cls._tasks_by_id is None
+                    or signature != cls._snapshot_signature
+                    or journal.size() < journal.offset)
+        tasks = None
+        if reloaded:
+            tasks = cls._read_tasks_file()
+            journal.offset = 0
+        records = journal.read_new() if journal.has_unread() else []
+        if not reloaded and not records:
+            return
+
+        with cls._lock:
+            if reloaded:
+                cls._set_tasks(tasks)
+                cls._snapshot_signature = signature
+                cls._version += 1
+            changes = [cls._apply_record(record) for record in records]
+            cls._publish_revision()
+
+        # Tras una recarga completa los listeners se rellenan de cero
+        if reloaded:
+            cls._rebuild_listeners()
+        else:
+            cls._notify_listeners(changes)
+
+    @classmethod
+    def _get_index(cls, force_reload=False):
+        """
+        Devuelve el índice id -> Task, leyendo del disco (con bloqueo
+        compartido) solo si ha cambiado desde la última vez.
+
+        Mientras este proceso escribe, la memoria es la última versión
+        confirmada y se sirve sin esperar a la escritura. Se llama sin _lock
+        tomado; el diccionario devuelto se lee con _lock.
+        """
+        if force_reload or cls._tasks_by_id is None or not (cls._writing or cls._is_current()):
+            with cls._write_lock, cls._file_lock.shared():
+                cls._refresh(force_reload)
+        return cls._tasks_by_id
+
+    @classmethod
+    def _submit(cls, operation):
+        """Encola una mutación en el group commit y espera a que se persista."""
+        if cls._committer is None:
+            with cls._lock:
+                if cls._committer is None:
+                    cls._committer = GroupCommitter(
+                        cls._flush_batch,
+                        max_delay=COMMIT_MAX_DELAY_MS / 1000,
+                        max_batch=COMMIT_MAX_BATCH
+                    )
+        return cls._committer.submit(operation)
+
+    @classmethod
+    def _stage(cls, record, task=None):
+        """
+        Deja un registro pendiente de escribir en el lote actual. La memoria
+        no se toca hasta que el lote está en disco; mientras, las operaciones
+        siguientes del lote ven el cambio a través de _staged_task.
+        """
+        cls._staged.append((record, task))
+        cls._staged_tasks[cls._record_id(record)] = task
+
+    @classmethod
+    def _staged_task(cls, task_id):
+        """Estado de una tarea visto desde el lote en curso (None si no existe)."""
+        if task_id in cls._staged_tasks:
+            return cls._staged_tasks[task_id]
+        return cls._tasks_by_id.get(task_id)
+
+    @classmethod
+    def _discard_staged(cls, mark):
+        """Descarta los registros preparados a partir de la posición `mark`."""
+        del cls._staged[mark:]
+        cls._staged_tasks = {cls._record_id(record): task for record, task in cls._staged}
+
+    @classmethod
+    def _flush_batch(cls, batch):
+        """
+        Ejecuta en orden las operaciones de un lote y escribe todos sus
+        registros en el journal con una sola escritura durable; solo
+        entonces se aplican en memoria y se avisa a los listeners.
+
+        Si una operación falla, solo ella recibe el error y se descartan los
+        registros que llegó a preparar. Si falla la escritura, la memoria
+        sigue como estaba y todas las operaciones del lote reciben el error.
+        """
+        with cls._write_lock, cls._file_lock.exclusive():
+            # Incorporar lo que hayan escrito otros procesos antes de aplicar el lote
+            cls._refresh()
+            cls._staged, cls._staged_tasks = [], {}
+            try:
+                for pending in batch:
+                    mark = len(cls._staged)
+                    try:
+                        pending.result = pending.operation()
+                    except Exception as e:
+                        pending.error = e
+                        cls._discard_staged(mark)
+                staged = cls._staged
+            finally:
+                cls._staged, cls._staged_tasks = [], {}
+
+            if not staged:
+                return
+            cls._writing = True
+            try:
+                cls._journal.append([record for record, _ in staged])
+                with cls._lock:
+                    changes = [cls._apply_record(record, task) for record, task in staged]
+                    cls._publish_revision()
+            except IOError as e:
+                raise TaskStorageError(f"Error al guardar el journal de tareas: {e}")
+            finally:
+                cls._writing = False
+            cls._notify_listeners(changes)
+            cls._maybe_compact()
+
+    @classmethod
+    def load_tasks(cls, force_reload=False):
+        """
+        Lee las tareas desde tasks.json y devuelve una lista de objetos Task.
+        Si el archivo no existe o está vacío, devuelve una lista vacía.
+
+        La lista se sirve desde la caché en memoria mientras la firma del
+        archivo no cambie. Con force_reload=True se fuerza la relectura.
+        """
+        tasks = cls._get_index(force_reload)
+        with cls._lock:
+            return list(tasks.values())
+
+    @classmethod
+    def get_task(cls, task_id):
+        """Devuelve la tarea con ese id o None si no existe."""
+        return cls._get_index().get(task_id)
+
+    @classmethod
+    def get_revision(cls):
+        """
+        Identificador del estado actual del almacén. Se deriva de lo que hay
+        en disco (firma del snapshot + posición en el journal), así que es el
+        mismo en todos los procesos que ven el mismo estado.
+        """
+        cls._get_index()
+        return '-'.join(str(part) for part in cls._revision)
+
+    @classmethod
+    def get_task_with_etag(cls, task_id):
+        """
+        Devuelve (tarea, ETag) leídos juntos, de modo que el ETag siempre
+        corresponde a la tarea devuelta, o (None, None) si no existe.
+        """
+        tasks = cls._get_index()
+        with cls._lock:
+            task = tasks.get(task_id)
+            return (None, None) if task is None else (task, cls._task_etag(task))
+
+    @staticmethod
+    def compute_etag(task):
+        """Hash del contenido de una tarea, usado como ETag fuerte."""
+        content = json.dumps(task.to_dict(), sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _task_etag(cls, task):
+        """ETag de una tarea del almacén, cacheado hasta su próxima modificación."""
+        etag = cls._etags.get(task.id)
+        if etag is None:
+            etag = cls._etags[task.id] = cls.compute_etag(task)
+        return etag
+
+    @classmethod
+    def _check_etag(cls, task_id, expected_etags):
+        """Lanza TaskPreconditionError si la tarea no tiene uno de los ETags esperados."""
+        if expected_etags is None:
+            return
+        task = cls._staged_task(task_id)
+        if task is None:
+            return
+        # Una tarea ya modificada en este lote no tiene su ETag en la caché
+        etag = cls.compute_etag(task) if task_id in cls._staged_tasks else cls._task_etag(task)
+        if etag not in expected_etags:
+            raise TaskPreconditionError("La tarea ha cambiado desde que se leyó (ETag no coincide)")
+
+    @classmethod
+    def query_tasks(cls, filters=None, sort=None, descending=False, limit=None, cursor=None):
+        """
+        Devuelve una página de tareas filtradas y ordenadas usando los índices.
+
+        Args:
+            filters: dict campo -> valor (solo campos de INDEXED_FIELDS)
+            sort: None (orden de alta) o uno de SORTABLE_FIELDS
+            descending: orden descendente para `sort`
+            limit: tamaño máximo de la página (None = sin límite)
+            cursor: cursor opaco devuelto por la página anterior
+
+        Returns:
+            Tupla (lista de Task, cursor de la siguiente página o None)
+
+        Raises:
+            ValueError: Si el cursor no es válido para esta consulta
+        """
+        cls._get_index()
+        after = cls._decode_cursor(cursor, sort, descending) if cursor else None
+        with cls._lock:
+            if sort is None:
+                candidates, keys = cls._matching_ids(filters or {})
+                start = bisect.bisect_right(keys, after) if cursor else 0
+                entries = ((keys[i], candidates[i]) for i in range(start, len(candidates)))
+            else:
+                entries = cls._sorted_entries(filters or {}, sort, descending, after, limit)
+
+            entries = list(itertools.islice(entries, None if limit is None else limit + 1))
+            page = [cls._tasks_by_id[task_id] for _, task_id in entries[:limit]]
+            next_cursor = None
+            if limit is not None and len(entries) > limit and page:
+                next_cursor = cls._encode_cursor(entries[limit - 1][0], sort, descending)
+            return page, next_cursor
+
+    @classmethod
+    def _matching_ids(cls, filters):
+        """
+        Ids que cumplen todos los filtros en orden de alta, junto con sus
+        posiciones (que son la clave de orden por defecto).
+        """
+        positions = cls._indexes.positions
+        if not filters:
+            # Sin filtros: lista ordenada cacheada mientras no cambie el almacén
+            version, ids, id_positions = cls._ordered_ids
+            if version != cls._version:
+                ids = list(cls._tasks_by_id)
+                id_positions = [positions[task_id] for task_id in ids]
+                cls._ordered_ids = (cls._version, ids, id_positions)
+            return ids, id_positions
+
+        # Se recorre el índice más pequeño y se comprueban los demás
+        buckets = sorted((cls._indexes.lookup(field, value) for field, value in filters.items()), key=len)
+        smallest, others = buckets[0], buckets[1:]
+        matches = [task_id for task_id in smallest if all(task_id in other for other in others)]
+        matches.sort(key=positions.__getitem__)
+        return matches, [positions[task_id] for task_id in matches]
+
+    @classmethod
+    def _sorted_entries(cls, filters, sort, descending, after, limit):
+        """
+        (clave, id) de las tareas que cumplen los filtros, en el orden del
+        índice ordenado de `sort` y a partir de la clave `after`.
+
+        Si los filtros dejan pocas tareas se ordenan solo esas; si no, se
+        recorre el índice ordenado desde el cursor comprobando los filtros,
+        que para una página cuesta unas limit * total / coincidencias visitas.
+        """
+        index = cls._indexes.sorted_by(sort, descending)
+        buckets = sorted((cls._indexes.lookup(field, value) for field, value in filters.items()), key=len)
+        total = len(index)
+        if buckets and len(buckets[0]) ** 2 < (limit or total) * total:
+            matches, _ = cls._matching_ids(filters)
+            ids = sorted(matches, key=index.key)
+            keys = [index.key(task_id) for task_id in ids]
+        else:
+            keys, ids = index.keys, index.ids
+
+        start = bisect.bisect_right(keys, after) if after is not None else 0
+        return ((keys[i], ids[i]) for i in range(start, len(ids))
+                if all(ids[i] in bucket for bucket in buckets))
+
+    @staticmethod
+    def _encode_cursor(key, sort, descending):
+        payload = json.dumps({"key": key, "sort": sort, "desc": descending})
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def _decode_cursor(cursor, sort, descending):
+        """
+        Clave a partir de la que sigue la página: la posición de alta o,
+        con sort, la clave (valor, posición) del índice ordenado.
+
+        Raises:
+            ValueError: Si el cursor no es válido o no corresponde a este orden
+        """
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            key = payload["key"]
+        except (ValueError, TypeError, KeyError):
+            raise ValueError("Cursor inválido")
+        if payload.get("sort") != sort or payload.get("desc") != descending:
+            raise ValueError("El cursor no corresponde a este orden")
+
+        def is_position(value):
+            return isinstance(value, int) and not isinstance(value, bool)
+
+        if sort is None:
+            if not is_position(key):
+                raise ValueError("Cursor inválido")
+            return key
+        if (not isinstance(key, list) or len(key) != 2 or not is_position(key[1])
+                or not (is_position(key[0]) or isinstance(key[0], float) and math.isfinite(key[0]))):
+            raise ValueError("Cursor inválido")
+        return tuple(key)
+
+    @classmethod
+    def _stage_create(cls, task):
+        cls._stage({"op": "create", "task": task.to_dict()}, task)
+        return task
+
+    @classmethod
+    def _stage_update(cls, task_id, data):
+        """Prepara la actualización de una tarea; devuelve None si no existe."""
+        current = cls._staged_task(task_id)
+        if current is None:
+            return None
+
+        fields = current.to_dict()
+        # Campos obligatorios
+        for field in ('title', 'description', 'priority', 'effort_hours', 'status', 'assigned_to'):
+            fields[field] = data[field]
+        # Campos opcionales (Entregable 2)
+        for field in ('category', 'risk_analysis', 'risk_mitigation'):
+            if field in data:
+                fields[field] = data[field]
+
+        task = Task.from_dict(fields)
+        cls._stage({"op": "update", "task": task.to_dict()}, task)
+        return task
+
+    @classmethod
+    def _stage_patch(cls, task_id, fields):
+        """Prepara la modificación de algunos campos; devuelve None si la tarea no existe."""
+        current = cls._staged_task(task_id)
+        if current is None:
+            return None
+
+        data = current.to_dict()
+        data.update((field, value) for field, value in fields.items() if field in TASK_FIELDS and field != 'id')
+        task = Task.from_dict(data)
+        cls._stage({"op": "update", "task": task.to_dict()}, task)
+        return task
+
+    @classmethod
+    def _stage_delete(cls, task_id):
+        """Prepara el borrado de una tarea; devuelve False si no existe."""
+        if cls._staged_task(task_id) is None:
+            return False
+        cls._stage({"op": "delete", "id": task_id})
+        return True
+
+    @classmethod
+    def add_task(cls, task):
+        """Añade una tarea nueva y la registra en el journal."""
+        return cls._submit(lambda: cls._stage_create(task))
+
+    @classmethod
+    def update_task(cls, task_id, data, expected_etags=None):
+        """
+        Actualiza una tarea existente con datos ya validados.
+        Los campos opcionales solo se modifican si vienen en data.
+        Devuelve la tarea actualizada o None si no existe.
+
+        Con expected_etags (If-Match) la comprobación se hace de forma
+        atómica junto a la escritura y lanza TaskPreconditionError si la
+        tarea cambió.
+        """
+        def operation():
+            cls._check_etag(task_id, expected_etags)
+            return cls._stage_update(task_id, data)
+        return cls._submit(operation)
+
+    @classmethod
+    def patch_task(cls, task_id, fields):
+        """
+        Modifica solo los campos indicados de una tarea (p. ej. los que
+        genera la IA), leyendo su estado actual dentro de la misma escritura.
+        Devuelve la tarea actualizada o None si no existe.
+        """
+        return cls._submit(lambda: cls._stage_patch(task_id, fields))
+
+    @classmethod
+    def delete_task(cls, task_id, expected_etags=None):
+        """Elimina una tarea. Devuelve True si existía. Acepta expected_etags como update_task."""
+        def operation():
+            cls._check_etag(task_id, expected_etags)
+            return cls._stage_delete(task_id)
+        return cls._submit(operation)
+
+    @classmethod
+    def add_tasks(cls, tasks):
+        """Añade varias tareas con una única escritura en disco."""
+        return cls._submit(lambda: [cls._stage_create(task) for task in tasks])
+
+    @classmethod
+    def update_tasks(cls, updates):
+        """
+        Actualiza varias tareas con una única escritura en disco.
+        `updates` es una lista de (task_id, data); devuelve, en el mismo
+        orden, la tarea actualizada o None si no existía.
+        """
+        return cls._submit(lambda: [cls._stage_update(task_id, data) for task_id, data in updates])
+
+    @classmethod
+    def delete_tasks(cls, task_ids):
+        """
+        Elimina varias tareas con una única escritura en disco.
+        Devuelve, en el mismo orden, True/False según si existía cada una.
+        """
+        return cls._submit(lambda: [cls._stage_delete(task_id) for task_id in task_ids])
+
+    @classmethod
+    def reload(cls):
+        """Fuerza la recarga de las tareas desde disco."""
+        return cls.load_tasks(force_reload=True)
+
+    @classmethod
+    def save_tasks(cls, tasks):
         """
         Recibe una lista de objetos Task y la guarda en tasks.json.
+        Reemplaza el almacén completo: escribe un snapshot nuevo y vacía el journal.
         """
+        cls.wait_for_compaction()
+        with cls._write_lock, cls._file_lock.exclusive():
+            cls._writing = True
+            try:
+                tmp_path = cls._temp_path('snapshot')
+                cls._dump_snapshot([task.to_dict() for task in tasks], tmp_path)
+                os.replace(tmp_path, cls.tasks_file)
+                cls._journal.clear()
+            except IOError as e:
+                cls.invalidate_cache()
+                raise TaskStorageError(f"Error al guardar tasks.json: {e}")
+            finally:
+                cls._writing = False
+
+            # La copia en memoria pasa a ser lo que acabamos de escribir
+            with cls._lock:
+                cls._set_tasks(tasks)
+                cls._snapshot_signature = cls._file_signature()
+                cls._version += 1
+                cls._publish_revision()
+            cls._rebuild_listeners()
+
+    @classmethod
+    def compact(cls):
+        """
+        Vuelca el estado actual a un snapshot nuevo y recorta del journal
+        los registros ya incluidos. La escritura pesada del snapshot se hace
+        fuera de los locks para no bloquear las peticiones, y los lectores
+        no esperan en ningún momento.
+        """
+        with cls._write_lock, cls._file_lock.exclusive():
+            cls._refresh()
+            data = [task.to_dict() for task in cls._tasks_by_id.values()]
+            compacted_offset = cls._journal.offset
+            snapshot_signature = cls._snapshot_signature
+
+        tmp_path = cls._temp_path('compact')
+        cls._dump_snapshot(data, tmp_path)
+
+        with cls._write_lock, cls._file_lock.exclusive():
+            # Si el almacén se reemplazó o compactó mientras tanto (en este u
+            # otro proceso), este snapshot ya no vale
+            if (cls._snapshot_signature != snapshot_signature
+                    or cls._file_signature() != snapshot_signature):
+                os.remove(tmp_path)
+                return
+            cls._writing = True
+            try:
+                os.replace(tmp_path, cls.tasks_file)
+                cls._journal.drop_prefix(compacted_offset)
+                with cls._lock:
+                    cls._snapshot_signature = cls._file_signature()
+                    cls._publish_revision()
+            finally:
+                cls._writing = False
+
+    @classmethod
+    def _maybe_compact(cls):
+        """Lanza la compactación en segundo plano si el journal es demasiado grande."""
+        if cls._journal.offset < cls.journal_max_bytes:
+            return
+        if cls._compaction_thread and cls._compaction_thread.is_alive():
+            return
+        cls._compaction_thread = threading.Thread(target=cls._compact_in_background, daemon=True)
+        cls._compaction_thread.start()
+
+    @classmethod
+    def _compact_in_background(cls):
         try:
-            data = [task.to_dict() for task in tasks]
-            with open(TASKS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=4, ensure_ascii=False)
-        except IOError as e:
-            print(f"Error al guardar tasks.json: {e}")
+            cls.compact()
+        except (IOError, TaskStorageError) as e:
+            print(f"Error al compactar tasks.json: {e}")
+
+    @classmethod
+    def wait_for_compaction(cls):
+        """Espera a que termine la compactación en curso, si la hay."""
+        thread = cls._compaction_thread
+        if thread and thread.is_alive() and thread is not threading.current_thread():
+            thread.join()
@@ -1,10 +1,22 @@
 import uuid
 
+# Valores permitidos (también definen el orden de prioridad, de menor a mayor)
+VALID_PRIORITIES = ['baja', 'media', 'alta', 'bloqueante']
+VALID_STATUSES = ['pendiente', 'en progreso', 'en revisión', 'completada']
+
+# Campos de una tarea en el orden en que se serializan
+TASK_FIELDS = ('id', 'title', 'description', 'priority', 'effort_hours', 'status',
+               'assigned_to', 'category', 'risk_analysis', 'risk_mitigation')
+
 class Task:
     """
     Representa una tarea en el sistema.
+    Usa __slots__ para no reservar un __dict__ por instancia (menos memoria
+    y acceso más rápido con decenas de miles de tareas cargadas).
     """
-    def __init__(self, title, description, priority, effort_hours, status, assigned_to, 
+    __slots__ = TASK_FIELDS
+
+    def __init__(self, title, description, priority, effort_hours, status, assigned_to,
                  id=None, category=None, risk_analysis=None, risk_mitigation=None):
         # Generar ID único si no viene informado
         self.id = id if id else str(uuid.uuid4())
@@ -20,7 +32,11 @@ class Task:
         self.risk_mitigation = risk_mitigation
 
     def to_dict(self):
-        """Convierte el objeto Task a un diccionario."""
+        """
+        Convierte el objeto Task a un diccionario.
+        Las claves son constantes del literal, así que Python construye el
+        diccionario de una vez sin recalcular el conjunto de claves.
+        """
         return {
             "id": self.id,
             "title": self.title,
@@ -36,16 +52,26 @@ class Task:
 
     @staticmethod
     def from_dict(data):
-        """Crea una instancia de Task desde un diccionario."""
-        return Task(
-            id=data.get("id"),
-            title=data.get("title"),
-            description=data.get("description"),
-            priority=data.get("priority"),
-            effort_hours=data.get("effort_hours"),
-            status=data.get("status"),
-            assigned_to=data.get("assigned_to"),
-            category=data.get("category"),
-            risk_analysis=data.get("risk_analysis"),
-            risk_mitigation=data.get("risk_mitigation")
-        )
+        """
+        Crea una instancia de Task desde un diccionario.
+        Asigna los slots directamente, sin pasar por los argumentos de __init__.
+        """
+        task = Task.__new__(Task)
+        get = data.get
+        task.id = get("id") or str(uuid.uuid4())
+        task.title = get("title")
+        task.description = get("description")
+        task.priority = get("priority")
+        task.effort_hours = float(get("effort_hours"))
+        task.status = get("status")
+        task.assigned_to = get("assigned_to")
+        task.category = get("category")
+        task.risk_analysis = get("risk_analysis")
+        task.risk_mitigation = get("risk_mitigation")
+        return task
+
+    @staticmethod
+    def from_dicts(items):
+        """Crea una lista de Task desde una lista de diccionarios (carga masiva)."""
+        from_dict = Task.from_dict
+        return [from_dict(item) for item in items]
@@ -0,0 +1,19 @@
+from flask import Blueprint, jsonify
+from managers.job_manager import JobManager
+from services.ai_jobs import job_to_dict
+
+ai_job_bp = Blueprint('ai_job_bp', __name__, url_prefix='/ai/jobs')
+
+
+@ai_job_bp.route('/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Estado de un trabajo de IA encolado con ?async=true.
+    
+    Salida: {"id", "status" (queued|running|succeeded|failed), "operation",
+             "task_id", "result" (la tarea enriquecida), "error", tiempos}
+    """
+    job = JobManager.get_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Trabajo con ID {job_id} no encontrado"}), 404
+    return jsonify(job_to_dict(job)), 200
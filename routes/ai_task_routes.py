@@ -1,10 +1,137 @@
-from flask import Blueprint, request, jsonify
-from services.ai_service import AIService
+import json
+import math
+import threading
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from managers.job_manager import JobManager
+from services.ai_jobs import (AI_JOB_KIND, enqueue_enrichment, job_to_dict, resolve_job_task,
+                              run_enrichment_job)
+from services.ai_prompts import AUDIT_MODES
+from services.ai_service import AIService, BATCH_OPERATIONS
+from services.async_ai_service import AsyncAIService, MAX_ASYNC_CONCURRENCY
+from services.enrichment_pipeline import enrich_pipeline, has_field, persist_enrichment
+from services.llm_providers import LLMProviderError
 
 ai_task_bp = Blueprint('ai_task_bp', __name__, url_prefix='/ai/tasks')
 
-# Instancia del servicio de IA
-ai_service = AIService()
+# Máximo de tareas por petición en los endpoints batch
+MAX_BATCH_ITEMS = 1000
+
+# Campos obligatorios de cada operación (los mismos que en los endpoints individuales)
+REQUIRED_FIELDS = {
+    'describe': ['title', 'priority', 'status', 'assigned_to'],
+    'categorize': ['title'],
+    'estimate': ['title', 'description'],
+    'audit': ['title', 'description']
+}
+
+# Instancias del servicio de IA: la síncrona para los endpoints individuales
+# y la asíncrona (mismo proveedor y misma caché) para los endpoints batch.
+# Se crean en el primer uso, así importar la app no carga el SDK de openai
+# ni exige las variables de Azure (los workers que solo sirven CRUD arrancan antes)
+ai_service = None
+async_ai_service = None
+_services_lock = threading.Lock()
+
+
+def get_ai_service():
+    """Devuelve el AIService compartido, creándolo en la primera llamada."""
+    global ai_service
+    if ai_service is None:
+        with _services_lock:
+            if ai_service is None:
+                ai_service = AIService()
+    return ai_service
+
+
+def get_async_ai_service():
+    """Devuelve el AsyncAIService compartido (mismo proveedor y caché que AIService)."""
+    global async_ai_service
+    if async_ai_service is None:
+        service = get_ai_service()
+        with _services_lock:
+            if async_ai_service is None:
+                async_ai_service = AsyncAIService(cache=service.cache, provider=service.provider,
+                                                  classifier=service.classifier,
+                                                  estimator=service.estimator,
+                                                  near_duplicates=service.near_duplicates,
+                                                  usage=service.usage)
+    return async_ai_service
+
+
+# Los trabajos en segundo plano usan el mismo AIService que las rutas
+JobManager.register_handler(AI_JOB_KIND, lambda payload: run_enrichment_job(get_ai_service(), payload))
+
+
+@ai_task_bp.errorhandler(LLMProviderError)
+def handle_provider_error(error):
+    """
+    Errores del proveedor de LLM: 503 con Retry-After si es transitorio
+    (cuota agotada, proveedor caído, circuito abierto), 500 si no.
+    """
+    if not error.retryable:
+        return jsonify({"error": str(error)}), 500
+    response = jsonify({"error": str(error)})
+    response.status_code = 503
+    if error.retry_after:
+        response.headers['Retry-After'] = str(math.ceil(error.retry_after))
+    return response
+
+
+def wants_event_stream():
+    """Indica si el cliente pide la respuesta en streaming (SSE)."""
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+    best = request.accept_mimetypes.best_match(['application/json', 'text/event-stream'])
+    return best == 'text/event-stream'
+
+
+def wants_async():
+    """Indica si el cliente pide procesar la operación en segundo plano (202 + trabajo)."""
+    if request.args.get('async') in ('1', 'true'):
+        return True
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+
+def enqueue_job(operation, data, mode=None):
+    """
+    Encola la operación y responde 202 con el trabajo y su URL en Location.
+    Con "task_id" en el cuerpo se parte de la tarea guardada y el resultado
+    se escribe en ella al terminar. `mode` es el modo de la auditoría.
+    """
+    try:
+        task, task_id = resolve_job_task(data)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+
+    missing_fields = [field for field in REQUIRED_FIELDS[operation] if field not in task]
+    if missing_fields:
+        return jsonify({"error": f"Campos faltantes: {', '.join(missing_fields)}"}), 400
+
+    job = job_to_dict(enqueue_enrichment(operation, task, task_id, mode))
+    response = jsonify(job)
+    response.status_code = 202
+    response.headers['Location'] = job['status_url']
+    return response
+
+
+def event_stream(events, error_prefix):
+    """
+    Respuesta text/event-stream a partir de eventos (nombre, datos) de AIService.
+    Cada fragmento del modelo se envía en cuanto llega. Si el modelo falla a
+    mitad del stream, se envía un evento 'error' (el código HTTP ya es 200).
+    """
+    def format_event(event, data):
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    def generate():
+        try:
+            for event, data in events:
+                yield format_event(event, data)
+        except Exception as e:
+            yield format_event('error', {"error": f"{error_prefix}: {str(e)}"})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @ai_task_bp.route('/describe', methods=['POST'])
@@ -14,26 +141,37 @@ def describe_task():
     
     Entrada: Tarea con description vacía o ausente
     Salida: La misma tarea con description generada por IA
+            (con ?stream=true o Accept: text/event-stream, eventos SSE 'token'
+            a medida que se genera y un evento final 'task')
+            (con ?async=true o Prefer: respond-async, 202 con el trabajo; ver /ai/jobs/<id>)
     """
     try:
         data = request.get_json()
         if not data:
             return jsonify({"error": "Cuerpo de la petición vacío o JSON inválido"}), 400
         
+        if wants_async():
+            return enqueue_job('describe', data)
+        
         # Validar campos mínimos necesarios
         required_fields = ['title', 'priority', 'status', 'assigned_to']
         missing_fields = [field for field in required_fields if field not in data]
         if missing_fields:
             return jsonify({"error": f"Campos faltantes: {', '.join(missing_fields)}"}), 400
         
+        if wants_event_stream():
+            return event_stream(get_ai_service().stream_description(data), "Error al generar descripción")
+        
         # Generar descripción usando IA
-        generated_description = ai_service.generate_description(data)
+        generated_description = get_ai_service().generate_description(data)
         
         # Actualizar la tarea con la descripción generada
         data['description'] = generated_description
         
         return jsonify(data), 200
         
+    except LLMProviderError:
+        raise
     except Exception as e:
         return jsonify({"error": f"Error al generar descripción: {str(e)}"}), 500
 
@@ -45,24 +183,30 @@ def categorize_task():
     
     Entrada: Tarea sin category
     Salida: La misma tarea con category asignada
+            (con ?async=true o Prefer: respond-async, 202 con el trabajo; ver /ai/jobs/<id>)
     """
     try:
         data = request.get_json()
         if not data:
             return jsonify({"error": "Cuerpo de la petición vacío o JSON inválido"}), 400
         
+        if wants_async():
+            return enqueue_job('categorize', data)
+        
         # Validar que tenga al menos title
         if 'title' not in data:
             return jsonify({"error": "El campo 'title' es obligatorio"}), 400
         
         # Categorizar tarea usando IA
-        category = ai_service.categorize_task(data)
+        category = get_ai_service().categorize_task(data)
         
         # Actualizar la tarea con la categoría
         data['category'] = category
         
         return jsonify(data), 200
         
+    except LLMProviderError:
+        raise
     except ValueError as e:
         return jsonify({"error": str(e)}), 500
     except Exception as e:
@@ -76,12 +220,16 @@ def estimate_task():
     
     Entrada: Tarea sin effort_hours
     Salida: La misma tarea con effort_hours estimado (float)
+            (con ?async=true o Prefer: respond-async, 202 con el trabajo; ver /ai/jobs/<id>)
     """
     try:
         data = request.get_json()
         if not data:
             return jsonify({"error": "Cuerpo de la petición vacío o JSON inválido"}), 400
         
+        if wants_async():
+            return enqueue_job('estimate', data)
+        
         # Validar campos mínimos
         required_fields = ['title', 'description']
         missing_fields = [field for field in required_fields if field not in data]
@@ -89,13 +237,15 @@ def estimate_task():
             return jsonify({"error": f"Campos faltantes: {', '.join(missing_fields)}"}), 400
         
         # Estimar esfuerzo usando IA
-        effort_hours = ai_service.estimate_effort_hours(data)
+        effort_hours = get_ai_service().estimate_effort_hours(data)
         
         # Actualizar la tarea con el esfuerzo estimado (como float)
         data['effort_hours'] = effort_hours
         
         return jsonify(data), 200
         
+    except LLMProviderError:
+        raise
     except ValueError as e:
         return jsonify({"error": f"Error al parsear esfuerzo: {str(e)}"}), 500
     except Exception as e:
@@ -106,24 +256,39 @@ def estimate_task():
 def audit_task():
     """
     Analiza riesgos y genera plan de mitigación para una tarea usando IA.
-    Realiza DOS llamadas al LLM.
+    Con ?mode=chain realiza DOS llamadas al LLM; con ?mode=structured UNA
+    sola con salida JSON (y las dos si la respuesta no es válida). Por
+    defecto, AI_AUDIT_MODE.
     
     Entrada: Tarea sin risk_analysis y risk_mitigation
     Salida: La misma tarea con ambos campos completados
+            (con ?stream=true o Accept: text/event-stream, eventos SSE 'token'
+            de cada campo a medida que se genera y un evento final 'task')
+            (con ?async=true o Prefer: respond-async, 202 con el trabajo; ver /ai/jobs/<id>)
     """
     try:
         data = request.get_json()
         if not data:
             return jsonify({"error": "Cuerpo de la petición vacío o JSON inválido"}), 400
         
+        mode = request.args.get('mode')
+        if mode is not None and mode not in AUDIT_MODES:
+            return jsonify({"error": f"Modo inválido. Valores permitidos: {', '.join(AUDIT_MODES)}"}), 400
+        
+        if wants_async():
+            return enqueue_job('audit', data, mode)
+        
         # Validar campos mínimos
         required_fields = ['title', 'description']
         missing_fields = [field for field in required_fields if field not in data]
         if missing_fields:
             return jsonify({"error": f"Campos faltantes: {', '.join(missing_fields)}"}), 400
         
-        # Realizar auditoría de riesgos (2 llamadas al LLM)
-        risk_analysis, risk_mitigation = ai_service.audit_risks(data)
+        if wants_event_stream():
+            return event_stream(get_ai_service().stream_audit(data, mode), "Error al auditar tarea")
+        
+        # Realizar auditoría de riesgos (1 o 2 llamadas al LLM según el modo)
+        risk_analysis, risk_mitigation = get_ai_service().audit_risks(data, mode)
         
         # Actualizar la tarea con el análisis
         data['risk_analysis'] = risk_analysis
@@ -131,5 +296,137 @@ def audit_task():
         
         return jsonify(data), 200
         
+    except LLMProviderError:
+        raise
     except Exception as e:
         return jsonify({"error": f"Error al auditar tarea: {str(e)}"}), 500
+
+
+@ai_task_bp.route('/enrich', methods=['POST'])
+def enrich_task():
+    """
+    Completa en una sola petición los campos de IA que le falten a una
+    tarea (description, category, effort_hours, risk_analysis y
+    risk_mitigation). Los pasos independientes se ejecutan en paralelo y
+    los campos que ya trae la tarea no se regeneran.
+    
+    Entrada: Tarea (o {"task_id": ...} para partir de una tarea guardada);
+             ?mode=chain|structured para la auditoría y, con task_id,
+             ?persist=true para guardar los campos generados
+    Salida: {"task", "steps": {paso: {"status", "ms", "error"}}, "elapsed_ms",
+             "sequential_ms", "persisted"}
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data:
+        return jsonify({"error": "Cuerpo de la petición vacío o JSON inválido"}), 400
+
+    try:
+        task, task_id = resolve_job_task(data)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+
+    # Sin descripción hacen falta los campos con los que se genera
+    required_fields = ['title'] if has_field(task, 'description') else REQUIRED_FIELDS['describe']
+    missing_fields = [field for field in required_fields if field not in task]
+    if missing_fields:
+        return jsonify({"error": f"Campos faltantes: {', '.join(missing_fields)}"}), 400
+
+    mode = request.args.get('mode')
+    if mode is not None and mode not in AUDIT_MODES:
+        return jsonify({"error": f"Modo inválido. Valores permitidos: {', '.join(AUDIT_MODES)}"}), 400
+
+    persist = request.args.get('persist') in ('1', 'true')
+    if persist and task_id is None:
+        return jsonify({"error": "Para guardar el resultado indica task_id"}), 400
+
+    service = get_async_ai_service()
+    enrichment = service.run(enrich_pipeline(service, task, mode))
+
+    if persist:
+        stored = persist_enrichment(task_id, enrichment)
+        if stored is None:
+            return jsonify({"error": f"Tarea con ID {task_id} no encontrada"}), 404
+        enrichment['task'] = stored.to_dict()
+    enrichment['persisted'] = persist
+    return jsonify(enrichment), 200
+
+
+@ai_task_bp.route('/status', methods=['GET'])
+def ai_status():
+    """
+    Estado del servicio de IA: limitador RPM/TPM, reintentos y circuit
+    breaker del proveedor, aciertos/fallos de la caché de respuestas,
+    llamadas agrupadas (del servicio síncrono y del asíncrono), fracción
+    de clasificaciones y estimaciones resueltas sin el LLM, respuestas
+    reutilizadas de tareas casi iguales y latencia y tokens de la auditoría
+    en cada modo (con el ahorro de 'structured' frente a 'chain').
+    """
+    status = get_ai_service().get_status()
+    async_service = get_async_ai_service()
+    status["async"] = {"single_flight": async_service.in_flight.stats(), "audit": async_service.audit_stats.stats()}
+    return jsonify(status), 200
+
+
+@ai_task_bp.route('/usage', methods=['GET'])
+def ai_usage():
+    """
+    Tokens y latencia de las llamadas al LLM por operación (endpoints
+    individuales, batch, enrich y trabajos en segundo plano): totales,
+    medias, percentiles de las últimas AI_USAGE_WINDOW llamadas y el
+    perfil de generación de cada operación, para ajustarlos con datos.
+    """
+    return jsonify(get_ai_service().get_usage_report()), 200
+
+
+@ai_task_bp.route('/batch/<operation>', methods=['POST'])
+def batch_operation(operation):
+    """
+    Aplica describe, categorize, estimate o audit a una lista de tareas.
+    Las llamadas al LLM se hacen en paralelo sobre el event loop de
+    AsyncAIService, sin ocupar un hilo por llamada (parámetro ?concurrency=N).
+    En audit, ?mode=chain|structured elige el modo como en /ai/tasks/audit.
+    
+    Entrada: Lista JSON de tareas
+    Salida: {"results": [{"index", "task"} o {"index", "error"}], "succeeded", "failed"}
+            en el mismo orden que la entrada
+    """
+    if operation not in BATCH_OPERATIONS:
+        return jsonify({"error": f"Operación inválida. Valores permitidos: {', '.join(BATCH_OPERATIONS)}"}), 404
+
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "El cuerpo debe ser una lista JSON no vacía"}), 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({"error": f"Máximo {MAX_BATCH_ITEMS} elementos por petición"}), 400
+
+    concurrency = request.args.get('concurrency')
+    if concurrency is not None:
+        if not concurrency.isdigit() or not 1 <= int(concurrency) <= MAX_ASYNC_CONCURRENCY:
+            return jsonify({"error": f"concurrency debe ser un entero entre 1 y {MAX_ASYNC_CONCURRENCY}"}), 400
+        concurrency = int(concurrency)
+
+    mode = request.args.get('mode')
+    if mode is not None and mode not in AUDIT_MODES:
+        return jsonify({"error": f"Modo inválido. Valores permitidos: {', '.join(AUDIT_MODES)}"}), 400
+
+    # Validar cada tarea; solo las válidas llegan al LLM
+    results = [None] * len(items)
+    valid_tasks, positions = [], []
+    for index, data in enumerate(items):
+        if not isinstance(data, dict):
+            results[index] = {"index": index, "error": "Cada elemento debe ser un objeto JSON"}
+            continue
+        missing_fields = [field for field in REQUIRED_FIELDS[operation] if field not in data]
+        if missing_fields:
+            results[index] = {"index": index, "error": f"Campos faltantes: {', '.join(missing_fields)}"}
+            continue
+        valid_tasks.append(data)
+        positions.append(index)
+
+    service = get_async_ai_service()
+    batch_results = service.run(service.run_batch(operation, valid_tasks, concurrency, mode))
+    for index, result in zip(positions, batch_results):
+        results[index] = dict(result, index=index)
+
+    failed = sum(1 for result in results if "error" in result)
+    return jsonify({"results": results, "succeeded": len(results) - failed, "failed": failed}), 200
@@ -1,12 +1,19 @@
-from flask import Blueprint, request, jsonify
-from models.task import Task
-from managers.task_manager import TaskManager
+import hashlib
+from flask import Blueprint, Response, current_app, request, jsonify
+from models.task import Task, VALID_PRIORITIES, VALID_STATUSES
+from managers.task_manager import TaskManager, TaskStorageError, TaskPreconditionError, SORTABLE_FIELDS
+from managers.task_indexes import INDEXED_FIELDS
 
 task_bp = Blueprint('task_bp', __name__)
 
-# Validadores
-VALID_PRIORITIES = ['baja', 'media', 'alta', 'bloqueante']
-VALID_STATUSES = ['pendiente', 'en progreso', 'en revisión', 'completada']
+# Tamaño máximo de página en GET /tasks
+MAX_PAGE_SIZE = 1000
+
+# Tareas serializadas por cada fragmento en las respuestas en streaming
+STREAM_CHUNK_SIZE = 500
+
+# Número máximo de elementos en una petición /tasks/bulk
+MAX_BULK_ITEMS = 10000
 
 def validate_task_data(data):
     """Valida los datos de entrada para crear o actualizar una tarea."""
@@ -38,18 +45,172 @@ def validate_task_data(data):
 
     return errors
 
+def build_task(data):
+    """Crea un Task nuevo a partir de datos ya validados."""
+    return Task(
+        title=data['title'],
+        description=data['description'],
+        priority=data['priority'],
+        effort_hours=data['effort_hours'],
+        status=data['status'],
+        assigned_to=data['assigned_to'],
+        category=data.get('category'),
+        risk_analysis=data.get('risk_analysis'),
+        risk_mitigation=data.get('risk_mitigation')
+    )
+
+def read_bulk_items():
+    """
+    Lee el cuerpo de un endpoint bulk: una lista JSON no vacía.
+    Devuelve (items, None) o (None, respuesta de error).
+    """
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not items:
+        return None, (jsonify({"error": "El cuerpo debe ser una lista JSON no vacía"}), 400)
+    if len(items) > MAX_BULK_ITEMS:
+        return None, (jsonify({"error": f"Máximo {MAX_BULK_ITEMS} elementos por petición"}), 400)
+    return items, None
+
+def parse_task_query(args):
+    """
+    Valida los parámetros de filtrado, orden y paginación de GET /tasks.
+    Devuelve (argumentos para TaskManager.query_tasks, lista de errores).
+    """
+    errors = []
+    filters = {field: args[field] for field in INDEXED_FIELDS if field in args}
+
+    if 'priority' in filters and filters['priority'] not in VALID_PRIORITIES:
+        errors.append(f"Prioridad inválida. Valores permitidos: {', '.join(VALID_PRIORITIES)}")
+    if 'status' in filters and filters['status'] not in VALID_STATUSES:
+        errors.append(f"Estado inválido. Valores permitidos: {', '.join(VALID_STATUSES)}")
+
+    # sort=campo (ascendente) o sort=-campo (descendente)
+    sort = args.get('sort') or None
+    descending = False
+    if sort and sort.startswith('-'):
+        sort, descending = sort[1:], True
+    if sort is not None and sort not in SORTABLE_FIELDS:
+        errors.append(f"Orden inválido. Valores permitidos: {', '.join(SORTABLE_FIELDS)}")
+
+    limit = args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+            if not 1 <= limit <= MAX_PAGE_SIZE:
+                raise ValueError
+        except ValueError:
+            errors.append(f"limit debe ser un entero entre 1 y {MAX_PAGE_SIZE}.")
+
+    query = {
+        "filters": filters,
+        "sort": sort,
+        "descending": descending,
+        "limit": limit,
+        "cursor": args.get('cursor')
+    }
+    return query, errors
+
+def wants_ndjson():
+    """Indica si el cliente prefiere NDJSON (una tarea JSON por línea)."""
+    best = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+    return best == 'application/x-ndjson'
+
+def stream_tasks(tasks, ndjson=False):
+    """
+    Respuesta en streaming que serializa las tareas por fragmentos, sin
+    construir en memoria la lista de diccionarios ni el JSON completo.
+    Genera un array JSON o, con ndjson=True, una tarea por línea.
+    """
+    dumps = current_app.json.dumps
+
+    def generate():
+        if not ndjson:
+            yield '['
+        for start in range(0, len(tasks), STREAM_CHUNK_SIZE):
+            chunk = [dumps(task.to_dict()) for task in tasks[start:start + STREAM_CHUNK_SIZE]]
+            if ndjson:
+                yield '\n'.join(chunk) + '\n'
+            else:
+                yield (',' if start else '') + ','.join(chunk)
+        if not ndjson:
+            yield ']'
+
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(generate(), mimetype=mimetype)
+
+def collection_etag(mimetype):
+    """
+    ETag de un listado: revisión del almacén + parámetros de la consulta +
+    formato, para que cada representación tenga su propia etiqueta.
+    """
+    query = '&'.join(f"{key}={value}" for key, value in sorted(request.args.items(multi=True)))
+    content = f"{TaskManager.get_revision()}|{query}|{mimetype}"
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+def not_modified(etag):
+    """Respuesta 304 sin cuerpo para un If-None-Match que coincide."""
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+def expected_etags():
+    """ETags de If-Match (None si no hay cabecera o es '*')."""
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    return request.if_match.as_set()
+
+@task_bp.app_errorhandler(TaskPreconditionError)
+def handle_precondition_error(error):
+    """Respuesta 412 cuando If-Match no coincide con la versión actual de la tarea."""
+    return jsonify({"error": str(error)}), 412
+
+@task_bp.app_errorhandler(TaskStorageError)
+def handle_storage_error(error):
+    """Devuelve en JSON los errores de persistencia de TaskManager."""
+    return jsonify({"error": str(error)}), 500
+
 @task_bp.route('/tasks', methods=['GET'])
 def get_tasks():
-    tasks = TaskManager.load_tasks()
-    return jsonify([task.to_dict() for task in tasks]), 200
+    ndjson = wants_ndjson()
+    stream = ndjson or request.args.get('stream') in ('1', 'true')
+
+    # Si el cliente ya tiene esta versión del listado no se serializa nada
+    etag = collection_etag('application/x-ndjson' if ndjson else 'application/json')
+    if etag in request.if_none_match:
+        return not_modified(etag)
+
+    if not request.args:
+        tasks, next_cursor = TaskManager.load_tasks(), None
+    else:
+        # Filtros, orden y paginación servidos desde los índices del almacén
+        query, errors = parse_task_query(request.args)
+        if errors:
+            return jsonify({"errors": errors}), 400
+        try:
+            tasks, next_cursor = TaskManager.query_tasks(**query)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    if stream:
+        response = stream_tasks(tasks, ndjson)
+    else:
+        response = jsonify([task.to_dict() for task in tasks])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    response.set_etag(etag)
+    return response, 200
 
 @task_bp.route('/tasks/<task_id>', methods=['GET'])
 def get_task(task_id):
-    tasks = TaskManager.load_tasks()
-    task = next((t for t in tasks if t.id == task_id), None)
-    if task:
-        return jsonify(task.to_dict()), 200
-    return jsonify({"error": "Tarea no encontrada"}), 404
+    task, etag = TaskManager.get_task_with_etag(task_id)
+    if task is None:
+        return jsonify({"error": "Tarea no encontrada"}), 404
+    if etag in request.if_none_match:
+        return not_modified(etag)
+
+    response = jsonify(task.to_dict())
+    response.set_etag(etag)
+    return response, 200
 
 @task_bp.route('/tasks', methods=['POST'])
 def create_task():
@@ -61,23 +222,12 @@ def create_task():
     if errors:
         return jsonify({"errors": errors}), 400
         
-    new_task = Task(
-        title=data['title'],
-        description=data['description'],
-        priority=data['priority'],
-        effort_hours=data['effort_hours'],
-        status=data['status'],
-        assigned_to=data['assigned_to'],
-        category=data.get('category'),
-        risk_analysis=data.get('risk_analysis'),
-        risk_mitigation=data.get('risk_mitigation')
-    )
+    new_task = build_task(data)
+    TaskManager.add_task(new_task)
     
-    tasks = TaskManager.load_tasks()
-    tasks.append(new_task)
-    TaskManager.save_tasks(tasks)
-    
-    return jsonify(new_task.to_dict()), 201
+    response = jsonify(new_task.to_dict())
+    response.set_etag(TaskManager.compute_etag(new_task))
+    return response, 201
 
 @task_bp.route('/tasks/<task_id>', methods=['PUT'])
 def update_task(task_id):
@@ -85,10 +235,7 @@ def update_task(task_id):
     if not data:
         return jsonify({"error": "Cuerpo de la petición vacío o JSON inválido"}), 400
 
-    tasks = TaskManager.load_tasks()
-    task = next((t for t in tasks if t.id == task_id), None)
-    
-    if not task:
+    if TaskManager.get_task(task_id) is None:
         return jsonify({"error": "Tarea no encontrada"}), 404
         
     # Validación completa de datos
@@ -96,33 +243,95 @@ def update_task(task_id):
     if errors:
         return jsonify({"errors": errors}), 400
 
-    # Actualizar campos obligatorios
-    task.title = data['title']
-    task.description = data['description']
-    task.priority = data['priority']
-    task.effort_hours = float(data['effort_hours'])
-    task.status = data['status']
-    task.assigned_to = data['assigned_to']
-    
-    # Actualizar campos opcionales (Entregable 2)
-    if 'category' in data:
-        task.category = data['category']
-    if 'risk_analysis' in data:
-        task.risk_analysis = data['risk_analysis']
-    if 'risk_mitigation' in data:
-        task.risk_mitigation = data['risk_mitigation']
-    
-    TaskManager.save_tasks(tasks)
-    return jsonify(task.to_dict()), 200
+    # If-Match: solo se actualiza si la tarea no cambió desde que se leyó
+    task = TaskManager.update_task(task_id, data, expected_etags())
+    if not task:
+        return jsonify({"error": "Tarea no encontrada"}), 404
+    response = jsonify(task.to_dict())
+    response.set_etag(TaskManager.compute_etag(task))
+    return response, 200
 
 @task_bp.route('/tasks/<task_id>', methods=['DELETE'])
 def delete_task(task_id):
-    tasks = TaskManager.load_tasks()
-    task = next((t for t in tasks if t.id == task_id), None)
-    
-    if not task:
+    if not TaskManager.delete_task(task_id, expected_etags()):
         return jsonify({"error": "Tarea no encontrada"}), 404
         
-    tasks.remove(task)
-    TaskManager.save_tasks(tasks)
     return jsonify({"message": "Tarea eliminada correctamente"}), 200
+
+@task_bp.route('/tasks/bulk', methods=['POST'])
+def bulk_create_tasks():
+    """Crea varias tareas; las válidas se guardan con una sola escritura."""
+    items, error_response = read_bulk_items()
+    if error_response:
+        return error_response
+
+    new_tasks, errors = [], []
+    for index, data in enumerate(items):
+        item_errors = validate_task_data(data) if isinstance(data, dict) else ["Cada elemento debe ser un objeto JSON."]
+        if item_errors:
+            errors.append({"index": index, "errors": item_errors})
+        else:
+            new_tasks.append(build_task(data))
+
+    if new_tasks:
+        TaskManager.add_tasks(new_tasks)
+    result = {"created": [task.to_dict() for task in new_tasks], "errors": errors}
+    return jsonify(result), 201 if new_tasks else 400
+
+@task_bp.route('/tasks/bulk', methods=['PUT'])
+def bulk_update_tasks():
+    """Actualiza varias tareas (cada elemento incluye su 'id') con una sola escritura."""
+    items, error_response = read_bulk_items()
+    if error_response:
+        return error_response
+
+    updates, positions, errors = [], [], []
+    for index, data in enumerate(items):
+        if not isinstance(data, dict):
+            errors.append({"index": index, "errors": ["Cada elemento debe ser un objeto JSON."]})
+            continue
+        task_id = data.get('id')
+        item_errors = [] if isinstance(task_id, str) and task_id else ["El campo 'id' es obligatorio."]
+        item_errors += validate_task_data(data)
+        if item_errors:
+            errors.append({"index": index, "errors": item_errors})
+        else:
+            updates.append((data['id'], data))
+            positions.append(index)
+
+    updated = []
+    results = TaskManager.update_tasks(updates) if updates else []
+    for index, task in zip(positions, results):
+        if task is None:
+            errors.append({"index": index, "errors": ["Tarea no encontrada"]})
+        else:
+            updated.append(task.to_dict())
+
+    errors.sort(key=lambda error: error["index"])
+    return jsonify({"updated": updated, "errors": errors}), 200 if updated else 400
+
+@task_bp.route('/tasks/bulk', methods=['DELETE'])
+def bulk_delete_tasks():
+    """Elimina varias tareas (lista de ids) con una sola escritura."""
+    items, error_response = read_bulk_items()
+    if error_response:
+        return error_response
+
+    task_ids, positions, errors = [], [], []
+    for index, task_id in enumerate(items):
+        if isinstance(task_id, str) and task_id:
+            task_ids.append(task_id)
+            positions.append(index)
+        else:
+            errors.append({"index": index, "errors": ["Cada elemento debe ser un id de tarea."]})
+
+    deleted = []
+    results = TaskManager.delete_tasks(task_ids) if task_ids else []
+    for index, task_id, existed in zip(positions, task_ids, results):
+        if existed:
+            deleted.append(task_id)
+        else:
+            errors.append({"index": index, "errors": ["Tarea no encontrada"]})
+
+    errors.sort(key=lambda error: error["index"])
+    return jsonify({"deleted": deleted, "errors": errors}), 200 if deleted else 400
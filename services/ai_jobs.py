@@ -0,0 +1,90 @@
+"""
+Trabajos de IA en segundo plano (modo asíncrono de /ai/tasks/*).
+
+La ruta encola el trabajo con JobManager y responde 202; un hilo del pool
+ejecuta run_enrichment_job, que aplica la operación con AIService y, si el
+trabajo apunta a una tarea guardada (task_id), escribe en ella los campos
+generados a través de TaskManager.
+"""
+from managers.job_manager import JobManager
+from managers.task_manager import TaskManager
+
+AI_JOB_KIND = 'ai_enrichment'
+
+# Campos que genera cada operación (los únicos que se escriben en la tarea)
+OPERATION_FIELDS = {
+    'describe': ('description',),
+    'categorize': ('category',),
+    'estimate': ('effort_hours',),
+    'audit': ('risk_analysis', 'risk_mitigation')
+}
+
+
+def resolve_job_task(data: dict) -> tuple:
+    """
+    Tarea sobre la que trabaja el job: si el cuerpo trae task_id, la tarea
+    guardada con los campos del cuerpo por encima; si no, el propio cuerpo.
+
+    Returns:
+        Tupla (tarea, task_id o None)
+
+    Raises:
+        LookupError: Si task_id no corresponde a ninguna tarea
+    """
+    task_id = data.get('task_id')
+    if task_id is None:
+        return data, None
+
+    stored = TaskManager.get_task(task_id)
+    if stored is None:
+        raise LookupError(f"Tarea con ID {task_id} no encontrada")
+    task = stored.to_dict()
+    task.update((field, value) for field, value in data.items() if field != 'task_id')
+    return task, task_id
+
+
+def enqueue_enrichment(operation: str, task: dict, task_id: str = None, mode: str = None) -> dict:
+    """
+    Encola la operación sobre la tarea y devuelve el trabajo ('queued').
+    `mode` es el modo de la auditoría (por defecto AI_AUDIT_MODE).
+    """
+    return JobManager.submit(AI_JOB_KIND, {"operation": operation, "task": task, "task_id": task_id,
+                                           "mode": mode})
+
+
+def run_enrichment_job(service, payload: dict) -> dict:
+    """
+    Handler de los trabajos AI_JOB_KIND: devuelve la tarea enriquecida y,
+    con task_id, guarda los campos generados en la tarea.
+
+    Raises:
+        LookupError: Si la tarea se eliminó mientras el trabajo esperaba
+    """
+    operation = payload['operation']
+    result = service.enrich_task(operation, payload['task'], payload.get('mode'))
+    task_id = payload.get('task_id')
+    if task_id is None:
+        return result
+
+    fields = {field: result[field] for field in OPERATION_FIELDS[operation]}
+    task = TaskManager.patch_task(task_id, fields)
+    if task is None:
+        raise LookupError(f"Tarea con ID {task_id} no encontrada")
+    return task.to_dict()
+
+
+def job_to_dict(job: dict) -> dict:
+    """Vista pública de un trabajo (sin el pid del proceso que lo ejecuta)."""
+    payload = job['payload']
+    return {
+        "id": job['id'],
+        "status": job['status'],
+        "operation": payload['operation'],
+        "task_id": payload.get('task_id'),
+        "result": job['result'],
+        "error": job['error'],
+        "created_at": job['created_at'],
+        "started_at": job['started_at'],
+        "finished_at": job['finished_at'],
+        "status_url": f"/ai/jobs/{job['id']}"
+    }
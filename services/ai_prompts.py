@@ -0,0 +1,216 @@
+"""
+Prompts y parseo de respuestas compartidos por AIService (síncrono) y
+AsyncAIService (asyncio). Solo construyen texto e interpretan respuestas;
+no llaman al modelo.
+"""
+import json
+import re
+
+VALID_CATEGORIES = ['Frontend', 'Backend', 'Testing', 'Infra', 'DevOps']
+
+# Modos de la auditoría: dos llamadas encadenadas (riesgos y luego
+# mitigación) o una sola llamada que devuelve ambos campos en JSON
+AUDIT_MODES = ('chain', 'structured')
+AUDIT_FIELDS = ('risk_analysis', 'risk_mitigation')
+
+
+def description_prompt(task: dict) -> str:
+    """Prompt para generar la descripción de una tarea."""
+    return f"""Genera una descripción clara y concisa para la siguiente tarea:
+
+Título: {task.get('title', 'Sin título')}
+Prioridad: {task.get('priority', 'Sin prioridad')}
+Estado: {task.get('status', 'Sin estado')}
+Asignado a: {task.get('assigned_to', 'Sin asignar')}
+
+IMPORTANTE:
+- Devuelve SOLO texto plano, sin markdown
+- No uses asteriscos, guiones, ni listas
+- Máximo 2-3 oraciones
+- No incluyas títulos ni encabezados
+- Responde directamente con la descripción
+"""
+
+
+def category_prompt(task: dict) -> str:
+    """Prompt para clasificar una tarea en una de VALID_CATEGORIES."""
+    return f"""Clasifica la siguiente tarea en UNA sola categoría.
+
+Título: {task.get('title', '')}
+Descripción: {task.get('description', '')}
+
+Categorías válidas:
+- Frontend
+- Backend
+- Testing
+- Infra
+- DevOps
+
+IMPORTANTE:
+- Responde SOLO con el nombre de la categoría
+- No agregues explicaciones ni texto adicional
+- Usa exactamente el formato: Frontend, Backend, Testing, Infra o DevOps
+"""
+
+
+def parse_category(response: str) -> str:
+    """
+    Extrae la categoría de la respuesta del modelo.
+
+    Raises:
+        ValueError: Si la respuesta no contiene una categoría válida
+    """
+    category = response.strip()
+
+    # Validar que la categoría sea válida
+    if category not in VALID_CATEGORIES:
+        # Intentar encontrar una categoría válida en la respuesta
+        for valid_cat in VALID_CATEGORIES:
+            if valid_cat.lower() in category.lower():
+                return valid_cat
+        raise ValueError(f"Categoría inválida recibida del LLM: {category}")
+
+    return category
+
+
+def effort_prompt(task: dict, references: list = None) -> str:
+    """
+    Prompt para estimar el esfuerzo en horas. `references` son tareas
+    completadas parecidas ({"title", "effort_hours"}) que se dan como contexto.
+    """
+    context = ""
+    if references:
+        lines = "\n".join(f"- {ref['title']}: {ref['effort_hours']:g} horas" for ref in references)
+        context = f"""
+Tareas parecidas ya completadas y sus horas reales:
+{lines}
+"""
+    return f"""Estima el esfuerzo en horas necesario para completar la siguiente tarea:
+
+Título: {task.get('title', '')}
+Descripción: {task.get('description', '')}
+Categoría: {task.get('category', 'Sin categoría')}
+{context}
+IMPORTANTE:
+- Responde SOLO con un número
+- Puede ser entero o decimal (ejemplo: 8 o 12.5)
+- No agregues palabras como "horas", "aproximadamente", etc.
+- Responde únicamente con el valor numérico
+"""
+
+
+def parse_effort(response: str) -> float:
+    """
+    Extrae el número de horas de la respuesta del modelo.
+
+    Raises:
+        ValueError: Si no se puede parsear un número válido de la respuesta
+    """
+    # Extraer el número de la respuesta usando regex
+    # Buscar patrones como: "12", "12.5", "12,5", "aproximadamente 12", etc.
+    numbers = re.findall(r'\d+[.,]?\d*', response)
+
+    if not numbers:
+        raise ValueError(f"No se pudo extraer un número válido de la respuesta: {response}")
+
+    # Tomar el primer número encontrado y convertirlo
+    try:
+        effort_str = numbers[0].replace(',', '.')
+        effort = float(effort_str)
+
+        if effort < 0:
+            raise ValueError("El esfuerzo no puede ser negativo")
+
+        return effort
+    except (ValueError, IndexError) as e:
+        raise ValueError(f"Error al parsear esfuerzo desde '{response}': {str(e)}")
+
+
+def risk_prompt(task: dict) -> str:
+    """Prompt de la primera llamada de la auditoría: análisis de riesgos."""
+    return f"""Analiza los riesgos potenciales de la siguiente tarea:
+
+Título: {task.get('title', '')}
+Descripción: {task.get('description', '')}
+Categoría: {task.get('category', 'Sin categoría')}
+Prioridad: {task.get('priority', '')}
+Esfuerzo estimado: {task.get('effort_hours', 'Sin estimar')} horas
+
+Identifica los principales riesgos técnicos, de recursos o de tiempo.
+
+IMPORTANTE:
+- Responde en texto plano, sin markdown
+- No uses listas con guiones ni asteriscos
+- Máximo 3-4 oraciones
+- Se específico y conciso
+"""
+
+
+def mitigation_prompt(task: dict, risk_analysis: str) -> str:
+    """Prompt de la segunda llamada de la auditoría: plan de mitigación."""
+    return f"""Basándote en los siguientes riesgos identificados, genera un plan de mitigación:
+
+TAREA:
+Título: {task.get('title', '')}
+Descripción: {task.get('description', '')}
+
+RIESGOS IDENTIFICADOS:
+{risk_analysis}
+
+Proporciona acciones concretas para mitigar estos riesgos.
+
+IMPORTANTE:
+- Responde en texto plano, sin markdown
+- No uses listas con guiones ni asteriscos
+- Máximo 3-4 oraciones
+- Proporciona acciones específicas y prácticas
+"""
+
+
+def structured_audit_prompt(task: dict) -> str:
+    """Prompt de la auditoría en una sola llamada: riesgos y mitigación en un objeto JSON."""
+    return f"""Audita la siguiente tarea: analiza sus riesgos potenciales y genera un plan de mitigación.
+
+Título: {task.get('title', '')}
+Descripción: {task.get('description', '')}
+Categoría: {task.get('category', 'Sin categoría')}
+Prioridad: {task.get('priority', '')}
+Esfuerzo estimado: {task.get('effort_hours', 'Sin estimar')} horas
+
+Identifica los principales riesgos técnicos, de recursos o de tiempo, y
+proporciona acciones concretas para mitigar esos mismos riesgos.
+
+IMPORTANTE:
+- Responde SOLO con un objeto JSON, sin markdown ni texto adicional
+- Usa exactamente este formato: {{"risk_analysis": "...", "risk_mitigation": "..."}}
+- Cada campo en texto plano, sin listas, con un máximo de 3-4 oraciones
+- Se específico y conciso
+"""
+
+
+def parse_structured_audit(response: str) -> tuple[str, str]:
+    """
+    Extrae (risk_analysis, risk_mitigation) de la respuesta JSON del modelo.
+    Admite el objeto envuelto en un bloque ```json.
+
+    Raises:
+        ValueError: Si la respuesta no es un objeto JSON con ambos campos
+                    como texto no vacío
+    """
+    text = response.strip()
+    fenced = re.match(r'^```(?:json)?\s*(.*?)\s*```$', text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1)
+
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"La auditoría recibida del LLM no es JSON válido: {str(e)}")
+
+    if not isinstance(data, dict):
+        raise ValueError("La auditoría recibida del LLM no es un objeto JSON")
+    for field in AUDIT_FIELDS:
+        value = data.get(field)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"La auditoría recibida del LLM no tiene el campo '{field}'")
+    return data['risk_analysis'].strip(), data['risk_mitigation'].strip()
@@ -1,42 +1,437 @@
+import json
 import os
-import re
-from openai import AzureOpenAI
+import threading
+import time
+from services import ai_prompts
+from services.llm_cache import LLMCache
+from services.effort_estimator import EffortEstimator
+from services.llm_providers import LLMConfigurationError, LLMProvider, create_provider
+from services.local_classifier import LocalClassifier
+from services.near_duplicate import create_near_duplicate_indexes
+from services.resilience import ResilientProvider
+from services.single_flight import SingleFlight
+from services.usage_tracker import UsageTracker
 
+# Parámetros de generación por defecto (llamadas sin operación conocida)
+SYSTEM_MESSAGE = "Eres un asistente experto en gestión de proyectos y desarrollo de software."
+TEMPERATURE = 0.7
+MAX_TOKENS = 500
 
-class AIService:
+# Caché de respuestas del LLM (LLM_CACHE_MAX_ENTRIES=0 la desactiva)
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', 1000))
+LLM_CACHE_TTL_SECONDS = int(os.getenv('LLM_CACHE_TTL_SECONDS', 3600))
+LLM_CACHE_FILE = os.getenv('LLM_CACHE_FILE') or None
+# Espera máxima antes de volcar a LLM_CACHE_FILE las respuestas nuevas
+LLM_CACHE_FLUSH_SECONDS = float(os.getenv('LLM_CACHE_FLUSH_SECONDS', 5))
+
+# Operaciones de enriquecimiento disponibles en los endpoints batch
+BATCH_OPERATIONS = ('describe', 'categorize', 'estimate', 'audit')
+
+# Modo de la auditoría cuando la petición no lo indica: 'chain' (dos
+# llamadas encadenadas) o 'structured' (una llamada con salida JSON)
+AI_AUDIT_MODE = os.getenv('AI_AUDIT_MODE', 'chain')
+
+# Formato de respuesta que se pide al modelo en la auditoría de una llamada
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+# Perfil de generación de cada operación. Las que responden una palabra o
+# un número no necesitan 500 tokens de salida ni variación: con menos
+# max_tokens y una parada en el salto de línea el modelo termina antes.
+# AI_GENERATION_PROFILES (JSON) cambia los valores por operación, p. ej.
+# {"categorize": {"max_tokens": 5}}; se lee en el primer uso (ver
+# generation_profiles), así que un valor inválido no impide arrancar la app
+DEFAULT_PROFILE = {"temperature": TEMPERATURE, "max_tokens": MAX_TOKENS, "stop": None, "response_format": None}
+GENERATION_PROFILES = {
+    'describe': dict(DEFAULT_PROFILE, max_tokens=250),
+    'categorize': dict(DEFAULT_PROFILE, temperature=0.0, max_tokens=10, stop=["\n"]),
+    'estimate': dict(DEFAULT_PROFILE, temperature=0.0, max_tokens=10, stop=["\n"]),
+    'risk_analysis': dict(DEFAULT_PROFILE, max_tokens=350),
+    'risk_mitigation': dict(DEFAULT_PROFILE, max_tokens=350),
+    'audit': dict(DEFAULT_PROFILE, max_tokens=800, response_format=JSON_RESPONSE_FORMAT)
+}
+
+
+def load_profile_overrides(profiles: dict) -> dict:
     """
-    Servicio centralizado para interactuar con Azure OpenAI.
-    Maneja generación de descripciones, categorización, estimación y análisis de riesgos.
+    Aplica AI_GENERATION_PROFILES sobre los perfiles.
+
+    Raises:
+        LLMConfigurationError: Si la variable no es un objeto JSON de
+                               operaciones y parámetros conocidos
     """
-    
+    raw = os.getenv('AI_GENERATION_PROFILES')
+    if not raw:
+        return profiles
+    try:
+        overrides = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise LLMConfigurationError(f"AI_GENERATION_PROFILES no es JSON válido: {str(e)}")
+    if not isinstance(overrides, dict):
+        raise LLMConfigurationError("AI_GENERATION_PROFILES debe ser un objeto JSON")
+
+    profiles = dict(profiles)
+    for operation, values in overrides.items():
+        if operation not in profiles or not isinstance(values, dict) or not set(values) <= set(DEFAULT_PROFILE):
+            raise LLMConfigurationError(f"Perfil de generación inválido en AI_GENERATION_PROFILES: {operation}")
+        profiles[operation] = dict(profiles[operation], **values)
+    return profiles
+
+
+_generation_profiles = None
+_profiles_lock = threading.Lock()
+
+
+def generation_profiles() -> dict:
+    """
+    GENERATION_PROFILES con AI_GENERATION_PROFILES aplicado, leído y
+    validado en la primera llamada.
+
+    Raises:
+        LLMConfigurationError: Si AI_GENERATION_PROFILES no es válido (se
+                               vuelve a comprobar en cada llamada)
+    """
+    global _generation_profiles
+    if _generation_profiles is None:
+        with _profiles_lock:
+            if _generation_profiles is None:
+                _generation_profiles = load_profile_overrides(GENERATION_PROFILES)
+    return _generation_profiles
+
+
+def generation_profile(operation: str = None) -> dict:
+    """Perfil de generación de una operación (DEFAULT_PROFILE si no tiene)."""
+    return generation_profiles().get(operation, DEFAULT_PROFILE)
+
+
+def completion_key(model: str, prompt: str, profile: dict = DEFAULT_PROFILE) -> str:
+    """Clave de caché de una llamada: todo lo que determina la respuesta."""
+    parts = (model, SYSTEM_MESSAGE, prompt, profile["temperature"], profile["max_tokens"])
+    if profile["stop"] or profile["response_format"]:
+        parts += (profile["stop"], profile["response_format"])
+    return LLMCache.make_key(*parts)
+
+
+def estimate_usage(prompt: str, content: str) -> dict:
+    """Tokens aproximados de una llamada (~4 caracteres por token) si la API no los informa."""
+    return {
+        "prompt_tokens": ResilientProvider.estimate_tokens(completion_messages(prompt), 0),
+        "completion_tokens": len(content) // 4
+    }
+
+
+def completion_messages(prompt: str) -> list:
+    """Mensajes de chat (sistema + usuario) para un prompt."""
+    return [
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def resolve_audit_mode(mode: str = None) -> str:
+    """
+    Modo de auditoría a usar (AI_AUDIT_MODE si no se indica).
+
+    Raises:
+        ValueError: Si el modo no es uno de AUDIT_MODES
+    """
+    mode = mode or AI_AUDIT_MODE
+    if mode not in ai_prompts.AUDIT_MODES:
+        raise ValueError(f"Modo de auditoría desconocido: {mode}")
+    return mode
+
+
+class AuditStats:
+    """
+    Latencia y tokens de audit_risks por modo, para comparar 'chain' y
+    'structured' con las peticiones reales. Los tokens se estiman (~4
+    caracteres por token, como el limitador TPM) a partir de los prompts
+    enviados y las respuestas recibidas. Es segura entre hilos.
+    """
+
     def __init__(self):
-        """Inicializa el cliente de Azure OpenAI leyendo variables de entorno."""
-        self.api_key = os.getenv('AZURE_OPENAI_API_KEY')
-        self.endpoint = os.getenv('AZURE_OPENAI_ENDPOINT')
-        self.deployment = os.getenv('AZURE_OPENAI_DEPLOYMENT')
-        self.api_version = os.getenv('AZURE_OPENAI_API_VERSION')
-        
-        # Validar que todas las variables estén configuradas
-        if not all([self.api_key, self.endpoint, self.deployment, self.api_version]):
-            raise ValueError(
-                "Faltan variables de entorno requeridas: "
-                "AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT, "
-                "AZURE_OPENAI_DEPLOYMENT, AZURE_OPENAI_API_VERSION"
-            )
+        self._modes = {mode: {"requests": 0, "fallbacks": 0, "llm_calls": 0, "seconds": 0.0, "tokens": 0}
+                       for mode in ai_prompts.AUDIT_MODES}
+        self._lock = threading.Lock()
+
+    def record(self, mode: str, seconds: float, exchanges: list, fallback: bool = False):
+        """Registra una auditoría: exchanges es la lista de (prompt, respuesta) de sus llamadas."""
+        tokens = sum(ResilientProvider.estimate_tokens(completion_messages(prompt), 0) + len(response) // 4
+                     for prompt, response in exchanges)
+        with self._lock:
+            stats = self._modes[mode]
+            stats["requests"] += 1
+            stats["fallbacks"] += int(fallback)
+            stats["llm_calls"] += len(exchanges)
+            stats["seconds"] += seconds
+            stats["tokens"] += tokens
+
+    def stats(self) -> dict:
+        """Medias por modo y ahorro (%) de 'structured' frente a 'chain' cuando hay datos de ambos."""
+        with self._lock:
+            modes = {mode: dict(stats) for mode, stats in self._modes.items()}
+
+        report = {}
+        for mode, stats in modes.items():
+            requests = stats["requests"]
+            report[mode] = {
+                "requests": requests,
+                "fallbacks": stats["fallbacks"],
+                "avg_llm_calls": round(stats["llm_calls"] / requests, 2) if requests else None,
+                "avg_latency_ms": round(stats["seconds"] / requests * 1000, 1) if requests else None,
+                "avg_estimated_tokens": round(stats["tokens"] / requests) if requests else None
+            }
+
+        chain, structured = report['chain'], report['structured']
+        report["savings"] = None
+        if chain["requests"] and structured["requests"]:
+            report["savings"] = {
+                "latency_pct": round(100 * (1 - structured["avg_latency_ms"] / chain["avg_latency_ms"]), 1)
+                if chain["avg_latency_ms"] else None,
+                "tokens_pct": round(100 * (1 - structured["avg_estimated_tokens"] / chain["avg_estimated_tokens"]), 1)
+                if chain["avg_estimated_tokens"] else None
+            }
+        return report
+
+
+def create_llm_cache() -> LLMCache:
+    """Caché de respuestas configurada con las variables LLM_CACHE_*."""
+    return LLMCache(
+        max_entries=LLM_CACHE_MAX_ENTRIES,
+        ttl_seconds=LLM_CACHE_TTL_SECONDS,
+        path=LLM_CACHE_FILE,
+        flush_seconds=LLM_CACHE_FLUSH_SECONDS
+    )
+
+
+class BaseAIService:
+    """
+    Lógica común de AIService (síncrono) y AsyncAIService (asyncio): el
+    estado compartible (proveedor, caché, clasificador, estimador, índices
+    de casi duplicados, contabilidad de uso), el estado del servicio y el
+    flujo de cada operación.
+
+    Cada operación se escribe una sola vez como un generador de pasos: cuando
+    necesita al modelo produce (prompt, operación) y recibe la respuesta. Las
+    subclases solo aportan el transporte: _call_llm (bloqueante o corrutina)
+    y _run_steps, que ejecuta los pasos con él.
+    """
+
+    single_flight_class = SingleFlight
+
+    def __init__(self, cache: LLMCache = None, provider: LLMProvider = None,
+                 classifier: LocalClassifier = None, estimator: EffortEstimator = None,
+                 near_duplicates: dict = None, usage: UsageTracker = None):
+        """
+        Inicializa el servicio con el proveedor de LLM configurado.
         
-        # Inicializar cliente de Azure OpenAI
-        self.client = AzureOpenAI(
-            api_key=self.api_key,
-            api_version=self.api_version,
-            azure_endpoint=self.endpoint
-        )
-    
-    def _call_llm(self, prompt: str) -> str:
+        Args:
+            cache: Caché de respuestas a usar (por defecto una nueva con LLM_CACHE_*);
+                   permite compartirla entre AIService y AsyncAIService
+            provider: Proveedor de LLM (por defecto el de LLM_PROVIDER, con el
+                      limitador, los reintentos y el circuit breaker de
+                      services/resilience.py; Azure OpenAI lee las variables
+                      AZURE_OPENAI_*)
+            classifier: Clasificador local que resuelve categorize_task sin
+                        el LLM cuando está seguro (por defecto uno con
+                        CATEGORY_LOCAL_THRESHOLD)
+            estimator: Índice kNN de tareas completadas que resuelve
+                       estimate_effort_hours sin el LLM cuando está seguro
+                       (por defecto uno con EFFORT_KNN_*)
+            near_duplicates: Índices MinHash por operación para reutilizar la
+                             respuesta de tareas casi iguales (por defecto los
+                             de NEAR_DUPLICATE_OPERATIONS; {} los desactiva)
+            usage: Contabilidad de tokens y latencia por operación (por
+                   defecto una nueva; puede compartirse entre servicios)
+
+        Raises:
+            LLMConfigurationError: Si falta la configuración del proveedor o
+                                   AI_GENERATION_PROFILES no es válido
+        """
+        # Perfiles de generación: un AI_GENERATION_PROFILES inválido falla aquí
+        generation_profiles()
+
+        self.provider = provider if provider is not None else ResilientProvider.from_env(create_provider())
+
+        # Caché de respuestas: evita repetir llamadas con el mismo prompt
+        self.cache = cache if cache is not None else create_llm_cache()
+
+        # Agrupa las llamadas concurrentes con el mismo prompt en una sola
+        self.in_flight = self.single_flight_class()
+
+        # Atajo local para categorize_task
+        self.classifier = classifier if classifier is not None else LocalClassifier()
+
+        # Atajo por tareas parecidas ya completadas para estimate_effort_hours
+        self.estimator = estimator if estimator is not None else EffortEstimator()
+
+        # Respuestas reutilizables entre tareas casi iguales (categorize, estimate)
+        self.near_duplicates = near_duplicates if near_duplicates is not None else create_near_duplicate_indexes()
+
+        # Latencia y tokens de la auditoría en cada modo
+        self.audit_stats = AuditStats()
+
+        # Tokens y latencia de cada llamada al modelo, por operación
+        self.usage = usage if usage is not None else UsageTracker()
+
+    def get_status(self) -> dict:
+        """Estado interno del servicio (caché y llamadas agrupadas)."""
+        return {
+            "provider": self.provider.name,
+            "resilience": self.provider.stats(),
+            "cache": self.cache.stats(),
+            "single_flight": self.in_flight.stats(),
+            "local_classifier": self.classifier.stats(),
+            "effort_estimator": self.estimator.stats(),
+            "near_duplicates": {operation: index.stats() for operation, index in self.near_duplicates.items()},
+            "audit": self.audit_stats.stats()
+        }
+
+    def get_usage_report(self) -> dict:
+        """Perfiles de generación y tokens y latencia (percentiles) por operación."""
+        return dict(self.usage.report(), profiles=generation_profiles())
+
+    def _cached_completion(self, prompt: str, operation: str = None) -> tuple:
+        """
+        Devuelve (clave de caché, respuesta cacheada o None) de una llamada,
+        con su perfil de generación, y cuenta los aciertos por operación.
+        """
+        cache_key = completion_key(self.provider.model, prompt, generation_profile(operation))
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            self.usage.record_cache_hit(operation)
+        return cache_key, cached
+
+    def _store_completion(self, prompt: str, cache_key: str, operation: str, start: float,
+                          content: str, usage: dict, parse=None) -> str:
+        """
+        Registra los tokens y la latencia de una llamada terminada (estimados
+        si la API no los informa) y guarda la respuesta en caché. Con parse,
+        solo se guarda si la respuesta se puede interpretar: una respuesta
+        inválida no se sirve a las peticiones siguientes.
+        """
+        estimated = "prompt_tokens" not in usage
+        if estimated:
+            usage.update(estimate_usage(prompt, content))
+        self.usage.record(operation, time.perf_counter() - start, usage, estimated)
+        try:
+            if parse is not None:
+                parse(content)
+        except ValueError:
+            return content
+        self.cache.set(cache_key, content)
+        return content
+
+    # Pasos de cada operación: generadores que producen (prompt, operación)
+    # o (prompt, operación, parse) y reciben la respuesta del modelo
+
+    def _reuse_near_duplicate(self, operation: str, task: dict, compute):
+        """
+        Devuelve la respuesta de una tarea casi igual ya resuelta (si la
+        operación tiene índice) o la calcula con los pasos de compute y la guarda.
+        """
+        index = self.near_duplicates.get(operation)
+        if index is None:
+            return (yield from compute)
+        answer = index.get(task)
+        if answer is None:
+            answer = yield from compute
+            index.set(task, answer)
+        return answer
+
+    def _description_steps(self, task: dict):
+        return (yield (ai_prompts.description_prompt(task), 'describe'))
+
+    def _category_steps(self, task: dict):
+        category = self.classifier.classify(task)
+        if category is not None:
+            return category
+        return (yield from self._reuse_near_duplicate('categorize', task, self._parsed_steps(
+            ai_prompts.category_prompt(task), 'categorize', ai_prompts.parse_category)))
+
+    def _effort_steps(self, task: dict):
+        hours, references = self.estimator.estimate(task)
+        if hours is not None:
+            return hours
+        return (yield from self._reuse_near_duplicate('estimate', task, self._parsed_steps(
+            ai_prompts.effort_prompt(task, references), 'estimate', ai_prompts.parse_effort)))
+
+    @staticmethod
+    def _parsed_steps(prompt: str, operation: str, parse):
+        return parse((yield (prompt, operation, parse)))
+
+    def _risk_steps(self, task: dict):
+        return (yield (ai_prompts.risk_prompt(task), 'risk_analysis'))
+
+    def _mitigation_steps(self, task: dict, risk_analysis: str):
+        return (yield (ai_prompts.mitigation_prompt(task, risk_analysis), 'risk_mitigation'))
+
+    def _audit_steps(self, task: dict, mode: str = None):
+        mode = resolve_audit_mode(mode)
+        exchanges = []
+        start = time.perf_counter()
+
+        def call(prompt, operation, parse=None):
+            response = yield (prompt, operation, parse)
+            exchanges.append((prompt, response))
+            return response
+
+        fallback = False
+        if mode == 'structured':
+            try:
+                result = ai_prompts.parse_structured_audit(
+                    (yield from call(ai_prompts.structured_audit_prompt(task), 'audit',
+                                    ai_prompts.parse_structured_audit)))
+            except ValueError:
+                fallback = True
+        if mode == 'chain' or fallback:
+            # Primera llamada: Análisis de riesgos
+            risk_analysis = yield from call(ai_prompts.risk_prompt(task), 'risk_analysis')
+
+            # Segunda llamada: Plan de mitigación basado en los riesgos detectados
+            risk_mitigation = yield from call(ai_prompts.mitigation_prompt(task, risk_analysis), 'risk_mitigation')
+            result = (risk_analysis, risk_mitigation)
+
+        self.audit_stats.record(mode, time.perf_counter() - start, exchanges, fallback)
+        return result
+
+    def _enrich_steps(self, operation: str, task: dict, mode: str = None):
+        result = dict(task)
+        if operation == 'describe':
+            result['description'] = yield from self._description_steps(task)
+        elif operation == 'categorize':
+            result['category'] = yield from self._category_steps(task)
+        elif operation == 'estimate':
+            result['effort_hours'] = yield from self._effort_steps(task)
+        elif operation == 'audit':
+            result['risk_analysis'], result['risk_mitigation'] = yield from self._audit_steps(task, mode)
+        else:
+            raise ValueError(f"Operación desconocida: {operation}")
+        return result
+
+
+class AIService(BaseAIService):
+    """
+    Servicio centralizado para interactuar con el LLM (Azure OpenAI por defecto).
+    Maneja generación de descripciones, categorización, estimación y análisis de riesgos.
+    """
+
+    def _call_llm(self, prompt: str, operation: str = None, parse=None) -> str:
         """
         Método interno para realizar llamadas al LLM.
+        La llamada usa el perfil de generación de la operación (temperatura,
+        max_tokens, secuencias de parada y formato de salida). Las
+        respuestas se guardan en caché por (modelo, mensaje de sistema,
+        prompt, perfil), y las peticiones concurrentes con la misma clave
+        comparten una única llamada al modelo (y su resultado o su error).
+        Los tokens y la latencia de cada llamada quedan en self.usage.
         
         Args:
             prompt: El prompt a enviar al modelo
+            operation: Operación de GENERATION_PROFILES (describe,
+                       categorize, estimate, risk_analysis,
+                       risk_mitigation o audit)
+            parse: Función que interpreta la respuesta; si lanza ValueError,
+                   la respuesta no se guarda en caché
             
         Returns:
             La respuesta del modelo como string
@@ -44,20 +439,83 @@ class AIService:
         Raises:
             Exception: Si hay error en la llamada al modelo
         """
+        cache_key, cached = self._cached_completion(prompt, operation)
+        if cached is not None:
+            return cached
+        return self.in_flight.do(cache_key, lambda: self._request_completion(prompt, cache_key, operation, parse))
+
+    def _request_completion(self, prompt: str, cache_key: str, operation: str = None, parse=None) -> str:
+        """
+        Llama al proveedor y guarda la respuesta con _store_completion. Se
+        guarda antes de liberar la llamada agrupada, para que quien llegue
+        justo después la encuentre en caché en lugar de repetirla.
+        """
+        profile = generation_profile(operation)
+        usage = {}
+        start = time.perf_counter()
         try:
-            response = self.client.chat.completions.create(
-                model=self.deployment,
-                messages=[
-                    {"role": "system", "content": "Eres un asistente experto en gestión de proyectos y desarrollo de software."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=500
-            )
-            return response.choices[0].message.content.strip()
-        except Exception as e:
-            raise Exception(f"Error al llamar a Azure OpenAI: {str(e)}")
+            content = self.provider.complete(completion_messages(prompt), profile["temperature"],
+                                             profile["max_tokens"], profile["response_format"],
+                                             stop=profile["stop"], usage=usage)
+        except Exception:
+            self.usage.record_error(operation)
+            raise
+        return self._store_completion(prompt, cache_key, operation, start, content, usage, parse)
+
+    def _run_steps(self, steps):
+        """
+        Ejecuta los pasos de una operación con llamadas bloqueantes al
+        modelo. Los errores de una llamada se lanzan dentro de los pasos.
+        """
+        try:
+            request = next(steps)
+            while True:
+                try:
+                    response = self._call_llm(*request)
+                except Exception as e:
+                    request = steps.throw(e)
+                else:
+                    request = steps.send(response)
+        except StopIteration as finished:
+            return finished.value
     
+    def _stream_llm(self, prompt: str, operation: str = None):
+        """
+        Versión en streaming de _call_llm: genera los fragmentos de texto a
+        medida que llegan del modelo y guarda la respuesta completa en caché.
+        Si la respuesta ya está en caché se entrega en un único fragmento.
+        No pasa por la agrupación de llamadas: cada cliente recibe su stream.
+        
+        Raises:
+            Exception: Si hay error en la llamada al modelo
+        """
+        cache_key, cached = self._cached_completion(prompt, operation)
+        if cached is not None:
+            yield cached
+            return
+
+        profile = generation_profile(operation)
+        parts = []
+        usage = {}
+        start = time.perf_counter()
+        try:
+            for token in self.provider.stream(completion_messages(prompt), profile["temperature"],
+                                              profile["max_tokens"], stop=profile["stop"], usage=usage):
+                parts.append(token)
+                yield token
+        except Exception:
+            self.usage.record_error(operation)
+            raise
+        self._store_completion(prompt, cache_key, operation, start, ''.join(parts).strip(), usage)
+
+    def _stream_field(self, field: str, prompt: str, result: dict, operation: str = None):
+        """Genera eventos ('token', ...) de un campo y deja el texto final en result[field]."""
+        parts = []
+        for token in self._stream_llm(prompt, operation):
+            parts.append(token)
+            yield ('token', {"field": field, "text": token})
+        result[field] = ''.join(parts).strip()
+
     def generate_description(self, task: dict) -> str:
         """
         Genera una descripción detallada para una tarea.
@@ -68,25 +526,13 @@ class AIService:
         Returns:
             Descripción generada como texto plano
         """
-        prompt = f"""Genera una descripción clara y concisa para la siguiente tarea:
-
-Título: {task.get('title', 'Sin título')}
-Prioridad: {task.get('priority', 'Sin prioridad')}
-Estado: {task.get('status', 'Sin estado')}
-Asignado a: {task.get('assigned_to', 'Sin asignar')}
-
-IMPORTANTE:
-- Devuelve SOLO texto plano, sin markdown
-- No uses asteriscos, guiones, ni listas
-- Máximo 2-3 oraciones
-- No incluyas títulos ni encabezados
-- Responde directamente con la descripción
-"""
-        return self._call_llm(prompt)
+        return self._run_steps(self._description_steps(task))
     
     def categorize_task(self, task: dict) -> str:
         """
-        Clasifica una tarea en una categoría específica.
+        Clasifica una tarea en una categoría específica. Si el clasificador
+        local está seguro responde él, sin llamar al LLM; si no, se reutiliza
+        la categoría de una tarea casi igual ya clasificada.
         
         Args:
             task: Diccionario con datos de la tarea
@@ -97,41 +543,14 @@ IMPORTANTE:
         Raises:
             ValueError: Si la categoría devuelta no es válida
         """
-        valid_categories = ['Frontend', 'Backend', 'Testing', 'Infra', 'DevOps']
-        
-        prompt = f"""Clasifica la siguiente tarea en UNA sola categoría.
-
-Título: {task.get('title', '')}
-Descripción: {task.get('description', '')}
-
-Categorías válidas:
-- Frontend
-- Backend
-- Testing
-- Infra
-- DevOps
-
-IMPORTANTE:
-- Responde SOLO con el nombre de la categoría
-- No agregues explicaciones ni texto adicional
-- Usa exactamente el formato: Frontend, Backend, Testing, Infra o DevOps
-"""
-        
-        category = self._call_llm(prompt).strip()
-        
-        # Validar que la categoría sea válida
-        if category not in valid_categories:
-            # Intentar encontrar una categoría válida en la respuesta
-            for valid_cat in valid_categories:
-                if valid_cat.lower() in category.lower():
-                    return valid_cat
-            raise ValueError(f"Categoría inválida recibida del LLM: {category}")
-        
-        return category
+        return self._run_steps(self._category_steps(task))
     
     def estimate_effort_hours(self, task: dict) -> float:
         """
-        Estima el esfuerzo en horas para completar una tarea.
+        Estima el esfuerzo en horas para completar una tarea. Si las tareas
+        completadas más parecidas coinciden lo bastante, se usa su media sin
+        llamar al LLM; si no, se reutiliza la estimación de una tarea casi
+        igual o se pregunta al LLM pasándole esas tareas como referencia.
         
         Args:
             task: Diccionario con datos de la tarea (title, description, category)
@@ -142,90 +561,88 @@ IMPORTANTE:
         Raises:
             ValueError: Si no se puede parsear un número válido de la respuesta
         """
-        prompt = f"""Estima el esfuerzo en horas necesario para completar la siguiente tarea:
+        return self._run_steps(self._effort_steps(task))
+    
+    def analyze_risks(self, task: dict) -> str:
+        """Primera llamada de la auditoría encadenada: análisis de riesgos."""
+        return self._run_steps(self._risk_steps(task))
 
-Título: {task.get('title', '')}
-Descripción: {task.get('description', '')}
-Categoría: {task.get('category', 'Sin categoría')}
+    def plan_mitigation(self, task: dict, risk_analysis: str) -> str:
+        """Segunda llamada de la auditoría encadenada: plan de mitigación de esos riesgos."""
+        return self._run_steps(self._mitigation_steps(task, risk_analysis))
 
-IMPORTANTE:
-- Responde SOLO con un número
-- Puede ser entero o decimal (ejemplo: 8 o 12.5)
-- No agregues palabras como "horas", "aproximadamente", etc.
-- Responde únicamente con el valor numérico
-"""
-        
-        response = self._call_llm(prompt)
-        
-        # Extraer el número de la respuesta usando regex
-        # Buscar patrones como: "12", "12.5", "12,5", "aproximadamente 12", etc.
-        numbers = re.findall(r'\d+[.,]?\d*', response)
-        
-        if not numbers:
-            raise ValueError(f"No se pudo extraer un número válido de la respuesta: {response}")
-        
-        # Tomar el primer número encontrado y convertirlo
-        try:
-            effort_str = numbers[0].replace(',', '.')
-            effort = float(effort_str)
-            
-            if effort < 0:
-                raise ValueError("El esfuerzo no puede ser negativo")
-            
-            return effort
-        except (ValueError, IndexError) as e:
-            raise ValueError(f"Error al parsear esfuerzo desde '{response}': {str(e)}")
-    
-    def audit_risks(self, task: dict) -> tuple[str, str]:
+    def audit_risks(self, task: dict, mode: str = None) -> tuple[str, str]:
         """
         Analiza riesgos de una tarea y genera un plan de mitigación.
-        Realiza DOS llamadas separadas al LLM.
+        En modo 'chain' realiza DOS llamadas separadas al LLM; en modo
+        'structured' UNA sola que devuelve ambos campos en JSON, y si la
+        respuesta no es válida repite la auditoría en modo 'chain'.
         
         Args:
             task: Diccionario con datos de la tarea
+            mode: 'chain' o 'structured' (por defecto AI_AUDIT_MODE)
             
         Returns:
             Tupla (risk_analysis, risk_mitigation)
+            
+        Raises:
+            ValueError: Si el modo no es válido
         """
-        # Primera llamada: Análisis de riesgos
-        risk_prompt = f"""Analiza los riesgos potenciales de la siguiente tarea:
-
-Título: {task.get('title', '')}
-Descripción: {task.get('description', '')}
-Categoría: {task.get('category', 'Sin categoría')}
-Prioridad: {task.get('priority', '')}
-Esfuerzo estimado: {task.get('effort_hours', 'Sin estimar')} horas
-
-Identifica los principales riesgos técnicos, de recursos o de tiempo.
+        return self._run_steps(self._audit_steps(task, mode))
 
-IMPORTANTE:
-- Responde en texto plano, sin markdown
-- No uses listas con guiones ni asteriscos
-- Máximo 3-4 oraciones
-- Se específico y conciso
-"""
-        
-        risk_analysis = self._call_llm(risk_prompt)
+    def stream_description(self, task: dict):
+        """
+        Igual que generate_description, pero en streaming.
         
-        # Segunda llamada: Plan de mitigación basado en los riesgos detectados
-        mitigation_prompt = f"""Basándote en los siguientes riesgos identificados, genera un plan de mitigación:
-
-TAREA:
-Título: {task.get('title', '')}
-Descripción: {task.get('description', '')}
+        Yields:
+            ('token', {"field": "description", "text": fragmento}) por cada
+            fragmento, y al final ('task', tarea con la descripción completa)
+        """
+        result = dict(task)
+        yield from self._stream_field('description', ai_prompts.description_prompt(task), result, 'describe')
+        yield ('task', result)
 
-RIESGOS IDENTIFICADOS:
-{risk_analysis}
+    def stream_audit(self, task: dict, mode: str = None):
+        """
+        Igual que audit_risks, pero en streaming: primero los fragmentos de
+        risk_analysis y después los de risk_mitigation. En modo 'structured'
+        el JSON no se puede mostrar a medias, así que cada campo llega en un
+        único fragmento cuando termina la llamada.
+        
+        Yields:
+            ('token', {"field": campo, "text": fragmento}) por cada fragmento,
+            y al final ('task', tarea con ambos campos completos)
+        """
+        mode = resolve_audit_mode(mode)
+        result = dict(task)
+        if mode == 'structured':
+            result['risk_analysis'], result['risk_mitigation'] = self.audit_risks(task, mode)
+            for field in ai_prompts.AUDIT_FIELDS:
+                yield ('token', {"field": field, "text": result[field]})
+            yield ('task', result)
+            return
 
-Proporciona acciones concretas para mitigar estos riesgos.
+        start = time.perf_counter()
+        risk_prompt = ai_prompts.risk_prompt(task)
+        yield from self._stream_field('risk_analysis', risk_prompt, result, 'risk_analysis')
+        mitigation_prompt = ai_prompts.mitigation_prompt(task, result['risk_analysis'])
+        yield from self._stream_field('risk_mitigation', mitigation_prompt, result, 'risk_mitigation')
+        self.audit_stats.record(mode, time.perf_counter() - start, [(risk_prompt, result['risk_analysis']),
+                                                                   (mitigation_prompt, result['risk_mitigation'])])
+        yield ('task', result)
 
-IMPORTANTE:
-- Responde en texto plano, sin markdown
-- No uses listas con guiones ni asteriscos
-- Máximo 3-4 oraciones
-- Proporciona acciones específicas y prácticas
-"""
-        
-        risk_mitigation = self._call_llm(mitigation_prompt)
+    def enrich_task(self, operation: str, task: dict, mode: str = None) -> dict:
+        """
+        Aplica una operación de IA a una tarea y devuelve una copia con los
+        campos generados.
         
-        return (risk_analysis, risk_mitigation)
+        Args:
+            operation: Una de BATCH_OPERATIONS
+            task: Diccionario con datos de la tarea
+            mode: Modo de la auditoría, 'chain' o 'structured' (por defecto AI_AUDIT_MODE)
+            
+        Returns:
+            La tarea con description, category, effort_hours o
+            risk_analysis/risk_mitigation completados
+        """
+        return self._run_steps(self._enrich_steps(operation, task, mode))
@@ -0,0 +1,182 @@
+import asyncio
+import os
+import threading
+import time
+from services.ai_service import BATCH_OPERATIONS, BaseAIService, completion_messages, generation_profile
+from services.single_flight import AsyncSingleFlight
+
+# Llamadas simultáneas al modelo por lote (por defecto y máximo). Con asyncio
+# cada llamada en curso es una corrutina, no un hilo, así que pueden ser cientos
+AI_ASYNC_CONCURRENCY = int(os.getenv('AI_ASYNC_CONCURRENCY', 64))
+MAX_ASYNC_CONCURRENCY = 256
+
+
+class BackgroundLoop:
+    """
+    Event loop de asyncio en un hilo propio (daemon).
+
+    Permite usar AsyncAIService desde código síncrono (rutas de Flask bajo
+    WSGI): run() envía la corrutina al loop y espera su resultado. Todas las
+    peticiones del proceso comparten el loop, y con él el pool de conexiones
+    del cliente. Tras un fork (workers de gunicorn) se crea un loop nuevo.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+                threading.Thread(target=self._loop.run_forever, name='ai-event-loop', daemon=True).start()
+            return self._loop
+
+    def run(self, coro):
+        """Ejecuta la corrutina en el loop y devuelve su resultado (o lanza su excepción)."""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_started()).result()
+
+
+class AsyncAIService(BaseAIService):
+    """
+    Variante asyncio de AIService (con Azure OpenAI usa AsyncAzureOpenAI).
+
+    Ofrece los mismos métodos como corrutinas (generate_description,
+    categorize_task, estimate_effort_hours, audit_risks) sobre los mismos
+    pasos de BaseAIService: solo cambia el transporte. El cliente asíncrono
+    del proveedor reutiliza sus conexiones HTTP entre todas las llamadas, y
+    la caché, el proveedor y los índices pueden compartirse con AIService.
+    """
+
+    single_flight_class = AsyncSingleFlight
+
+    def __init__(self, *args, **kwargs):
+        """Mismos argumentos que BaseAIService; añade el event loop para usarlo desde código síncrono."""
+        super().__init__(*args, **kwargs)
+        self.loop = BackgroundLoop()
+
+    def run(self, coro):
+        """
+        Ejecuta una corrutina del servicio desde código síncrono y espera su
+        resultado. Ejemplo: service.run(service.categorize_task(task))
+        """
+        return self.loop.run(coro)
+
+    async def _call_llm(self, prompt: str, operation: str = None, parse=None) -> str:
+        """
+        Versión asíncrona de AIService._call_llm: perfil de generación de
+        la operación, caché, agrupación de llamadas idénticas en curso,
+        llamada al modelo y registro de tokens y latencia.
+
+        Raises:
+            Exception: Si hay error en la llamada al modelo
+        """
+        cache_key, cached = self._cached_completion(prompt, operation)
+        if cached is not None:
+            return cached
+        return await self.in_flight.do(cache_key, lambda: self._request_completion(prompt, cache_key, operation, parse))
+
+    async def _request_completion(self, prompt: str, cache_key: str, operation: str = None,
+                                  parse=None) -> str:
+        """Llama al proveedor y guarda la respuesta con _store_completion."""
+        profile = generation_profile(operation)
+        usage = {}
+        start = time.perf_counter()
+        try:
+            content = await self.provider.acomplete(completion_messages(prompt), profile["temperature"],
+                                                    profile["max_tokens"], profile["response_format"],
+                                                    stop=profile["stop"], usage=usage)
+        except Exception:
+            self.usage.record_error(operation)
+            raise
+        return self._store_completion(prompt, cache_key, operation, start, content, usage, parse)
+
+    async def _run_steps(self, steps):
+        """Versión asíncrona de AIService._run_steps."""
+        try:
+            request = next(steps)
+            while True:
+                try:
+                    response = await self._call_llm(*request)
+                except Exception as e:
+                    request = steps.throw(e)
+                else:
+                    request = steps.send(response)
+        except StopIteration as finished:
+            return finished.value
+
+    async def generate_description(self, task: dict) -> str:
+        """Genera una descripción detallada para una tarea."""
+        return await self._run_steps(self._description_steps(task))
+
+    async def categorize_task(self, task: dict) -> str:
+        """
+        Clasifica una tarea en Frontend, Backend, Testing, Infra o DevOps
+        (con el clasificador local si está seguro).
+
+        Raises:
+            ValueError: Si la categoría devuelta no es válida
+        """
+        return await self._run_steps(self._category_steps(task))
+
+    async def estimate_effort_hours(self, task: dict) -> float:
+        """
+        Estima el esfuerzo en horas para completar una tarea (con el índice
+        kNN de tareas completadas si está seguro).
+
+        Raises:
+            ValueError: Si no se puede parsear un número válido de la respuesta
+        """
+        return await self._run_steps(self._effort_steps(task))
+
+    async def analyze_risks(self, task: dict) -> str:
+        """Primera llamada de la auditoría encadenada: análisis de riesgos."""
+        return await self._run_steps(self._risk_steps(task))
+
+    async def plan_mitigation(self, task: dict, risk_analysis: str) -> str:
+        """Segunda llamada de la auditoría encadenada: plan de mitigación de esos riesgos."""
+        return await self._run_steps(self._mitigation_steps(task, risk_analysis))
+
+    async def audit_risks(self, task: dict, mode: str = None) -> tuple[str, str]:
+        """
+        Analiza riesgos de una tarea y genera un plan de mitigación: dos
+        llamadas encadenadas al LLM ('chain') o una con salida JSON
+        ('structured', que repite en 'chain' si la respuesta no es válida).
+
+        Returns:
+            Tupla (risk_analysis, risk_mitigation)
+
+        Raises:
+            ValueError: Si el modo no es válido
+        """
+        return await self._run_steps(self._audit_steps(task, mode))
+
+    async def enrich_task(self, operation: str, task: dict, mode: str = None) -> dict:
+        """Aplica una operación de BATCH_OPERATIONS y devuelve una copia de la tarea."""
+        return await self._run_steps(self._enrich_steps(operation, task, mode))
+
+    async def run_batch(self, operation: str, tasks: list, concurrency: int = None, mode: str = None) -> list:
+        """
+        Aplica una operación a varias tareas con como mucho `concurrency`
+        llamadas en curso a la vez (por defecto AI_ASYNC_CONCURRENCY, como
+        máximo MAX_ASYNC_CONCURRENCY). `mode` es el modo de la auditoría.
+
+        Returns:
+            Lista en el mismo orden que la entrada; cada elemento es
+            {"task": tarea enriquecida} o {"error": mensaje}
+        """
+        if operation not in BATCH_OPERATIONS:
+            raise ValueError(f"Operación desconocida: {operation}")
+
+        limit = asyncio.Semaphore(min(max(1, concurrency or AI_ASYNC_CONCURRENCY), MAX_ASYNC_CONCURRENCY))
+
+        async def enrich(task):
+            async with limit:
+                try:
+                    return {"task": await self.enrich_task(operation, task, mode)}
+                except Exception as e:
+                    return {"error": str(e)}
+
+        return list(await asyncio.gather(*(enrich(task) for task in tasks)))
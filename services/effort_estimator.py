@@ -0,0 +1,208 @@
+"""
+Estimación de esfuerzo por vecinos más cercanos (kNN) para
+estimate_effort_hours.
+
+Cada tarea completada con effort_hours se guarda como un vector (bolsa de
+palabras del título, la descripción y la categoría, con hashing) en una
+matriz de NumPy. Estimar es un producto matriz-vector: la media de horas
+de las k tareas más parecidas, ponderada por su similitud coseno. El
+índice se mantiene al día con TaskManager.add_listener, así que cada alta,
+modificación o borrado solo actualiza una fila.
+
+NumPy se importa en el primer uso, como el SDK de openai: no retrasa el
+arranque de la app.
+"""
+import os
+import threading
+import zlib
+from managers.task_manager import TaskManager
+from services.local_classifier import tokenize
+
+# Vecinos que se promedian y confianza mínima (0-1) para no llamar al LLM
+# (1 desactiva el atajo; los vecinos se siguen pasando al LLM como contexto)
+EFFORT_KNN_K = int(os.getenv('EFFORT_KNN_K', 5))
+EFFORT_KNN_THRESHOLD = float(os.getenv('EFFORT_KNN_THRESHOLD', 0.6))
+
+# Dimensiones del vector (hashing de palabras) y peso de la categoría
+EFFORT_VECTOR_DIMENSIONS = 512
+CATEGORY_WEIGHT = 2.0
+
+# Solo las tareas terminadas tienen un esfuerzo fiable
+COMPLETED_STATUS = 'completada'
+
+
+def _numpy():
+    import numpy
+    return numpy
+
+
+class EffortEstimator:
+    """
+    Índice kNN incremental de tareas completadas.
+
+    Implementa la interfaz de listener de TaskManager (rebuild, add,
+    replace, remove). Las filas de tareas borradas quedan a cero y se
+    reutilizan; la matriz dobla su capacidad cuando se llena.
+
+    La confianza de una estimación es la similitud media de los vecinos
+    multiplicada por su acuerdo (1 - desviación típica relativa de sus
+    horas): vecinos muy parecidos con horas dispares no bastan.
+    """
+
+    def __init__(self, k=EFFORT_KNN_K, threshold=EFFORT_KNN_THRESHOLD, dimensions=EFFORT_VECTOR_DIMENSIONS):
+        self.k = k
+        self.threshold = threshold
+        self.dimensions = dimensions
+        self.served_locally = 0
+        self.llm_fallbacks = 0
+        self._np = None
+        self._vectors = None  # matriz (capacidad x dimensiones) float32
+        self._efforts = None
+        self._titles = []
+        self._rows = {}  # id de tarea -> fila
+        self._free_rows = []
+        self._size = 0  # filas usadas, incluidas las libres
+        self._lock = threading.Lock()
+        self._attach_lock = threading.Lock()
+        self._attached = False
+
+    @property
+    def enabled(self):
+        return self.threshold < 1
+
+    def _ensure_attached(self):
+        """Carga NumPy y se registra en TaskManager (que lo llena con las tareas actuales)."""
+        if self._attached:
+            return
+        with self._attach_lock:
+            if not self._attached:
+                self._np = _numpy()
+                TaskManager.add_listener(self)
+                self._attached = True
+
+    def vectorize(self, task: dict):
+        """Vector normalizado (L2) de la tarea, o None si no tiene texto."""
+        np = self._np
+        tokens = tokenize(str(task.get('title') or '')) + tokenize(str(task.get('description') or ''))
+        buckets = [zlib.crc32(token.encode('utf-8')) % self.dimensions for token in tokens]
+        weights = [1.0] * len(buckets)
+        if task.get('category'):
+            buckets.append(zlib.crc32(f"categoria:{task['category']}".encode('utf-8')) % self.dimensions)
+            weights.append(CATEGORY_WEIGHT)
+        if not buckets:
+            return None
+        vector = np.bincount(buckets, weights, minlength=self.dimensions).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    # Interfaz de listener de TaskManager (se llama con el lock del almacén)
+
+    def rebuild(self, tasks):
+        np = self._np
+        tasks = list(tasks)
+        capacity = max(64, len(tasks))
+        with self._lock:
+            self._vectors = np.zeros((capacity, self.dimensions), dtype=np.float32)
+            self._efforts = np.zeros(capacity, dtype=np.float64)
+            self._titles = []
+            self._rows = {}
+            self._free_rows = []
+            self._size = 0
+        for task in tasks:
+            self.add(task)
+
+    def add(self, task):
+        try:
+            effort = float(task.effort_hours)
+        except (TypeError, ValueError):
+            return
+        if task.status != COMPLETED_STATUS or effort <= 0:
+            return
+        vector = self.vectorize(task.to_dict())
+        if vector is None:
+            return
+
+        np = self._np
+        with self._lock:
+            if self._free_rows:
+                row = self._free_rows.pop()
+            else:
+                row = self._size
+                self._size += 1
+                if row == len(self._vectors):
+                    self._vectors = np.concatenate([self._vectors, np.zeros_like(self._vectors)])
+                    self._efforts = np.concatenate([self._efforts, np.zeros_like(self._efforts)])
+                self._titles.append(None)
+            self._vectors[row] = vector
+            self._efforts[row] = effort
+            self._titles[row] = task.title
+            self._rows[task.id] = row
+
+    def remove(self, task):
+        with self._lock:
+            row = self._rows.pop(task.id, None)
+            if row is not None:
+                self._vectors[row] = 0.0
+                self._titles[row] = None
+                self._free_rows.append(row)
+
+    def replace(self, old_task, new_task):
+        self.remove(old_task)
+        self.add(new_task)
+
+    def neighbours(self, task: dict) -> list:
+        """Hasta k tareas completadas más parecidas: [{"title", "effort_hours", "similarity"}]."""
+        self._ensure_attached()
+        vector = self.vectorize(task)
+        if vector is None:
+            return []
+
+        np = self._np
+        with self._lock:
+            if not self._rows:
+                return []
+            similarities = self._vectors[:self._size] @ vector
+            k = min(self.k, len(self._rows))
+            top = np.argpartition(-similarities, k - 1)[:k]
+            top = top[np.argsort(-similarities[top])]
+            return [{"title": self._titles[row], "effort_hours": float(self._efforts[row]),
+                     "similarity": round(float(similarities[row]), 3)}
+                    for row in top if similarities[row] > 0]
+
+    @staticmethod
+    def combine(neighbours: list) -> tuple:
+        """(horas, confianza) a partir de los vecinos: media ponderada por similitud."""
+        weights = [neighbour["similarity"] for neighbour in neighbours]
+        efforts = [neighbour["effort_hours"] for neighbour in neighbours]
+        total = sum(weights)
+        hours = sum(w * e for w, e in zip(weights, efforts)) / total
+        spread = (sum(w * (e - hours) ** 2 for w, e in zip(weights, efforts)) / total) ** 0.5 / hours
+        confidence = total / len(weights) * max(0.0, 1 - spread)
+        # Al medio punto más cercano, como las estimaciones habituales
+        return max(0.5, round(hours * 2) / 2), confidence
+
+    def estimate(self, task: dict) -> tuple:
+        """
+        Devuelve (horas, vecinos): horas es None si la confianza no llega al
+        umbral y hay que preguntar al LLM, que recibe los vecinos como
+        referencia. Lleva la cuenta de ambos casos.
+        """
+        neighbours = self.neighbours(task)
+        if self.enabled and neighbours:
+            hours, confidence = self.combine(neighbours)
+            if confidence >= self.threshold:
+                self.served_locally += 1
+                return hours, neighbours
+        self.llm_fallbacks += 1
+        return None, neighbours
+
+    def stats(self) -> dict:
+        """Tareas indexadas y estimaciones resueltas sin el LLM."""
+        total = self.served_locally + self.llm_fallbacks
+        return {
+            "k": self.k,
+            "threshold": self.threshold,
+            "indexed_tasks": len(self._rows) if self._attached else None,
+            "served_locally": self.served_locally,
+            "llm_fallbacks": self.llm_fallbacks,
+            "local_fraction": round(self.served_locally / total, 3) if total else None
+        }
@@ -0,0 +1,151 @@
+"""
+Enriquecimiento completo de una tarea (POST /ai/tasks/enrich).
+
+Los pasos de IA forman un grafo de dependencias: la categoría y el
+análisis de riesgos solo necesitan la descripción, la estimación necesita
+además la categoría y la mitigación necesita los riesgos. Cada paso se
+lanza como corrutina de AsyncAIService en cuanto terminan los pasos de los
+que depende, así que el tiempo total se acerca al del camino crítico
+(describe → categorize → estimate) y no a la suma de las cinco llamadas.
+Los pasos cuyos campos ya trae la tarea no se ejecutan.
+"""
+import asyncio
+import time
+from managers.task_manager import TaskManager
+from services.ai_prompts import AUDIT_FIELDS
+from services.ai_service import resolve_audit_mode
+
+# Pasos en orden topológico: campos que generan y campos que necesitan
+ENRICH_STEPS = {
+    'describe': {"fields": ('description',), "requires": ()},
+    'categorize': {"fields": ('category',), "requires": ('description',)},
+    'risk_analysis': {"fields": ('risk_analysis',), "requires": ('description',)},
+    'estimate': {"fields": ('effort_hours',), "requires": ('description', 'category')},
+    'risk_mitigation': {"fields": ('risk_mitigation',), "requires": ('risk_analysis',)}
+}
+
+# En modo 'structured' la auditoría completa es un único paso
+STRUCTURED_AUDIT_STEP = {"fields": AUDIT_FIELDS, "requires": ('description',)}
+
+STEP_STATUSES = ('completed', 'skipped', 'failed', 'blocked')
+
+
+def has_field(task: dict, field: str) -> bool:
+    """
+    Indica si la tarea ya tiene el campo. Un texto vacío cuenta como
+    ausente, y un effort_hours de 0 como sin estimar.
+    """
+    value = task.get(field)
+    if field == 'effort_hours':
+        try:
+            return float(value) > 0
+        except (TypeError, ValueError):
+            return False
+    if isinstance(value, str):
+        return bool(value.strip())
+    return value is not None
+
+
+def pipeline_steps(task: dict, audit_mode: str = None) -> dict:
+    """
+    Grafo de pasos para la tarea. En modo 'structured', si faltan los dos
+    campos de la auditoría, risk_analysis y risk_mitigation se sustituyen
+    por un paso 'audit' de una sola llamada.
+
+    Raises:
+        ValueError: Si el modo de auditoría no es válido
+    """
+    steps = dict(ENRICH_STEPS)
+    if resolve_audit_mode(audit_mode) == 'structured' and not any(has_field(task, f) for f in AUDIT_FIELDS):
+        del steps['risk_analysis'], steps['risk_mitigation']
+        steps['audit'] = STRUCTURED_AUDIT_STEP
+    return steps
+
+
+async def run_step(service, name: str, task: dict) -> dict:
+    """Ejecuta un paso con AsyncAIService y devuelve los campos que genera."""
+    if name == 'describe':
+        return {"description": await service.generate_description(task)}
+    if name == 'categorize':
+        return {"category": await service.categorize_task(task)}
+    if name == 'estimate':
+        return {"effort_hours": await service.estimate_effort_hours(task)}
+    if name == 'risk_analysis':
+        return {"risk_analysis": await service.analyze_risks(task)}
+    if name == 'risk_mitigation':
+        return {"risk_mitigation": await service.plan_mitigation(task, task['risk_analysis'])}
+    if name == 'audit':
+        risk_analysis, risk_mitigation = await service.audit_risks(task, 'structured')
+        return {"risk_analysis": risk_analysis, "risk_mitigation": risk_mitigation}
+    raise ValueError(f"Paso desconocido: {name}")
+
+
+async def enrich_pipeline(service, task: dict, audit_mode: str = None) -> dict:
+    """
+    Completa los campos de IA que le falten a la tarea, con los pasos
+    independientes en paralelo. Un paso que falla no detiene a los demás;
+    los que dependen de él quedan 'blocked'.
+
+    Args:
+        service: AsyncAIService con el que se ejecutan los pasos
+        task: Diccionario con datos de la tarea
+        audit_mode: 'chain' o 'structured' (por defecto AI_AUDIT_MODE)
+
+    Returns:
+        {"task": tarea enriquecida, "steps": {paso: {"status", "ms"?, "error"?}},
+         "elapsed_ms": tiempo total, "sequential_ms": suma de los pasos}
+    """
+    steps = pipeline_steps(task, audit_mode)
+    result = dict(task)
+    report = {}
+    pending = [name for name, step in steps.items() if not all(has_field(task, f) for f in step['fields'])]
+    producers = {field: name for name in pending for field in steps[name]['fields']}
+    runs = {}
+
+    async def run(name):
+        dependencies = {producers[field] for field in steps[name]['requires'] if field in producers}
+        outcomes = await asyncio.gather(*(runs[dependency] for dependency in dependencies))
+        if not all(outcomes):
+            report[name] = {"status": "blocked"}
+            return False
+        start = time.perf_counter()
+        try:
+            # Cada paso ve una copia: los que corren en paralelo no se pisan
+            result.update(await run_step(service, name, dict(result)))
+        except Exception as e:
+            report[name] = {"status": "failed", "ms": round((time.perf_counter() - start) * 1000, 1),
+                            "error": str(e)}
+            return False
+        report[name] = {"status": "completed", "ms": round((time.perf_counter() - start) * 1000, 1)}
+        return True
+
+    start = time.perf_counter()
+    # En orden topológico: cuando un paso arranca, ya existen los de los que depende
+    for name in pending:
+        runs[name] = asyncio.ensure_future(run(name))
+    await asyncio.gather(*runs.values())
+    elapsed = time.perf_counter() - start
+
+    steps_report = {name: report.get(name, {"status": "skipped"}) for name in steps}
+    return {
+        "task": result,
+        "steps": steps_report,
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "sequential_ms": round(sum(step.get("ms", 0) for step in steps_report.values()), 1)
+    }
+
+
+def persist_enrichment(task_id: str, enrichment: dict):
+    """
+    Guarda en la tarea task_id los campos generados por los pasos
+    completados. Devuelve la tarea guardada o None si ya no existe.
+    """
+    task = enrichment['task']
+    step_fields = dict({name: step['fields'] for name, step in ENRICH_STEPS.items()},
+                       audit=STRUCTURED_AUDIT_STEP['fields'])
+    fields = {field: task[field]
+              for name, step in enrichment['steps'].items() if step['status'] == 'completed'
+              for field in step_fields[name]}
+    if not fields:
+        return TaskManager.get_task(task_id)
+    return TaskManager.patch_task(task_id, fields)
@@ -0,0 +1,182 @@
+"""
+Servidor HTTP local que imita chat.completions de Azure OpenAI.
+
+Responde con FakeLLMProvider (respuestas deterministas, latencia, variación
+y tasa de errores configurables) a cualquier POST .../chat/completions, así
+que la app puede usar el cliente real de Azure contra él:
+
+    python -m services.fake_llm_server --port 8001 --latency-ms 200 --jitter-ms 50
+
+    AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8001 python app.py
+
+Con "stream": true responde con eventos SSE (chat.completion.chunk), y con
+"stream_options": {"include_usage": true} añade un último fragmento con
+los tokens. Los
+errores simulados se devuelven como 500, que ResilientProvider reintenta
+(services/resilience.py).
+"""
+import argparse
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from services.llm_providers import FakeLLMProvider
+
+
+class FakeChatCompletionsHandler(BaseHTTPRequestHandler):
+    """Atiende POST .../chat/completions con el proveedor del servidor."""
+
+    protocol_version = 'HTTP/1.1'
+    # Cabeceras y cuerpo van en escrituras separadas: sin esto el ACK
+    # retardado de TCP añade ~40 ms a cada respuesta
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            return self._send(400, {"error": {"message": "JSON inválido", "type": "invalid_request_error"}})
+
+        if not self.path.split('?')[0].endswith('/chat/completions'):
+            return self._send(404, {"error": {"message": "Ruta no encontrada", "type": "invalid_request_error"}})
+
+        messages = body.get('messages') or []
+        if not messages:
+            return self._send(400, {"error": {"message": "Faltan messages", "type": "invalid_request_error"}})
+
+        if body.get('stream'):
+            return self._send_stream(body, messages)
+
+        usage = {}
+        try:
+            content = self.server.provider.complete(messages, body.get('temperature'), body.get('max_tokens'),
+                                                   body.get('response_format'), stop=body.get('stop'), usage=usage)
+        except Exception as e:
+            return self._send(500, {"error": {"message": str(e), "type": "server_error"}})
+
+        if not usage:
+            usage = FakeLLMProvider.count_usage(messages, content)
+        prompt_tokens, completion_tokens = usage["prompt_tokens"], usage["completion_tokens"]
+        self._send(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', FakeLLMProvider.model),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+
+    def _send_stream(self, body, messages):
+        """Respuesta stream=True: fragmentos chat.completion.chunk como eventos SSE."""
+        try:
+            # El error simulado se decide antes de empezar, como un 500 real
+            usage = {}
+            tokens = self.server.provider.stream(messages, body.get('temperature'), body.get('max_tokens'),
+                                                 stop=body.get('stop'), usage=usage)
+            first = next(tokens)
+        except Exception as e:
+            return self._send(500, {"error": {"message": str(e), "type": "server_error"}})
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        # Sin Content-Length: la conexión se cierra al terminar el stream
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def chunk(delta, finish_reason=None):
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get('model', FakeLLMProvider.model),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+
+        self._send_event(chunk({"role": "assistant", "content": first}))
+        parts = []
+        for token in tokens:
+            parts.append(token)
+            self._send_event(chunk({"content": token}))
+        self._send_event(chunk({}, "stop"))
+        if (body.get('stream_options') or {}).get('include_usage'):
+            content = first + ''.join(parts)
+            if not usage:
+                usage = FakeLLMProvider.count_usage(messages, content)
+            final = dict(chunk({}), choices=[], usage={
+                "prompt_tokens": usage["prompt_tokens"],
+                "completion_tokens": usage["completion_tokens"],
+                "total_tokens": usage["prompt_tokens"] + usage["completion_tokens"]
+            })
+            self._send_event(final)
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def _send_event(self, payload):
+        self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+    def _send(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Sin un log por petición: en pruebas de carga solo añade ruido
+        pass
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    """Un hilo por conexión y una cola de conexiones amplia para pruebas de carga."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def make_server(host='127.0.0.1', port=8001, provider=None):
+    """Crea el servidor; port=0 elige un puerto libre."""
+    server = FakeLLMServer((host, port), FakeChatCompletionsHandler)
+    server.provider = provider if provider is not None else FakeLLMProvider.from_env()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local que imita chat.completions de Azure OpenAI")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency-ms', type=float, default=200)
+    parser.add_argument('--jitter-ms', type=float, default=50)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    provider = FakeLLMProvider(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+    server = make_server(args.host, args.port, provider)
+    print(f"Servidor LLM simulado en http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
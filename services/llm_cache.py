@@ -0,0 +1,174 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from managers.file_lock import FileLock
+
+
+class LLMCache:
+    """
+    Caché de respuestas del LLM con expulsión LRU y caducidad (TTL).
+
+    Las claves son un hash de todos los parámetros que determinan la
+    respuesta (deployment, mensaje de sistema, prompt, temperatura, etc.).
+    Es segura para usar desde varios hilos.
+
+    Opcionalmente se guarda en un archivo JSON para sobrevivir a reinicios.
+    Las escrituras no van al disco en cada set: se marcan como pendientes
+    y se vuelcan juntas como mucho `flush_seconds` después (y al salir del
+    proceso), fuera del lock de la caché. El volcado toma un bloqueo de
+    archivo y mezcla lo que hayan guardado otros procesos, de modo que
+    varios workers con el mismo archivo no se pisan.
+    """
+
+    def __init__(self, max_entries=1000, ttl_seconds=3600, path=None, flush_seconds=5):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # clave -> (expira_en, valor)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._cleared = False  # el próximo volcado reemplaza el archivo en vez de mezclar
+        self._flush_timer = None
+        if path:
+            self._file_lock = FileLock(path + '.lock')
+            self._flush_lock = threading.Lock()
+            self._load()
+            atexit.register(self.flush)
+
+    @staticmethod
+    def make_key(*parts):
+        """Hash estable de los parámetros de una llamada."""
+        content = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        """Devuelve el valor cacheado o None si no existe o ha caducado."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Guarda un valor, expulsando las entradas menos usadas si hace falta."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self.path:
+                self._schedule_flush()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+            if self.path:
+                self._cleared = True
+                self._schedule_flush()
+
+    def stats(self):
+        """Contadores de uso de la caché."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0
+            }
+
+    def _schedule_flush(self):
+        """Marca cambios pendientes y programa un volcado. Requiere el lock tomado."""
+        self._dirty = True
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_seconds, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        """
+        Vuelca a disco los cambios pendientes. Se mezclan con las entradas
+        vigentes que ya tenga el archivo (de otros procesos); las de esta
+        caché son las más recientes y, si sobran, se descartan las más
+        antiguas del archivo.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._dirty:
+                return
+            entries = list(self._entries.items())
+            replace = self._cleared
+            self._dirty = self._cleared = False
+
+        with self._flush_lock, self._file_lock.exclusive():
+            merged = OrderedDict() if replace else self._read_file()
+            for key, entry in entries:
+                merged.pop(key, None)
+                merged[key] = entry
+            while len(merged) > self.max_entries:
+                merged.popitem(last=False)
+            self._write_file(merged)
+
+    def _read_file(self):
+        """Entradas vigentes del archivo, en el orden guardado (vacío si no existe o es ilegible)."""
+        entries = OrderedDict()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return entries
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"Error al leer la caché del LLM: {e}")
+            return entries
+
+        now = time.time()
+        for key, expires_at, value in data:
+            if expires_at >= now:
+                entries[key] = (expires_at, value)
+        return entries
+
+    def _load(self):
+        """Carga las entradas vigentes desde el archivo (si existe)."""
+        with self._file_lock.shared():
+            self._entries = self._read_file()
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _write_file(self, entries):
+        """Escribe las entradas en disco (temporal + rename). Requiere el bloqueo de archivo."""
+        data = [[key, expires_at, value] for key, (expires_at, value) in entries.items()]
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except IOError as e:
+            print(f"Error al guardar la caché del LLM: {e}")
@@ -0,0 +1,352 @@
+"""
+Proveedores de LLM detrás de AIService y AsyncAIService.
+
+- AzureOpenAIProvider: Azure OpenAI real (variables AZURE_OPENAI_*).
+- FakeLLMProvider: respuestas deterministas en el propio proceso, con
+  latencia, variación y tasa de errores configurables; sirve para pruebas
+  de carga y benchmarks sin credenciales. services/fake_llm_server.py lo
+  expone además como servidor HTTP con la forma de chat.completions.
+
+Se elige con LLM_PROVIDER=azure (por defecto) o LLM_PROVIDER=fake.
+El SDK de openai solo se importa al crear AzureOpenAIProvider: tarda en
+cargar y el proveedor fake (o un worker que solo sirve CRUD) no lo necesita.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from services.ai_prompts import VALID_CATEGORIES
+
+
+class LLMProviderError(Exception):
+    """
+    Error de una llamada al proveedor.
+
+    retryable indica si tiene sentido reintentar (429, 5xx, timeouts,
+    errores de conexión) y retry_after, si el proveedor lo indicó, cuántos
+    segundos esperar antes de hacerlo.
+    """
+
+    def __init__(self, message, retryable=False, retry_after=None, status_code=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+class LLMConfigurationError(LLMProviderError, ValueError):
+    """Falta configuración del proveedor (p. ej. las variables AZURE_OPENAI_*)."""
+
+
+def load_azure_settings() -> tuple:
+    """
+    Lee la configuración de Azure OpenAI de las variables de entorno.
+
+    Returns:
+        Tupla (api_key, endpoint, deployment, api_version)
+
+    Raises:
+        LLMConfigurationError: Si falta alguna variable
+    """
+    settings = (
+        os.getenv('AZURE_OPENAI_API_KEY'),
+        os.getenv('AZURE_OPENAI_ENDPOINT'),
+        os.getenv('AZURE_OPENAI_DEPLOYMENT'),
+        os.getenv('AZURE_OPENAI_API_VERSION')
+    )
+
+    # Validar que todas las variables estén configuradas
+    if not all(settings):
+        raise LLMConfigurationError(
+            "Faltan variables de entorno requeridas: "
+            "AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT, "
+            "AZURE_OPENAI_DEPLOYMENT, AZURE_OPENAI_API_VERSION"
+        )
+    return settings
+
+
+def _openai():
+    """
+    Módulo openai para gestionar sus excepciones. Cuando se usa ya está
+    importado (lo importa AzureOpenAIProvider); en una cláusula except la
+    expresión solo se evalúa si hay una excepción.
+    """
+    import openai
+    return openai
+
+
+def azure_error(e: Exception) -> LLMProviderError:
+    """Convierte una excepción del cliente de openai en LLMProviderError."""
+    openai = _openai()
+    status_code = getattr(e, 'status_code', None)
+    retryable = (isinstance(e, openai.APIConnectionError)
+                 or status_code in (408, 409, 429)
+                 or (status_code is not None and status_code >= 500))
+
+    retry_after = None
+    response = getattr(e, 'response', None)
+    if response is not None:
+        headers = response.headers
+        try:
+            if headers.get('retry-after-ms'):
+                retry_after = float(headers['retry-after-ms']) / 1000
+            elif headers.get('retry-after'):
+                retry_after = float(headers['retry-after'])
+        except ValueError:
+            # Retry-After como fecha HTTP: se usa el backoff propio
+            pass
+
+    return LLMProviderError(f"Error al llamar a Azure OpenAI: {str(e)}", retryable=retryable,
+                            retry_after=retry_after, status_code=status_code)
+
+
+class LLMProvider:
+    """
+    Interfaz de un proveedor: recibe los mensajes de chat y devuelve el
+    texto de la respuesta (complete, acomplete) o lo va entregando por
+    fragmentos a medida que se genera (stream). `model` identifica el
+    modelo en la clave de caché. response_format={"type": "json_object"}
+    pide una respuesta JSON a los modelos que lo admiten, y `stop` son
+    secuencias en las que el modelo deja de generar.
+
+    Si se pasa un dict en `usage`, el proveedor anota en él los tokens que
+    informa la API (prompt_tokens, completion_tokens) y el motivo de fin
+    (finish_reason: 'stop' o 'length' si se agotó max_tokens).
+    """
+
+    name = None
+    model = None
+
+    def complete(self, messages: list, temperature: float, max_tokens: int, response_format: dict = None,
+                 stop: list = None, usage: dict = None) -> str:
+        raise NotImplementedError
+
+    def stream(self, messages: list, temperature: float, max_tokens: int, stop: list = None, usage: dict = None):
+        """Generador de fragmentos de texto de la respuesta."""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        """Estado interno del proveedor (vacío si no tiene)."""
+        return {}
+
+    async def acomplete(self, messages: list, temperature: float, max_tokens: int,
+                        response_format: dict = None, stop: list = None, usage: dict = None) -> str:
+        raise NotImplementedError
+
+
+def record_usage(usage: dict, reported, finish_reason=None):
+    """Copia en `usage` (si no es None) los tokens de la respuesta de la API."""
+    if usage is None:
+        return
+    if reported is not None:
+        usage["prompt_tokens"] = reported.prompt_tokens
+        usage["completion_tokens"] = reported.completion_tokens
+    if finish_reason is not None:
+        usage["finish_reason"] = finish_reason
+
+
+class AzureOpenAIProvider(LLMProvider):
+    """Azure OpenAI con un cliente síncrono y otro asíncrono (cada uno con su pool)."""
+
+    name = 'azure'
+
+    def __init__(self, api_key, endpoint, deployment, api_version):
+        from openai import AsyncAzureOpenAI, AzureOpenAI
+
+        self.model = deployment
+        # Sin reintentos del SDK: los gestiona ResilientProvider (services/resilience.py)
+        self.client = AzureOpenAI(api_key=api_key, api_version=api_version,
+                                  azure_endpoint=endpoint, max_retries=0)
+        self.async_client = AsyncAzureOpenAI(api_key=api_key, api_version=api_version,
+                                             azure_endpoint=endpoint, max_retries=0)
+
+    @classmethod
+    def from_env(cls):
+        return cls(*load_azure_settings())
+
+    @staticmethod
+    def _options(response_format=None, stop=None):
+        """Parámetros opcionales de chat.completions.create."""
+        options = {}
+        if response_format:
+            options["response_format"] = response_format
+        if stop:
+            options["stop"] = stop
+        return options
+
+    def complete(self, messages, temperature, max_tokens, response_format=None, stop=None, usage=None):
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                **self._options(response_format, stop)
+            )
+            record_usage(usage, response.usage, response.choices[0].finish_reason)
+            return response.choices[0].message.content.strip()
+        except _openai().OpenAIError as e:
+            raise azure_error(e)
+        except Exception as e:
+            raise LLMProviderError(f"Error al llamar a Azure OpenAI: {str(e)}")
+
+    def stream(self, messages, temperature, max_tokens, stop=None, usage=None):
+        options = self._options(stop=stop)
+        if usage is not None:
+            # Los tokens llegan en un último fragmento sin choices
+            options["stream_options"] = {"include_usage": True}
+        try:
+            chunks = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+                **options
+            )
+            for chunk in chunks:
+                if getattr(chunk, 'usage', None) is not None:
+                    record_usage(usage, chunk.usage)
+                # Azure envía fragmentos sin choices (p. ej. filtros de contenido)
+                if not chunk.choices:
+                    continue
+                if chunk.choices[0].finish_reason:
+                    record_usage(usage, None, chunk.choices[0].finish_reason)
+                if chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except _openai().OpenAIError as e:
+            raise azure_error(e)
+        except Exception as e:
+            raise LLMProviderError(f"Error al llamar a Azure OpenAI: {str(e)}")
+
+    async def acomplete(self, messages, temperature, max_tokens, response_format=None, stop=None, usage=None):
+        try:
+            response = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                **self._options(response_format, stop)
+            )
+            record_usage(usage, response.usage, response.choices[0].finish_reason)
+            return response.choices[0].message.content.strip()
+        except _openai().OpenAIError as e:
+            raise azure_error(e)
+        except Exception as e:
+            raise LLMProviderError(f"Error al llamar a Azure OpenAI: {str(e)}")
+
+
+class FakeLLMProvider(LLMProvider):
+    """
+    Proveedor local determinista: la misma petición produce siempre la
+    misma respuesta, con un formato que los parsers de AIService aceptan
+    (una categoría válida, un número de horas, el JSON de la auditoría en
+    una llamada o texto plano).
+
+    La latencia es `latency` ± `jitter` segundos, y una fracción
+    `error_rate` de las llamadas falla, para medir el comportamiento ante
+    errores del proveedor. Respeta `stop` y cuenta los tokens como
+    palabras (igual que el servidor simulado).
+    """
+
+    name = 'fake'
+    model = 'fake'
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+    @classmethod
+    def from_env(cls):
+        seed = os.getenv('FAKE_LLM_SEED')
+        return cls(
+            latency=float(os.getenv('FAKE_LLM_LATENCY_MS', 200)) / 1000,
+            jitter=float(os.getenv('FAKE_LLM_JITTER_MS', 50)) / 1000,
+            error_rate=float(os.getenv('FAKE_LLM_ERROR_RATE', 0)),
+            seed=int(seed) if seed else None
+        )
+
+    @staticmethod
+    def answer(messages: list) -> str:
+        """Respuesta determinista para unos mensajes (sin latencia ni errores)."""
+        prompt = messages[-1]["content"]
+        digest = int(hashlib.sha256(prompt.encode('utf-8')).hexdigest(), 16)
+        if prompt.startswith("Clasifica"):
+            return VALID_CATEGORIES[digest % len(VALID_CATEGORIES)]
+        if prompt.startswith("Estima"):
+            return str(1 + digest % 40)
+        if prompt.startswith("Audita"):
+            return json.dumps({
+                "risk_analysis": f"Riesgo simulado {digest % 10**8:08d} para la tarea solicitada.",
+                "risk_mitigation": f"Mitigación simulada {digest % 10**8:08d} para la tarea solicitada."
+            }, ensure_ascii=False)
+        return f"Respuesta simulada {digest % 10**8:08d} para la tarea solicitada."
+
+    @staticmethod
+    def apply_stop(text: str, stop: list = None) -> str:
+        """Corta el texto en la primera secuencia de parada, como el modelo."""
+        for sequence in stop or ():
+            text = text.split(sequence, 1)[0]
+        return text
+
+    @staticmethod
+    def count_usage(messages: list, content: str) -> dict:
+        """Tokens (palabras) de la petición y de la respuesta."""
+        return {
+            "prompt_tokens": sum(len(str(message.get('content', '')).split()) for message in messages),
+            "completion_tokens": len(content.split()),
+            "finish_reason": "stop"
+        }
+
+    def _respond(self, messages, stop, usage):
+        content = self.apply_stop(self.answer(messages), stop)
+        if usage is not None:
+            usage.update(self.count_usage(messages, content))
+        return content
+
+    def next_delay(self) -> float:
+        """Latencia de la siguiente llamada; lanza una excepción si toca simular un error."""
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise LLMProviderError("Error al llamar al proveedor fake: error simulado",
+                                   retryable=True, status_code=500)
+        return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def complete(self, messages, temperature, max_tokens, response_format=None, stop=None, usage=None):
+        delay = self.next_delay()
+        if delay:
+            time.sleep(delay)
+        return self._respond(messages, stop, usage)
+
+    def stream(self, messages, temperature, max_tokens, stop=None, usage=None):
+        """Entrega la respuesta palabra a palabra, repartiendo la latencia entre ellas."""
+        delay = self.next_delay()
+        words = self._respond(messages, stop, usage).split(' ')
+        for i, word in enumerate(words):
+            if delay:
+                time.sleep(delay / len(words))
+            yield word if i == 0 else ' ' + word
+
+    async def acomplete(self, messages, temperature, max_tokens, response_format=None, stop=None, usage=None):
+        delay = self.next_delay()
+        if delay:
+            await asyncio.sleep(delay)
+        return self._respond(messages, stop, usage)
+
+
+def create_provider() -> LLMProvider:
+    """
+    Crea el proveedor indicado en LLM_PROVIDER ('azure' o 'fake').
+
+    Raises:
+        LLMConfigurationError: Si el proveedor es desconocido o falta su configuración
+    """
+    name = os.getenv('LLM_PROVIDER', 'azure').lower()
+    if name == 'azure':
+        return AzureOpenAIProvider.from_env()
+    if name == 'fake':
+        return FakeLLMProvider.from_env()
+    raise LLMConfigurationError(f"LLM_PROVIDER desconocido: {name}. Valores permitidos: azure, fake")
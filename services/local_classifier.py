@@ -0,0 +1,199 @@
+"""
+Clasificador local de categorías para categorize_task.
+
+Combina reglas de palabras clave con un Naive Bayes multinomial (bolsa de
+palabras) entrenado con las tareas de tasks.json que ya tienen categoría.
+Responde en microsegundos; AIService solo llama al LLM cuando la confianza
+no llega al umbral.
+
+Los recuentos del Naive Bayes se mantienen al día con
+TaskManager.add_listener, como el índice de EffortEstimator: cada alta,
+modificación o borrado solo suma o resta las palabras de una tarea, y
+nunca hay que reentrenar dentro de una petición.
+"""
+import math
+import os
+import re
+import threading
+import unicodedata
+from managers.task_manager import TaskManager
+from services.ai_prompts import VALID_CATEGORIES
+
+# Confianza mínima (0-1) para responder sin el LLM; 1 desactiva el clasificador
+CATEGORY_LOCAL_THRESHOLD = float(os.getenv('CATEGORY_LOCAL_THRESHOLD', 0.8))
+
+# Palabras clave por categoría, sin tildes. Las de más de 3 letras cuentan
+# como raíz ("prueba" cubre "pruebas"); las cortas deben coincidir enteras
+CATEGORY_KEYWORDS = {
+    'Frontend': ('frontend', 'front', 'ui', 'ux', 'interfaz', 'pantalla', 'vista', 'boton', 'formulario',
+                 'css', 'html', 'react', 'vue', 'angular', 'responsive', 'maquet', 'estilo', 'navegador'),
+    'Backend': ('backend', 'api', 'endpoint', 'servicio', 'microservicio', 'sql', 'consulta', 'esquema',
+                'flask', 'django', 'orm', 'autentic', 'jwt', 'webhook', 'graphql'),
+    'Testing': ('test', 'prueba', 'unitari', 'e2e', 'end', 'selenium', 'pytest',
+                'cypress', 'qa', 'cobertura', 'regresion', 'mock'),
+    'Infra': ('infra', 'infraestructura', 'servidor', 'red', 'dns', 'vpc', 'firewall', 'balanceador',
+              'certificado', 'ssl', 'tls', 'backup', 'respaldo', 'almacenamiento', 'nube', 'cloud',
+              'terraform', 'aws', 'azure', 'gcp', 'vm'),
+    'DevOps': ('devops', 'ci', 'cd', 'pipeline', 'jenkins', 'actions', 'docker', 'contenedor', 'kubernetes',
+               'k8s', 'helm', 'despliegue', 'deploy', 'monitoriz', 'observabilidad', 'release')
+}
+
+# Palabras clave indexadas: exactas (palabra -> categorías) y raíces por categoría
+_EXACT_KEYWORDS = {}
+for _category, _keywords in CATEGORY_KEYWORDS.items():
+    for _keyword in _keywords:
+        _EXACT_KEYWORDS.setdefault(_keyword, set()).add(_category)
+_KEYWORD_STEMS = {category: tuple(keyword for keyword in keywords if len(keyword) > 3)
+                  for category, keywords in CATEGORY_KEYWORDS.items()}
+
+# Peso de cada palabra clave encontrada (en escala logarítmica, como el Naive Bayes)
+KEYWORD_WEIGHT = 3.0
+
+
+def tokenize(text: str) -> list:
+    """Palabras en minúsculas y sin tildes."""
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode('ascii')
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+
+def task_tokens(task: dict) -> list:
+    """Palabras del título y la descripción (lo mismo que ve el prompt de categorize)."""
+    return tokenize(str(task.get('title') or '')) + tokenize(str(task.get('description') or ''))
+
+
+def keyword_matches(tokens: list) -> dict:
+    """Número de palabras clave de cada categoría presentes en los tokens."""
+    counts = dict.fromkeys(VALID_CATEGORIES, 0)
+    for token in tokens:
+        exact = _EXACT_KEYWORDS.get(token, ())
+        for category, stems in _KEYWORD_STEMS.items():
+            if category in exact or token.startswith(stems):
+                counts[category] += 1
+    return counts
+
+
+class LocalClassifier:
+    """
+    predict() devuelve (categoría, confianza) para una tarea. La puntuación
+    de cada categoría es la log-probabilidad del Naive Bayes más
+    KEYWORD_WEIGHT por palabra clave, y la confianza es su softmax: sin
+    datos de entrenamiento ni palabras clave todas valen 0.2, y dos
+    categorías con las mismas evidencias se quedan en 0.5.
+
+    Implementa la interfaz de listener de TaskManager (rebuild, add,
+    replace, remove): se registra en el primer uso, que lo llena con las
+    tareas guardadas, y desde entonces sus recuentos siguen al almacén.
+    """
+
+    def __init__(self, threshold=CATEGORY_LOCAL_THRESHOLD):
+        self.threshold = threshold
+        self.served_locally = 0
+        self.llm_fallbacks = 0
+        self._doc_counts = dict.fromkeys(VALID_CATEGORIES, 0)
+        self._word_counts = {category: {} for category in VALID_CATEGORIES}
+        self._total_words = dict.fromkeys(VALID_CATEGORIES, 0)
+        self._vocabulary = {}  # palabra -> apariciones en todas las categorías
+        self._lock = threading.Lock()
+        self._attach_lock = threading.Lock()
+        self._attached = False
+
+    @property
+    def enabled(self):
+        return self.threshold < 1
+
+    def _ensure_attached(self):
+        """Se registra en TaskManager, que lo llena con las tareas actuales."""
+        if self._attached:
+            return
+        with self._attach_lock:
+            if not self._attached:
+                TaskManager.add_listener(self)
+                self._attached = True
+
+    def _count(self, task, sign):
+        """Suma (sign=1) o resta (sign=-1) las palabras de una tarea con categoría."""
+        if task.category not in self._doc_counts:
+            return
+        tokens = task_tokens(task.to_dict())
+        with self._lock:
+            counts = self._word_counts[task.category]
+            self._doc_counts[task.category] += sign
+            self._total_words[task.category] += sign * len(tokens)
+            for token in tokens:
+                for table in (counts, self._vocabulary):
+                    remaining = table.get(token, 0) + sign
+                    if remaining > 0:
+                        table[token] = remaining
+                    else:
+                        table.pop(token, None)
+
+    # Interfaz de listener de TaskManager
+
+    def rebuild(self, tasks):
+        with self._lock:
+            self._doc_counts = dict.fromkeys(VALID_CATEGORIES, 0)
+            self._word_counts = {category: {} for category in VALID_CATEGORIES}
+            self._total_words = dict.fromkeys(VALID_CATEGORIES, 0)
+            self._vocabulary = {}
+        for task in tasks:
+            self.add(task)
+
+    def add(self, task):
+        self._count(task, 1)
+
+    def remove(self, task):
+        self._count(task, -1)
+
+    def replace(self, old_task, new_task):
+        self.remove(old_task)
+        self.add(new_task)
+
+    def predict(self, task: dict) -> tuple:
+        """Devuelve (categoría más probable, confianza entre 0 y 1)."""
+        self._ensure_attached()
+        tokens = task_tokens(task)
+        keywords = keyword_matches(tokens)
+
+        scores = {}
+        with self._lock:
+            examples = sum(self._doc_counts.values())
+            # Las palabras que no aparecen en ninguna tarea de entrenamiento no aportan evidencia
+            known = [token for token in tokens if token in self._vocabulary]
+            for category in VALID_CATEGORIES:
+                score = keywords[category] * KEYWORD_WEIGHT
+                if examples:
+                    # Naive Bayes con suavizado de Laplace
+                    counts = self._word_counts[category]
+                    denominator = self._total_words[category] + len(self._vocabulary) + 1
+                    score += (math.log((self._doc_counts[category] + 1) / (examples + len(VALID_CATEGORIES)))
+                              + sum(math.log(counts.get(token, 0) + 1) for token in known)
+                              - len(known) * math.log(denominator))
+                scores[category] = score
+
+        best = max(scores, key=scores.get)
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / total
+
+    def classify(self, task: dict):
+        """
+        Categoría si la confianza llega al umbral, o None si hay que
+        preguntar al LLM. Lleva la cuenta de ambos casos.
+        """
+        if self.enabled:
+            category, confidence = self.predict(task)
+            if confidence >= self.threshold:
+                self.served_locally += 1
+                return category
+        self.llm_fallbacks += 1
+        return None
+
+    def stats(self) -> dict:
+        """Peticiones resueltas localmente y fracción sobre el total."""
+        total = self.served_locally + self.llm_fallbacks
+        return {
+            "threshold": self.threshold,
+            "training_examples": sum(self._doc_counts.values()) if self._attached else None,
+            "served_locally": self.served_locally,
+            "llm_fallbacks": self.llm_fallbacks,
+            "local_fraction": round(self.served_locally / total, 3) if total else None
+        }
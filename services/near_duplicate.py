@@ -0,0 +1,190 @@
+"""
+Reutilización de respuestas para tareas casi iguales (MinHash + LSH).
+
+La caché de respuestas solo acierta si el prompt es idéntico, pero
+"Implementar login" e "Implementar el login" tienen la misma categoría y
+el mismo esfuerzo. NearDuplicateIndex guarda la respuesta de cada tarea
+ya resuelta con la firma MinHash de sus shingles de caracteres, y la
+reutiliza para una tarea nueva cuya similitud de Jaccard estimada supere
+el umbral. Las firmas se reparten en bandas (LSH), así que una consulta
+solo compara con las pocas entradas que comparten alguna banda y no con
+todas.
+
+Se activa por operación con NEAR_DUPLICATE_OPERATIONS (categorize y
+estimate por defecto). NumPy se importa en el primer uso.
+"""
+import os
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from services.local_classifier import tokenize
+
+# Operaciones con reutilización (separadas por comas; vacío la desactiva)
+NEAR_DUPLICATE_OPERATIONS = tuple(
+    op.strip() for op in os.getenv('NEAR_DUPLICATE_OPERATIONS', 'categorize,estimate').split(',') if op.strip())
+# Similitud de Jaccard mínima para reutilizar una respuesta
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.8))
+# Entradas por operación (expulsión LRU)
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv('NEAR_DUPLICATE_MAX_ENTRIES', 100000))
+
+# Campos de la tarea que determinan la respuesta de cada operación
+NEAR_DUPLICATE_FIELDS = {
+    'categorize': ('title', 'description'),
+    'estimate': ('title', 'description', 'category')
+}
+
+SHINGLE_SIZE = 4
+# Palabras que no cambian la respuesta ("Implementar el login" = "Implementar login")
+STOPWORDS = frozenset(('a', 'al', 'con', 'de', 'del', 'e', 'el', 'en', 'la', 'las', 'lo', 'los', 'o',
+                       'para', 'por', 'que', 'se', 'su', 'sus', 'un', 'una', 'unas', 'unos', 'y'))
+# 16 bandas de 8 filas: con similitud 0.9 coinciden en alguna banda el 99.9 %
+# de las veces, con 0.8 el 95 % y con 0.5 solo el 6 %
+NUM_PERMUTATIONS = 128
+BANDS = 16
+# Candidatas que se verifican como máximo por consulta (las que más bandas comparten)
+MAX_CANDIDATES = 32
+# Una banda compartida por más entradas no discrimina (texto de plantilla):
+# no se recorre, así el coste de una consulta no crece con el índice
+MAX_BUCKET_SCAN = 512
+
+
+def _numpy():
+    import numpy
+    return numpy
+
+
+def shingles(text: str) -> set:
+    """Shingles de SHINGLE_SIZE caracteres del texto normalizado (sin tildes ni STOPWORDS)."""
+    text = ' '.join(token for token in tokenize(text) if token not in STOPWORDS)
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+class NearDuplicateIndex:
+    """
+    Índice MinHash/LSH de respuestas de una operación.
+
+    Cada entrada es (firma de NUM_PERMUTATIONS mínimos, respuesta). La
+    firma se parte en BANDS bandas; dos tareas son candidatas si coinciden
+    en alguna banda completa, y entre las candidatas se elige la de mayor
+    similitud estimada (fracción de mínimos iguales). Es segura entre hilos.
+    """
+
+    def __init__(self, fields, threshold=NEAR_DUPLICATE_THRESHOLD, max_entries=NEAR_DUPLICATE_MAX_ENTRIES,
+                 num_perm=NUM_PERMUTATIONS, bands=BANDS, seed=1):
+        self.fields = fields
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.seed = seed
+        self.hits = 0
+        self.misses = 0
+        self._np = None
+        self._entries = OrderedDict()  # clave exacta -> (firma, respuesta)
+        self._buckets = {}  # (banda, valores) -> {clave: None}
+        self._lock = threading.Lock()
+
+    def _permutations(self):
+        if self._np is None:
+            np = _numpy()
+            rng = np.random.default_rng(self.seed)
+            # Hash multiplicativo (a*x + b) >> 32 con a impar: una "permutación" por fila
+            self._a = rng.integers(1, 2**63, size=(self.num_perm, 1), dtype=np.uint64) | np.uint64(1)
+            self._b = rng.integers(0, 2**63, size=(self.num_perm, 1), dtype=np.uint64)
+            self._np = np
+        return self._np
+
+    def task_text(self, task: dict) -> str:
+        return ' | '.join(str(task.get(field) or '') for field in self.fields)
+
+    def signature(self, text: str):
+        """Firma MinHash (uint32) del texto, o None si no tiene shingles."""
+        np = self._permutations()
+        values = shingles(text)
+        if not values:
+            return None
+        hashes = np.fromiter((zlib.crc32(value.encode('utf-8')) for value in values),
+                             dtype=np.uint64, count=len(values))
+        return ((self._a * hashes + self._b) >> np.uint64(32)).min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                for band in range(self.bands)]
+
+    def get(self, task: dict):
+        """Respuesta de la tarea ya resuelta más parecida (≥ threshold) o None."""
+        text = self.task_text(task)
+        signature = self.signature(text)
+        if signature is None:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(text)
+            if entry is not None:
+                self._entries.move_to_end(text)
+                self.hits += 1
+                return entry[1]
+
+            collisions = Counter()
+            for band_key in self._band_keys(signature):
+                bucket = self._buckets.get(band_key)
+                if bucket is not None and len(bucket) <= MAX_BUCKET_SCAN:
+                    collisions.update(bucket.keys())
+
+            candidates = [key for key, _ in collisions.most_common(MAX_CANDIDATES)]
+            if candidates:
+                signatures = self._np.stack([self._entries[key][0] for key in candidates])
+                similarities = (signatures == signature).sum(axis=1) / self.num_perm
+                best = int(similarities.argmax())
+                if similarities[best] >= self.threshold:
+                    key = candidates[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][1]
+            self.misses += 1
+            return None
+
+    def set(self, task: dict, answer):
+        """Guarda la respuesta de una tarea (expulsa la menos usada si está lleno)."""
+        if self.max_entries <= 0:
+            return
+        text = self.task_text(task)
+        signature = self.signature(text)
+        if signature is None:
+            return
+
+        with self._lock:
+            if text in self._entries:
+                self._remove(text)
+            self._entries[text] = (signature, answer)
+            for band_key in self._band_keys(signature):
+                self._buckets.setdefault(band_key, {})[text] = None
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        signature, _ = self._entries.pop(key)
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.pop(key, None)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "threshold": self.threshold
+            }
+
+
+def create_near_duplicate_indexes(operations=NEAR_DUPLICATE_OPERATIONS) -> dict:
+    """Un índice por operación activada (de las que admiten reutilización)."""
+    return {operation: NearDuplicateIndex(NEAR_DUPLICATE_FIELDS[operation])
+            for operation in operations if operation in NEAR_DUPLICATE_FIELDS}
@@ -0,0 +1,346 @@
+"""
+Protecciones alrededor de las llamadas al proveedor de LLM:
+
+- TokenBucket: limitador local de peticiones por minuto (RPM) y tokens por
+  minuto (TPM), dimensionado a la cuota del deployment.
+- RetryPolicy: reintentos con backoff exponencial y jitter que respetan
+  Retry-After.
+- CircuitBreaker: tras varios fallos seguidos deja de llamar al proveedor
+  durante un tiempo y falla al instante.
+
+ResilientProvider combina las tres envolviendo a otro LLMProvider.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from services.llm_providers import LLMProvider, LLMProviderError
+
+# Cuota del deployment (0 = sin límite local)
+LLM_RPM = int(os.getenv('LLM_RPM', 0))
+LLM_TPM = int(os.getenv('LLM_TPM', 0))
+# Espera máxima por el limitador antes de rechazar la llamada
+LLM_RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv('LLM_RATE_LIMIT_MAX_WAIT_SECONDS', 30))
+
+# Reintentos (el total de intentos es LLM_MAX_RETRIES + 1)
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 3))
+LLM_RETRY_BASE_DELAY_MS = int(os.getenv('LLM_RETRY_BASE_DELAY_MS', 500))
+LLM_RETRY_MAX_DELAY_MS = int(os.getenv('LLM_RETRY_MAX_DELAY_MS', 20000))
+
+# Circuit breaker
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', 5))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv('LLM_BREAKER_RESET_SECONDS', 30))
+
+
+class LLMUnavailableError(LLMProviderError):
+    """
+    La llamada no se ha hecho: el circuito está abierto o el limitador local
+    haría esperar demasiado. retry_after indica cuándo volver a intentarlo.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message, retryable=True, retry_after=retry_after, status_code=503)
+
+
+class TokenBucket:
+    """
+    Cubeta de tokens que se rellena a `per_minute` tokens por minuto, con
+    capacidad para una ráfaga de un minuto de cuota.
+
+    reserve() descuenta los tokens aunque aún no estén disponibles y
+    devuelve cuánto hay que esperar, así las llamadas se ordenan en la cola
+    sin sondear y el que espera puede dormir (time.sleep o asyncio.sleep).
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self._tokens = float(per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.per_minute > 0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount, max_wait=None):
+        """
+        Reserva `amount` tokens y devuelve los segundos a esperar antes de
+        usarlos. Si la espera superaría max_wait no reserva nada y devuelve None.
+        """
+        if not self.enabled:
+            return 0.0
+        # Una petición mayor que la capacidad nunca cabría: se limita a una cubeta llena
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = max(0.0, (amount - self._tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._tokens -= amount
+            return wait
+
+    def refund(self, amount):
+        """Devuelve `amount` tokens reservados con reserve() que no se van a usar."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + min(amount, self.capacity))
+
+    def stats(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "per_minute": self.per_minute,
+                "available": round(self._tokens, 1) if self.enabled else None
+            }
+
+
+class RetryPolicy:
+    """Backoff exponencial con jitter completo; si hay Retry-After, se respeta."""
+
+    def __init__(self, max_retries=3, base_delay=0.5, max_delay=20.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, error, attempt):
+        """attempt empieza en 0 (primer reintento tras el primer fallo)."""
+        return (attempt < self.max_retries
+                and isinstance(error, LLMProviderError)
+                and error.retryable
+                and not isinstance(error, LLMUnavailableError))
+
+    def delay(self, error, attempt):
+        if error.retry_after is not None:
+            return min(error.retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    closed: las llamadas pasan y se cuentan los fallos seguidos.
+    open: tras `failure_threshold` fallos seguidos, se rechaza todo durante
+          `reset_timeout` segundos sin llamar al proveedor.
+    half_open: pasado ese tiempo se deja pasar una sola llamada de prueba;
+               si va bien se cierra y si falla se vuelve a abrir.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.failure_threshold > 0
+
+    def before_call(self):
+        """Lanza LLMUnavailableError si el circuito no deja pasar la llamada."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise LLMUnavailableError(
+                        "El proveedor de LLM no está disponible (circuito abierto)", retry_after=remaining)
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    raise LLMUnavailableError(
+                        "El proveedor de LLM no está disponible (comprobando si se ha recuperado)",
+                        retry_after=1.0)
+                self._probe_in_flight = True
+
+    def cancel_call(self):
+        """La llamada autorizada por before_call() no llegó a hacerse."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or (self.enabled and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            retry_in = None
+            if self.state == self.OPEN:
+                retry_in = round(max(0.0, self._opened_at + self.reset_timeout - time.monotonic()), 1)
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "failure_threshold": self.failure_threshold,
+                "rejected": self.rejected,
+                "retry_in_seconds": retry_in
+            }
+
+
+class ResilientProvider(LLMProvider):
+    """
+    Envuelve un proveedor con limitador RPM/TPM, reintentos y circuit breaker.
+
+    Solo cuentan como fallo del proveedor (y se reintentan) los errores
+    marcados como retryable (429, 5xx, timeouts); un 400 se devuelve tal cual.
+    En streaming solo se reintenta si el fallo llega antes del primer fragmento.
+    """
+
+    def __init__(self, provider, requests_bucket=None, tokens_bucket=None, retry=None,
+                 breaker=None, max_wait=LLM_RATE_LIMIT_MAX_WAIT_SECONDS):
+        self.provider = provider
+        self.name = provider.name
+        self.model = provider.model
+        self.requests_bucket = requests_bucket or TokenBucket(0)
+        self.tokens_bucket = tokens_bucket or TokenBucket(0)
+        self.retry = retry or RetryPolicy(max_retries=0)
+        self.breaker = breaker or CircuitBreaker(failure_threshold=0)
+        self.max_wait = max_wait
+        # Contadores compartidos entre hilos (y con el event loop de AsyncAIService)
+        self.retries = 0
+        self.throttled_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, provider):
+        return cls(
+            provider,
+            requests_bucket=TokenBucket(LLM_RPM),
+            tokens_bucket=TokenBucket(LLM_TPM),
+            retry=RetryPolicy(LLM_MAX_RETRIES, LLM_RETRY_BASE_DELAY_MS / 1000, LLM_RETRY_MAX_DELAY_MS / 1000),
+            breaker=CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS)
+        )
+
+    @staticmethod
+    def estimate_tokens(messages, max_tokens):
+        """Tokens que la llamada descuenta de la cuota TPM (~4 caracteres por token + max_tokens)."""
+        return sum(len(message["content"]) for message in messages) // 4 + (max_tokens or 0)
+
+    def _acquire(self, messages, max_tokens):
+        """Reserva cuota y devuelve los segundos a esperar (o lanza LLMUnavailableError)."""
+        self.breaker.before_call()
+        wait_requests = self.requests_bucket.reserve(1, self.max_wait)
+        wait_tokens = None
+        if wait_requests is not None:
+            wait_tokens = self.tokens_bucket.reserve(self.estimate_tokens(messages, max_tokens), self.max_wait)
+            if wait_tokens is None:
+                # Sin cuota TPM la petición no se hace: su hueco RPM queda libre para otra
+                self.requests_bucket.refund(1)
+        if wait_tokens is None:
+            self.breaker.cancel_call()
+            raise LLMUnavailableError("Límite local de peticiones al LLM alcanzado (RPM/TPM)",
+                                      retry_after=self.max_wait)
+        wait = max(wait_requests, wait_tokens)
+        with self._lock:
+            self.throttled_seconds += wait
+        return wait
+
+    def _on_error(self, error, attempt):
+        """Registra el fallo y devuelve la espera antes de reintentar, o None si no se reintenta."""
+        if isinstance(error, LLMUnavailableError):
+            return None
+        if isinstance(error, LLMProviderError) and error.retryable:
+            self.breaker.record_failure()
+        else:
+            # Errores de la petición (400, contenido filtrado...): el proveedor responde bien
+            self.breaker.record_success()
+        if not self.retry.should_retry(error, attempt):
+            return None
+        with self._lock:
+            self.retries += 1
+        return self.retry.delay(error, attempt)
+
+    def complete(self, messages, temperature, max_tokens, response_format=None, stop=None, usage=None):
+        attempt = 0
+        while True:
+            try:
+                time.sleep(self._acquire(messages, max_tokens))
+                result = self.provider.complete(messages, temperature, max_tokens, response_format,
+                                                stop=stop, usage=usage)
+                self.breaker.record_success()
+                return result
+            except Exception as e:
+                delay = self._on_error(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    async def acomplete(self, messages, temperature, max_tokens, response_format=None, stop=None, usage=None):
+        attempt = 0
+        while True:
+            try:
+                await asyncio.sleep(self._acquire(messages, max_tokens))
+                result = await self.provider.acomplete(messages, temperature, max_tokens, response_format,
+                                                       stop=stop, usage=usage)
+                self.breaker.record_success()
+                return result
+            except Exception as e:
+                delay = self._on_error(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def stream(self, messages, temperature, max_tokens, stop=None, usage=None):
+        attempt = 0
+        while True:
+            try:
+                time.sleep(self._acquire(messages, max_tokens))
+                tokens = self.provider.stream(messages, temperature, max_tokens, stop=stop, usage=usage)
+                first = next(tokens, None)
+                # Ya responde: el proveedor está sano aunque el stream se corte después
+                self.breaker.record_success()
+                break
+            except Exception as e:
+                delay = self._on_error(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+        try:
+            if first is not None:
+                yield first
+            yield from tokens
+        except LLMProviderError as e:
+            self._on_error(e, self.retry.max_retries)
+            raise
+
+    def stats(self):
+        with self._lock:
+            retries, throttled_seconds = self.retries, self.throttled_seconds
+        return {
+            "rate_limiter": {
+                "requests": self.requests_bucket.stats(),
+                "tokens": self.tokens_bucket.stats(),
+                "throttled_seconds": round(throttled_seconds, 3)
+            },
+            "retries": retries,
+            "circuit_breaker": self.breaker.stats()
+        }
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+
+
+class _Flight:
+    """Una llamada en curso: la esperan todos los hilos con la misma clave."""
+
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas concurrentes idénticas.
+
+    El primer hilo que llega con una clave ejecuta la función; los que llegan
+    mientras tanto con la misma clave esperan y reciben su resultado (o su
+    excepción) sin repetir la llamada. Cuando termina, la clave se libera y
+    la siguiente llamada vuelve a ejecutarse. Es segura entre hilos, así que
+    sirve con el servidor de Flask con hilos y con workers gthread de gunicorn
+    (cada proceso agrupa sus propias llamadas).
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        """Ejecuta fn() una sola vez por clave entre las llamadas concurrentes."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                self.shared += 1
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def stats(self):
+        """Llamadas ejecutadas, llamadas agrupadas y claves en curso."""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "shared": self.shared,
+                "in_flight": len(self._flights)
+            }
+
+
+class AsyncSingleFlight:
+    """
+    Versión asyncio de SingleFlight para corrutinas de un mismo event loop.
+    No necesita lock: dentro del loop no hay cambios de contexto entre la
+    consulta y el registro de la llamada en curso.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, coro_fn):
+        """Ejecuta await coro_fn() una sola vez por clave entre las llamadas concurrentes."""
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.shared += 1
+            # shield: si se cancela quien espera, la llamada sigue para los demás
+            return await asyncio.shield(flight)
+
+        flight = self._flights[key] = asyncio.get_running_loop().create_future()
+        self.calls += 1
+        try:
+            result = await coro_fn()
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except BaseException as e:
+            flight.set_exception(e)
+            # Marcar la excepción como recuperada si nadie más la espera
+            flight.exception()
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            del self._flights[key]
+
+    def stats(self):
+        """Llamadas ejecutadas, llamadas agrupadas y claves en curso."""
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "in_flight": len(self._flights)
+        }
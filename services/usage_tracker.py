@@ -0,0 +1,99 @@
+"""
+Contabilidad de tokens y latencia de las llamadas al LLM por operación.
+
+AIService registra cada llamada al proveedor con los tokens que informa la
+API (o una estimación de ~4 caracteres por token si no los informa) y su
+latencia. report() devuelve, por operación, los totales y los percentiles
+de las últimas USAGE_WINDOW llamadas, para ajustar los perfiles de
+generación (max_tokens, temperatura) con datos.
+"""
+import os
+import threading
+from collections import deque
+
+# Llamadas recientes por operación sobre las que se calculan los percentiles
+USAGE_WINDOW = int(os.getenv('AI_USAGE_WINDOW', 1000))
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentiles(values: list) -> dict:
+    """Percentiles (rango más cercano) y máximo de una lista de números."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    report = {f"p{p}": ordered[max(0, -(-p * len(ordered) // 100) - 1)] for p in PERCENTILES}
+    report["max"] = ordered[-1]
+    return report
+
+
+class UsageTracker:
+    """
+    Tokens y latencia por operación. Los totales cubren toda la vida del
+    proceso; los percentiles, las últimas `window` llamadas. Puede
+    compartirse entre AIService y AsyncAIService y es segura entre hilos.
+    """
+
+    def __init__(self, window=USAGE_WINDOW):
+        self.window = window
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def _get(self, operation):
+        stats = self._operations.get(operation)
+        if stats is None:
+            stats = self._operations[operation] = {
+                "calls": 0, "cache_hits": 0, "errors": 0, "estimated_calls": 0, "length_stops": 0,
+                "prompt_tokens": 0, "completion_tokens": 0,
+                "samples": deque(maxlen=self.window)  # (latencia en ms, prompt_tokens, completion_tokens)
+            }
+        return stats
+
+    def record(self, operation: str, seconds: float, usage: dict, estimated: bool = False):
+        """
+        Registra una llamada al modelo. `usage` trae prompt_tokens,
+        completion_tokens y, si la API lo informa, finish_reason.
+        """
+        with self._lock:
+            stats = self._get(operation)
+            stats["calls"] += 1
+            stats["estimated_calls"] += int(estimated)
+            stats["length_stops"] += int(usage.get("finish_reason") == "length")
+            stats["prompt_tokens"] += usage["prompt_tokens"]
+            stats["completion_tokens"] += usage["completion_tokens"]
+            stats["samples"].append((round(seconds * 1000, 1), usage["prompt_tokens"], usage["completion_tokens"]))
+
+    def record_cache_hit(self, operation: str):
+        """Registra una respuesta servida desde la caché (sin tokens ni latencia del modelo)."""
+        with self._lock:
+            self._get(operation)["cache_hits"] += 1
+
+    def record_error(self, operation: str):
+        """Registra una llamada al modelo que ha fallado."""
+        with self._lock:
+            self._get(operation)["errors"] += 1
+
+    def report(self) -> dict:
+        """Totales, medias y percentiles de latencia y tokens por operación."""
+        with self._lock:
+            snapshot = {operation: dict(stats, samples=list(stats["samples"]))
+                        for operation, stats in self._operations.items()}
+
+        operations = {}
+        for operation, stats in sorted(snapshot.items()):
+            calls, samples = stats["calls"], stats["samples"]
+            operations[operation] = {
+                "calls": calls,
+                "cache_hits": stats["cache_hits"],
+                "errors": stats["errors"],
+                "estimated_calls": stats["estimated_calls"],
+                "length_stops": stats["length_stops"],
+                "prompt_tokens": {"total": stats["prompt_tokens"],
+                                  "avg": round(stats["prompt_tokens"] / calls, 1) if calls else None},
+                "completion_tokens": {"total": stats["completion_tokens"],
+                                      "avg": round(stats["completion_tokens"] / calls, 1) if calls else None},
+                "latency_ms": percentiles([sample[0] for sample in samples]),
+                "completion_tokens_percentiles": percentiles([sample[2] for sample in samples]),
+                "total_tokens_percentiles": percentiles([sample[1] + sample[2] for sample in samples])
+            }
+        return {"window": self.window, "operations": operations}
@@ -0,0 +1,833 @@
+"""
+Pruebas locales de AIService (sin servidor ni Azure OpenAI).
+
+Usan el proveedor de LLM simulado (LLM_PROVIDER=fake) o un proveedor
+con la llamada al modelo sustituida por un mock, para comprobar la lógica
+que rodea a _call_llm. Ejecutar con:
+
+    python test_ai_service.py
+    python -m pytest test_ai_service.py
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+# Proveedor local: no hacen falta credenciales de Azure
+os.environ.setdefault('LLM_PROVIDER', 'fake')
+
+from app import create_app
+from managers.job_manager import JobManager
+from managers.task_manager import TaskManager
+from models.task import Task
+from routes import ai_task_routes
+from services.ai_jobs import AI_JOB_KIND
+from services.ai_service import AIService
+from services.async_ai_service import AsyncAIService
+from services.fake_llm_server import make_server
+from services.effort_estimator import EffortEstimator
+from services.llm_cache import LLMCache
+from services.local_classifier import LocalClassifier
+from services.near_duplicate import create_near_duplicate_indexes
+from services.llm_providers import AzureOpenAIProvider, FakeLLMProvider, LLMProvider, LLMProviderError
+from services.resilience import (CircuitBreaker, LLMUnavailableError, ResilientProvider, RetryPolicy,
+                                 TokenBucket)
+
+SAMPLE_TASK = {
+    "title": "Crear tests unitarios para la API",
+    "description": "Implementar suite de pruebas automatizadas"
+}
+
+
+def print_separator(title):
+    print(f"\n{'='*20} {title} {'='*20}")
+
+
+class MockProvider(LLMProvider):
+    """Proveedor cuya llamada al modelo es un mock (para contar llamadas)."""
+
+    name = 'test'
+    model = 'test'
+
+    def __init__(self, answer):
+        self.complete = mock.Mock(return_value=answer)
+        self.acomplete = mock.AsyncMock(return_value=answer)
+
+
+def llm_only():
+    """
+    Sin los atajos locales (clasificador y reutilización de tareas casi
+    iguales): las pruebas cuentan las llamadas al modelo.
+    """
+    return dict(classifier=LocalClassifier(threshold=1), near_duplicates={})
+
+
+def make_service(answer="Testing"):
+    """AIService con la llamada al modelo simulada; devuelve (servicio, mock)."""
+    provider = MockProvider(answer)
+    service = AIService(cache=LLMCache(max_entries=100, ttl_seconds=60), provider=provider,
+                        **llm_only())
+    return service, provider.complete
+
+
+def make_async_service(answer="Testing"):
+    """AsyncAIService con la llamada al modelo simulada; devuelve (servicio, mock)."""
+    provider = MockProvider(answer)
+    service = AsyncAIService(cache=LLMCache(max_entries=100, ttl_seconds=60), provider=provider,
+                             **llm_only())
+    return service, provider.acomplete
+
+
+def test_repeated_prompt_is_served_from_cache():
+    print_separator("TEST: CACHÉ DE RESPUESTAS")
+    service, upstream = make_service()
+
+    assert service.categorize_task(SAMPLE_TASK) == "Testing"
+    assert service.categorize_task(SAMPLE_TASK) == "Testing"
+    assert upstream.call_count == 1
+
+    service.categorize_task(dict(SAMPLE_TASK, title="Otra tarea"))
+    assert upstream.call_count == 2
+    stats = service.get_status()["cache"]
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+    print("✅ El mismo prompt solo llama una vez al modelo")
+
+
+def test_cache_lru_and_ttl():
+    print_separator("TEST: LRU Y TTL")
+    cache = LLMCache(max_entries=2, ttl_seconds=60)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+    assert cache.get("b") is None and cache.get("a") == "1"
+
+    expiring = LLMCache(max_entries=10, ttl_seconds=0.05)
+    expiring.set("a", "1")
+    time.sleep(0.1)
+    assert expiring.get("a") is None
+    print("✅ Se expulsa lo menos usado y lo caducado")
+
+
+def test_cache_persists_to_disk():
+    print_separator("TEST: CACHÉ PERSISTENTE")
+    path = os.path.join(tempfile.mkdtemp(), 'llm_cache.json')
+    first = LLMCache(max_entries=10, ttl_seconds=60, path=path, flush_seconds=60)
+    second = LLMCache(max_entries=10, ttl_seconds=60, path=path, flush_seconds=60)
+    with mock.patch('services.llm_cache.json.dump', wraps=json.dump) as dump:
+        for i in range(5):
+            first.set(f"clave{i}", "valor")
+        assert dump.call_count == 0  # nada va al disco en cada set
+        first.flush()
+        second.set("otra", "valor")
+        second.flush()
+        assert dump.call_count == 2
+
+    # El segundo proceso no borra lo que guardó el primero
+    restarted = LLMCache(max_entries=10, ttl_seconds=60, path=path)
+    assert restarted.get("clave0") == "valor" and restarted.get("otra") == "valor"
+    print("✅ La caché se vuelca por lotes, mezcla workers y sobrevive a un reinicio")
+
+
+def test_concurrent_identical_prompts_share_one_call():
+    print_separator("TEST: LLAMADAS AGRUPADAS (SINGLE-FLIGHT)")
+    service, upstream = make_service()
+    release = threading.Event()
+
+    def slow_completion(*args, **kwargs):
+        release.wait(5)
+        return "Testing"
+    upstream.side_effect = slow_completion
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(service.categorize_task(SAMPLE_TASK)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    # Esperar a que todos los hilos estén esperando la llamada en curso
+    deadline = time.time() + 5
+    while service.in_flight.stats()["shared"] < 7 and time.time() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["Testing"] * 8
+    assert upstream.call_count == 1
+    print("✅ 8 peticiones idénticas, 1 llamada al modelo")
+
+    # Los errores también se comparten y no quedan cacheados
+    failing, upstream = make_service()
+    release.clear()
+
+    def failing_completion(*args, **kwargs):
+        release.wait(5)
+        raise RuntimeError("timeout")
+    upstream.side_effect = failing_completion
+
+    errors = []
+
+    def categorize():
+        try:
+            failing.categorize_task(SAMPLE_TASK)
+        except Exception as e:
+            errors.append(str(e))
+    threads = [threading.Thread(target=categorize) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    deadline = time.time() + 5
+    while failing.in_flight.stats()["shared"] < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 4 and all("timeout" in e for e in errors)
+    assert upstream.call_count == 1
+    assert failing.in_flight.stats()["in_flight"] == 0
+    print("✅ Todos los que esperaban reciben el mismo error")
+
+
+def test_async_service_keeps_hundreds_of_calls_in_flight():
+    print_separator("TEST: AsyncAIService")
+    service, upstream = make_async_service()
+    in_flight = peak = 0
+
+    async def slow_completion(*args, **kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.2)
+        in_flight -= 1
+        return "Backend"
+    upstream.side_effect = slow_completion
+
+    tasks = [{"title": f"Tarea {i}", "description": "API"} for i in range(300)]
+    start = time.perf_counter()
+    results = service.run(service.run_batch('categorize', tasks, concurrency=256))
+    elapsed = time.perf_counter() - start
+
+    assert [r["task"]["category"] for r in results] == ["Backend"] * 300
+    assert upstream.call_count == 300 and peak == 256
+    # 300 llamadas de 0.2 s con 256 en curso: dos tandas (~0.4 s), no 60 s
+    assert elapsed < 2.0
+    print(f"✅ 300 llamadas en {elapsed:.2f}s con {peak} en curso a la vez")
+
+    # Los métodos individuales mantienen la misma API (como corrutinas)
+    assert service.run(service.categorize_task(tasks[-1])) == "Backend"
+    assert upstream.call_count == 300
+    print("✅ categorize_task asíncrono usa la misma caché")
+
+
+def test_batch_endpoint_fans_out_in_order():
+    print_separator("TEST: POST /ai/tasks/batch/describe")
+    service, upstream = make_async_service()
+
+    async def echo_title(messages, *args, **kwargs):
+        await asyncio.sleep(0.1)
+        title = messages[-1]["content"].split("Título: ")[1].split("\n")[0]
+        return f"Descripción de {title}"
+    upstream.side_effect = echo_title
+
+    tasks = [{"title": f"Tarea {i}", "priority": "media", "status": "pendiente", "assigned_to": "Ana"}
+             for i in range(16)]
+    tasks.insert(3, {"title": "Sin campos"})
+    client = create_app().test_client()
+    with mock.patch.object(ai_task_routes, 'async_ai_service', service):
+        start = time.perf_counter()
+        response = client.post('/ai/tasks/batch/describe?concurrency=8', json=tasks)
+        elapsed = time.perf_counter() - start
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert (body["succeeded"], body["failed"]) == (16, 1)
+    assert [r["index"] for r in body["results"]] == list(range(17))
+    assert "Campos faltantes" in body["results"][3]["error"]
+    for result, task in zip(body["results"], tasks):
+        if "task" in result:
+            assert result["task"]["description"] == f"Descripción de {task['title']}"
+    # 16 llamadas de 0.1 s con 8 en paralelo: ~0.2 s en lugar de 1.6 s
+    assert elapsed < 1.0
+    print(f"✅ 16 tareas en {elapsed:.2f}s con el orden de entrada")
+
+    assert client.post('/ai/tasks/batch/describe?concurrency=0', json=tasks).status_code == 400
+    assert client.post('/ai/tasks/batch/traducir', json=tasks).status_code == 404
+    assert client.post('/ai/tasks/batch/describe', json={"title": "x"}).status_code == 400
+    print("✅ Parámetros inválidos rechazados")
+
+
+def test_fake_provider_is_deterministic():
+    print_separator("TEST: PROVEEDOR FAKE")
+    service = AIService(cache=LLMCache(max_entries=0), provider=FakeLLMProvider())
+    category = service.categorize_task(SAMPLE_TASK)
+    assert category in ['Frontend', 'Backend', 'Testing', 'Infra', 'DevOps']
+    assert service.categorize_task(SAMPLE_TASK) == category
+    assert 1 <= service.estimate_effort_hours(SAMPLE_TASK) <= 40
+    print(f"✅ Respuestas deterministas y parseables ({category})")
+
+    failing = AIService(cache=LLMCache(max_entries=0), provider=FakeLLMProvider(error_rate=1.0))
+    try:
+        failing.generate_description(SAMPLE_TASK)
+        assert False, "Debería fallar"
+    except Exception as e:
+        assert "error simulado" in str(e)
+    print("✅ error_rate=1.0 hace fallar todas las llamadas")
+
+
+def test_fake_server_speaks_chat_completions():
+    print_separator("TEST: SERVIDOR LLM SIMULADO")
+    server = make_server(port=0, provider=FakeLLMProvider(latency=0.01))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # El cliente real de Azure OpenAI contra el servidor local
+        provider = AzureOpenAIProvider('test', f"http://127.0.0.1:{server.server_port}",
+                                       'fake-deployment', '2024-12-01-preview')
+        service = AIService(cache=LLMCache(max_entries=0), provider=provider)
+        assert service.categorize_task(SAMPLE_TASK) == AIService(
+            cache=LLMCache(max_entries=0), provider=FakeLLMProvider()).categorize_task(SAMPLE_TASK)
+
+        async_service = AsyncAIService(cache=LLMCache(max_entries=0), provider=provider)
+        tasks = [dict(SAMPLE_TASK, title=f"Tarea {i}") for i in range(20)]
+        results = async_service.run(async_service.run_batch('estimate', tasks))
+        assert all(1 <= r["task"]["effort_hours"] <= 40 for r in results)
+
+        messages = [{"role": "user", "content": "Genera una descripción"}]
+        tokens = list(provider.stream(messages, 0.7, 500))
+        assert len(tokens) > 1 and ''.join(tokens) == FakeLLMProvider.answer(messages)
+        print("✅ El cliente de Azure (síncrono y asíncrono) funciona contra el servidor simulado")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def read_events(body):
+    """Separa un cuerpo text/event-stream en una lista de (evento, datos)."""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_describe_and_audit_stream_tokens():
+    print_separator("TEST: STREAMING SSE")
+    service = AIService(cache=LLMCache(max_entries=100, ttl_seconds=60),
+                        provider=FakeLLMProvider(latency=0.4))
+    client = create_app().test_client()
+    task = {"title": "Login con OAuth", "priority": "alta", "status": "pendiente",
+            "assigned_to": "Ana", "description": "Integrar proveedor externo"}
+
+    with mock.patch.object(ai_task_routes, 'ai_service', service):
+        start = time.perf_counter()
+        response = client.post('/ai/tasks/describe?stream=true', json=task, buffered=False)
+        chunks = iter(response.response)
+        first = next(chunks)
+        first_token = time.perf_counter() - start
+        body = (first if isinstance(first, str) else first.decode()) + \
+            ''.join(c if isinstance(c, str) else c.decode() for c in chunks)
+        total = time.perf_counter() - start
+
+    assert response.mimetype == 'text/event-stream'
+    events = read_events(body)
+    tokens = [data["text"] for event, data in events if event == "token"]
+    assert len(tokens) > 1 and events[-1][0] == "task"
+    assert events[-1][1]["description"] == ''.join(tokens).strip() == service.generate_description(task)
+    assert first_token < total / 2
+    print(f"✅ Primer token a {first_token*1000:.0f} ms de {total*1000:.0f} ms totales")
+
+    with mock.patch.object(ai_task_routes, 'ai_service', service):
+        response = client.post('/ai/tasks/audit', json=task, headers={"Accept": "text/event-stream"})
+    events = read_events(response.get_data(as_text=True))
+    fields = [data["field"] for event, data in events if event == "token"]
+    assert fields.index("risk_mitigation") > fields.index("risk_analysis")
+    assert "risk_analysis" not in fields[fields.index("risk_mitigation"):]
+    final = events[-1][1]
+    assert (final["risk_analysis"], final["risk_mitigation"]) == service.audit_risks(task)
+    print("✅ La auditoría emite primero el análisis y después la mitigación")
+
+    # Un fallo del modelo a mitad de stream llega como evento 'error'
+    failing = AIService(cache=LLMCache(max_entries=0), provider=FakeLLMProvider(error_rate=1.0))
+    with mock.patch.object(ai_task_routes, 'ai_service', failing):
+        response = client.post('/ai/tasks/describe?stream=1', json=task)
+    assert read_events(response.get_data(as_text=True))[-1][0] == "error"
+    print("✅ Errores como evento SSE")
+
+
+def test_token_bucket_limits_rate():
+    print_separator("TEST: LIMITADOR RPM/TPM")
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.reserve(60) == 0.0
+    assert 0.9 < bucket.reserve(1) < 1.1
+    assert bucket.reserve(10, max_wait=5) is None
+    assert TokenBucket(per_minute=0).reserve(10**6) == 0.0
+
+    # Si la cuota TPM no alcanza, la petición devuelve su hueco RPM
+    provider = ResilientProvider(MockProvider("Testing"), requests_bucket=TokenBucket(per_minute=60),
+                                 tokens_bucket=TokenBucket(per_minute=60), max_wait=0)
+    provider.tokens_bucket.reserve(60)
+    for _ in range(3):
+        try:
+            provider.complete([{"content": "x" * 400}], 0.7, 10)
+            raise AssertionError("Debía agotar la cuota TPM")
+        except LLMUnavailableError:
+            pass
+    assert provider.requests_bucket.stats()["available"] >= 59.9
+    print("✅ Ráfaga de un minuto de cuota y espera proporcional después")
+
+
+def test_retries_honor_retry_after():
+    print_separator("TEST: REINTENTOS CON RETRY-AFTER")
+    inner = MockProvider("Testing")
+    throttled = LLMProviderError("429", retryable=True, retry_after=0.1, status_code=429)
+    inner.complete.side_effect = [throttled, throttled, "Testing"]
+    provider = ResilientProvider(inner, retry=RetryPolicy(max_retries=3, base_delay=0.01, max_delay=1))
+
+    start = time.perf_counter()
+    assert provider.complete([{"content": "x"}], 0.7, 10) == "Testing"
+    assert time.perf_counter() - start >= 0.2
+    assert inner.complete.call_count == 3 and provider.retries == 2
+
+    # Un error no transitorio (400) no se reintenta
+    inner.complete.side_effect = LLMProviderError("400", retryable=False, status_code=400)
+    try:
+        provider.complete([{"content": "x"}], 0.7, 10)
+        assert False, "Debería fallar"
+    except LLMProviderError as e:
+        assert e.status_code == 400
+    assert inner.complete.call_count == 4
+    print("✅ 429 reintentado respetando Retry-After; 400 devuelto al instante")
+
+
+def test_circuit_breaker_fails_fast():
+    print_separator("TEST: CIRCUIT BREAKER")
+    inner = MockProvider("Testing")
+    inner.complete.side_effect = LLMProviderError("503", retryable=True, status_code=503)
+    provider = ResilientProvider(inner, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.2))
+    service = AIService(cache=LLMCache(max_entries=0), provider=provider, **llm_only())
+
+    for _ in range(2):
+        try:
+            provider.complete([{"content": "x"}], 0.7, 10)
+        except LLMProviderError:
+            pass
+    assert provider.breaker.state == CircuitBreaker.OPEN
+
+    client = create_app().test_client()
+    with mock.patch.object(ai_task_routes, 'ai_service', service):
+        response = client.post('/ai/tasks/categorize', json=SAMPLE_TASK)
+        status = client.get('/ai/tasks/status').get_json()
+    assert response.status_code == 503 and int(response.headers['Retry-After']) >= 1
+    assert inner.complete.call_count == 2
+    assert status["resilience"]["circuit_breaker"]["state"] == "open"
+    print("✅ Con el circuito abierto responde 503 sin llamar al proveedor")
+
+    # Pasado reset_timeout, una llamada de prueba que va bien lo cierra
+    time.sleep(0.25)
+    inner.complete.side_effect = None
+    try:
+        provider.breaker.before_call()
+        provider.breaker.before_call()
+        assert False, "Solo debe pasar una llamada de prueba"
+    except LLMUnavailableError:
+        provider.breaker.cancel_call()
+    assert provider.complete([{"content": "x"}], 0.7, 10) == "Testing"
+    assert provider.breaker.state == CircuitBreaker.CLOSED
+    print("✅ half_open deja pasar una prueba y se cierra si va bien")
+
+
+def test_app_boots_without_azure_or_openai():
+    print_separator("TEST: ARRANQUE SIN AZURE")
+    # Proceso nuevo: en este ya están importados los servicios
+    snippet = (
+        "import sys\n"
+        "from app import create_app\n"
+        "client = create_app().test_client()\n"
+        "assert 'openai' not in sys.modules\n"
+        "assert client.get('/tasks').status_code == 200\n"
+        "response = client.post('/ai/tasks/categorize', json={'title': 'x'})\n"
+        "assert response.status_code == 500 and 'AZURE_OPENAI' in response.get_json()['error']\n"
+    )
+    env = {key: value for key, value in os.environ.items()
+           if not key.startswith('AZURE_OPENAI_') and key != 'LLM_PROVIDER'}
+    result = subprocess.run([sys.executable, '-c', snippet], env=env, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 0, result.stderr
+    print("✅ CRUD disponible sin variables de Azure y sin importar openai")
+
+
+def test_invalid_generation_profiles_fail_only_ai_requests():
+    print_separator("TEST: AI_GENERATION_PROFILES INVÁLIDO")
+    # Proceso nuevo: los perfiles se leen en el primer uso
+    snippet = (
+        "from app import create_app\n"
+        "client = create_app().test_client()\n"
+        "assert client.get('/tasks').status_code == 200\n"
+        "response = client.post('/ai/tasks/categorize', json={'title': 'x'})\n"
+        "assert response.status_code == 500 and 'AI_GENERATION_PROFILES' in response.get_json()['error']\n"
+        "assert client.get('/ai/tasks/usage').status_code == 500\n"
+    )
+    env = dict(os.environ, LLM_PROVIDER='fake', AI_GENERATION_PROFILES='{"categorize": 5')
+    result = subprocess.run([sys.executable, '-c', snippet], env=env, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 0, result.stderr
+    print("✅ La app arranca y las rutas de IA responden 500 en JSON")
+
+
+def test_status_endpoint():
+    print_separator("TEST: GET /ai/tasks/status")
+    client = create_app().test_client()
+    response = client.get('/ai/tasks/status')
+    assert response.status_code == 200
+    assert {"hits", "misses", "entries"} <= set(response.get_json()["cache"])
+    assert {"rate_limiter", "retries", "circuit_breaker"} <= set(response.get_json()["resilience"])
+    print("✅ El endpoint expone los contadores")
+
+
+def wait_for_job(client, job_id, timeout=5):
+    """Consulta GET /ai/jobs/<id> hasta que el trabajo termina."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f'/ai/jobs/{job_id}').get_json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"El trabajo {job_id} no terminó")
+
+
+def test_async_job_writes_back_to_task():
+    print_separator("TEST: TRABAJOS DE IA EN SEGUNDO PLANO (202 + POLLING)")
+    tmp_dir = tempfile.mkdtemp()
+    TaskManager.configure(os.path.join(tmp_dir, 'tasks.json'))
+    JobManager.configure(os.path.join(tmp_dir, 'jobs.json'), workers=2)
+    task = Task("Migrar la base de datos", "Pasar a la nueva versión", "alta", 3, "pendiente", "Ana")
+    TaskManager.add_task(task)
+
+    service, upstream = make_service("Backend")
+    with mock.patch.object(ai_task_routes, 'ai_service', service):
+        client = create_app().test_client()
+        response = client.post('/ai/tasks/categorize?async=true', json={"task_id": task.id})
+        assert response.status_code == 202
+        job = response.get_json()
+        assert job["status"] in ("queued", "running", "succeeded")
+        assert response.headers['Location'] == f"/ai/jobs/{job['id']}"
+
+        job = wait_for_job(client, job["id"])
+        assert job["status"] == "succeeded", job
+        assert job["result"]["category"] == "Backend"
+        assert TaskManager.get_task(task.id).category == "Backend"
+        assert TaskManager.get_task(task.id).title == "Migrar la base de datos"
+
+        # Sin task_id el resultado solo queda en el trabajo
+        response = client.post('/ai/tasks/categorize', json=SAMPLE_TASK, headers={"Prefer": "respond-async"})
+        assert response.status_code == 202
+        assert wait_for_job(client, response.get_json()["id"])["result"]["category"] == "Backend"
+
+        assert client.post('/ai/tasks/categorize?async=true', json={"task_id": "no-existe"}).status_code == 404
+        assert client.get('/ai/jobs/no-existe').status_code == 404
+
+    # El estado persiste: otro "proceso" lo lee del archivo
+    JobManager.wait_for_jobs()
+    JobManager._jobs = {}
+    assert JobManager.get_job(job["id"])["status"] == "succeeded"
+    assert upstream.call_count == 2
+    print("✅ 202 con Location, resultado por polling y escrito en la tarea")
+
+
+def test_pending_jobs_resume_after_restart():
+    print_separator("TEST: TRABAJOS PENDIENTES TRAS UN REINICIO")
+    jobs_file = os.path.join(tempfile.mkdtemp(), 'jobs.json')
+    # Un proceso que ya no existe dejó un trabajo a medias
+    dead = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                          capture_output=True, text=True)
+    with open(jobs_file, 'w', encoding='utf-8') as f:
+        json.dump({"job1": {
+            "id": "job1", "kind": AI_JOB_KIND, "status": "running",
+            "payload": {"operation": "estimate", "task": SAMPLE_TASK, "task_id": None},
+            "result": None, "error": None, "created_at": time.time(), "started_at": time.time(),
+            "finished_at": None, "owner": int(dead.stdout)
+        }}, f)
+
+    JobManager.configure(jobs_file)
+    service, _ = make_service("8")
+    with mock.patch.object(ai_task_routes, 'ai_service', service):
+        client = create_app().test_client()  # create_app reencola los pendientes
+        job = wait_for_job(client, "job1")
+    assert job["status"] == "succeeded"
+    assert job["result"]["effort_hours"] == 8.0
+    print("✅ El trabajo interrumpido se reencola y termina")
+
+
+def test_local_classifier_skips_the_llm_when_confident():
+    print_separator("TEST: CLASIFICADOR LOCAL DE CATEGORÍAS")
+    TaskManager.configure(os.path.join(tempfile.mkdtemp(), 'tasks.json'))
+    TaskManager.add_tasks([
+        Task("Optimizar consultas del informe mensual", "Reducir el tiempo de carga", "alta", 5,
+             "completada", "Ana", category="Backend"),
+        Task("Optimizar consultas de facturación", "Índices nuevos", "media", 3,
+             "completada", "Luis", category="Backend"),
+    ])
+    provider = MockProvider("Infra")
+    service = AIService(cache=LLMCache(max_entries=0), provider=provider,
+                        classifier=LocalClassifier(threshold=0.8))
+
+    # Palabras clave claras: sin llamada al modelo
+    assert service.categorize_task({"title": "Crear tests end-to-end con Selenium"}) == "Testing"
+    # Aprendido de las tareas guardadas
+    assert service.categorize_task({"title": "Optimizar consultas lentas"}) == "Backend"
+    assert provider.complete.call_count == 0
+    # Sin evidencias: decide el LLM
+    assert service.categorize_task({"title": "Revisar el documento de alcance"}) == "Infra"
+    assert provider.complete.call_count == 1
+
+    stats = service.get_status()["local_classifier"]
+    assert stats["served_locally"] == 2 and stats["llm_fallbacks"] == 1
+    assert stats["local_fraction"] == 0.667 and stats["training_examples"] == 2
+
+    # Las tareas nuevas se cuentan al guardarse, sin reentrenar
+    TaskManager.add_task(Task("Documentar la API de pagos", "Endpoints nuevos", "baja", 2,
+                              "completada", "Ana", category="Backend"))
+    assert service.get_status()["local_classifier"]["training_examples"] == 3
+    print(f"✅ {stats['served_locally']} de 3 resueltas sin el LLM")
+
+
+def test_effort_estimator_uses_similar_completed_tasks():
+    print_separator("TEST: ESTIMADOR kNN DE ESFUERZO")
+    TaskManager.configure(os.path.join(tempfile.mkdtemp(), 'tasks.json'))
+    login = Task("Implementar login con JWT", "Endpoint de autenticación", "alta", 8, "completada", "Ana",
+                 category="Backend")
+    TaskManager.add_tasks([
+        login,
+        Task("Implementar login con OAuth", "Endpoint de autenticación", "alta", 9, "completada", "Luis",
+             category="Backend"),
+        Task("Implementar registro con JWT", "Endpoint de alta", "media", 7, "pendiente", "Eva",
+             category="Backend"),
+    ])
+    provider = MockProvider("20")
+    service = AIService(cache=LLMCache(max_entries=0), provider=provider, **llm_only(),
+                        estimator=EffortEstimator(k=3, threshold=0.6))
+    task = {"title": "Implementar login con JWT", "description": "Endpoint de autenticación",
+            "category": "Backend"}
+
+    # Solo cuentan las completadas: 8 y 9 horas, muy parecidas
+    assert service.estimate_effort_hours(task) == 8.5
+    assert provider.complete.call_count == 0
+    assert service.estimator.stats()["indexed_tasks"] == 2
+
+    # El índice sigue los cambios de TaskManager: una tarea con horas muy distintas baja la confianza
+    TaskManager.patch_task(login.id, {"effort_hours": 40})
+    assert service.estimate_effort_hours(task) == 20.0
+    prompt = provider.complete.call_args[0][0][-1]["content"]
+    assert "Implementar login con OAuth: 9 horas" in prompt and "40 horas" in prompt
+
+    TaskManager.delete_task(login.id)
+    assert service.estimator.stats()["indexed_tasks"] == 1
+    print(f"✅ {service.estimator.stats()}")
+
+
+def test_near_duplicate_tasks_reuse_answers():
+    print_separator("TEST: REUTILIZACIÓN ENTRE TAREAS CASI IGUALES")
+    provider = MockProvider("Backend")
+    service = AIService(cache=LLMCache(max_entries=100, ttl_seconds=60), provider=provider,
+                        classifier=LocalClassifier(threshold=1), estimator=EffortEstimator(threshold=1),
+                        near_duplicates=create_near_duplicate_indexes(('categorize',)))
+
+    assert service.categorize_task({"title": "Implementar login"}) == "Backend"
+    assert service.categorize_task({"title": "Implementar el login"}) == "Backend"
+    assert provider.complete.call_count == 1
+    # Otra palabra significativa sí cambia la tarea
+    service.categorize_task({"title": "Implementar logout"})
+    assert provider.complete.call_count == 2
+
+    # estimate no tiene índice: cada variante va al LLM
+    provider.complete.return_value = "5"
+    service.estimate_effort_hours({"title": "Implementar login", "description": ""})
+    service.estimate_effort_hours({"title": "Implementar el login", "description": ""})
+    assert provider.complete.call_count == 4
+
+    stats = service.get_status()["near_duplicates"]
+    assert list(stats) == ["categorize"] and stats["categorize"]["hits"] == 1
+    print(f"✅ {stats}")
+
+
+def test_structured_audit_uses_one_call_and_falls_back():
+    print_separator("TEST: AUDITORÍA EN UNA LLAMADA")
+    provider = MockProvider('{"risk_analysis": "Riesgo A", "risk_mitigation": "Acción B"}')
+    service = AIService(cache=LLMCache(max_entries=0), provider=provider, **llm_only())
+
+    assert service.audit_risks(SAMPLE_TASK, mode='structured') == ("Riesgo A", "Acción B")
+    assert provider.complete.call_count == 1
+    assert provider.complete.call_args[0][3] == {"type": "json_object"}
+
+    # Respuesta sin el esquema: se repite en modo chain (1 + 2 llamadas)
+    provider.complete.return_value = '{"risk_analysis": "Solo riesgo"}'
+    risk_analysis, risk_mitigation = service.audit_risks(SAMPLE_TASK, mode='structured')
+    assert risk_analysis == risk_mitigation == '{"risk_analysis": "Solo riesgo"}'
+    assert provider.complete.call_count == 4
+
+    service.audit_risks(SAMPLE_TASK, mode='chain')
+    stats = service.get_status()["audit"]
+    assert stats["structured"]["requests"] == 2 and stats["structured"]["fallbacks"] == 1
+    assert stats["chain"]["avg_llm_calls"] == 2 and stats["savings"] is not None
+
+    # El modo se elige por petición; uno desconocido es un 400
+    client = create_app().test_client()
+    fake = AIService(cache=LLMCache(max_entries=0), provider=FakeLLMProvider(), **llm_only())
+    with mock.patch.object(ai_task_routes, 'ai_service', fake):
+        response = client.post('/ai/tasks/audit?mode=structured', json=SAMPLE_TASK)
+        assert client.post('/ai/tasks/audit?mode=otro', json=SAMPLE_TASK).status_code == 400
+    assert response.status_code == 200
+    assert response.get_json()["risk_mitigation"].startswith("Mitigación simulada")
+    assert fake.get_status()["audit"]["structured"]["avg_llm_calls"] == 1
+
+    async_service = AsyncAIService(cache=LLMCache(max_entries=0), provider=FakeLLMProvider(), **llm_only())
+    assert async_service.run(async_service.audit_risks(SAMPLE_TASK, mode='structured')) == \
+        fake.audit_risks(SAMPLE_TASK, mode='structured')
+    print(f"✅ {stats}")
+
+
+def test_audit_mode_reaches_jobs_and_batches():
+    print_separator("TEST: ?mode EN TRABAJOS Y BATCH, Y JSON INVÁLIDO FUERA DE LA CACHÉ")
+    # Una respuesta estructurada inválida no se guarda: la siguiente petición vuelve a pedirla
+    service, upstream = make_service('{"risk_analysis": "Solo riesgo"}')
+    service.audit_risks(SAMPLE_TASK, mode='structured')
+    service.audit_risks(SAMPLE_TASK, mode='structured')
+    assert upstream.call_count == 4  # 1 + 2 (chain) y 1 más: las de chain sí se cachean
+    upstream.return_value = '{"risk_analysis": "Riesgo A", "risk_mitigation": "Acción B"}'
+    service.audit_risks(SAMPLE_TASK, mode='structured')
+    assert service.audit_risks(SAMPLE_TASK, mode='structured') == ("Riesgo A", "Acción B")
+    assert upstream.call_count == 5
+
+    tmp_dir = tempfile.mkdtemp()
+    JobManager.configure(os.path.join(tmp_dir, 'jobs.json'), workers=1)
+    fake = AIService(cache=LLMCache(max_entries=0), provider=FakeLLMProvider(), **llm_only())
+    async_fake = AsyncAIService(cache=LLMCache(max_entries=0), provider=FakeLLMProvider(), **llm_only())
+    client = create_app().test_client()
+    with mock.patch.object(ai_task_routes, 'ai_service', fake), \
+            mock.patch.object(ai_task_routes, 'async_ai_service', async_fake):
+        response = client.post('/ai/tasks/audit?mode=structured&async=true', json=SAMPLE_TASK)
+        assert wait_for_job(client, response.get_json()["id"])["status"] == "succeeded"
+        assert client.post('/ai/tasks/audit?mode=otro&async=true', json=SAMPLE_TASK).status_code == 400
+
+        response = client.post('/ai/tasks/batch/audit?mode=structured', json=[SAMPLE_TASK, SAMPLE_TASK])
+        assert response.get_json()["succeeded"] == 2
+        assert client.post('/ai/tasks/batch/audit?mode=otro', json=[SAMPLE_TASK]).status_code == 400
+
+    JobManager.wait_for_jobs()
+    assert fake.get_status()["audit"]["structured"]["requests"] == 1
+    assert async_fake.audit_stats.stats()["structured"]["requests"] == 2
+    print("✅ El modo llega a los trabajos y al batch; el JSON inválido se vuelve a pedir")
+
+
+def test_enrich_runs_independent_steps_in_parallel():
+    print_separator("TEST: ENRIQUECIMIENTO COMPLETO (/ai/tasks/enrich)")
+    tmp_dir = tempfile.mkdtemp()
+    TaskManager.configure(os.path.join(tmp_dir, 'tasks.json'))
+    task = Task("Pasarela de pagos", "", "alta", 0, "pendiente", "Luis", category="Backend")
+    TaskManager.add_task(task)
+
+    service = AsyncAIService(cache=LLMCache(max_entries=0), provider=FakeLLMProvider(latency=0.1),
+                             estimator=EffortEstimator(threshold=1), **llm_only())
+    client = create_app().test_client()
+    data = {"title": "Login con OAuth", "priority": "alta", "status": "pendiente", "assigned_to": "Ana"}
+    with mock.patch.object(ai_task_routes, 'async_ai_service', service):
+        response = client.post('/ai/tasks/enrich', json=data)
+        body = response.get_json()
+        assert response.status_code == 200
+        assert all(step["status"] == "completed" for step in body["steps"].values())
+        assert all(body["task"][field] for field in ("description", "category", "effort_hours",
+                                                     "risk_analysis", "risk_mitigation"))
+        # Camino crítico de 3 llamadas frente a 5 en secuencia
+        assert body["elapsed_ms"] < 0.75 * body["sequential_ms"]
+        print(f"✅ {body['elapsed_ms']:.0f} ms frente a {body['sequential_ms']:.0f} ms en secuencia")
+
+        # En modo structured la auditoría es un solo paso
+        response = client.post('/ai/tasks/enrich?mode=structured', json=data)
+        assert set(response.get_json()["steps"]) == {"describe", "categorize", "estimate", "audit"}
+
+        # Con task_id solo se generan los campos que faltan y se guardan con persist
+        response = client.post('/ai/tasks/enrich?persist=true', json={"task_id": task.id})
+        body = response.get_json()
+        assert body["persisted"] and body["steps"]["categorize"]["status"] == "skipped"
+        stored = TaskManager.get_task(task.id)
+        assert stored.category == "Backend" and stored.description and stored.effort_hours > 0
+        assert stored.risk_mitigation == body["task"]["risk_mitigation"]
+
+        assert client.post('/ai/tasks/enrich?persist=true', json=data).status_code == 400
+        assert client.post('/ai/tasks/enrich', json={"title": "Sin datos"}).status_code == 400
+    print("✅ Pasos omitidos si el campo existe y resultado guardado con persist=true")
+
+
+def test_generation_profiles_and_usage_report():
+    print_separator("TEST: PERFILES DE GENERACIÓN Y TOKENS POR OPERACIÓN")
+    service, upstream = make_service("Testing")
+    service.categorize_task(SAMPLE_TASK)
+    service.categorize_task(SAMPLE_TASK)
+    args, kwargs = upstream.call_args
+    assert args[1:3] == (0.0, 10) and kwargs["stop"] == ["\n"]
+    service.generate_description(SAMPLE_TASK)
+    assert upstream.call_args[0][1:3] == (0.7, 250)
+
+    # Sin tokens en la respuesta (el mock) se estiman
+    report = service.get_usage_report()["operations"]
+    assert report["categorize"]["calls"] == 1 and report["categorize"]["cache_hits"] == 1
+    assert report["categorize"]["estimated_calls"] == 1 and report["categorize"]["latency_ms"]["p50"] >= 0
+
+    # Con el cliente de Azure los tokens salen de la respuesta de la API
+    server = make_server(port=0, provider=FakeLLMProvider(latency=0.01))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        provider = AzureOpenAIProvider('test', f"http://127.0.0.1:{server.server_port}",
+                                       'fake-deployment', '2024-12-01-preview')
+        azure = AIService(cache=LLMCache(max_entries=0), provider=provider, **llm_only())
+        azure.audit_risks(SAMPLE_TASK, mode='chain')
+        client = create_app().test_client()
+        with mock.patch.object(ai_task_routes, 'ai_service', azure):
+            body = client.get('/ai/tasks/usage').get_json()
+        analysis = body["operations"]["risk_analysis"]
+        assert analysis["calls"] == 1 and analysis["estimated_calls"] == 0
+        assert analysis["completion_tokens"]["total"] == 7
+        assert body["profiles"]["categorize"]["max_tokens"] == 10
+
+        messages = [{"role": "user", "content": "Genera una descripción"}]
+        usage = {}
+        assert ''.join(provider.stream(messages, 0.7, 500, usage=usage)) == FakeLLMProvider.answer(messages)
+        assert usage == {"prompt_tokens": 3, "completion_tokens": 7, "finish_reason": "stop"}
+        assert provider.complete(messages, 0.7, 500, stop=[" simulada"]) == "Respuesta"
+    finally:
+        server.shutdown()
+        server.server_close()
+    print(f"✅ {analysis}")
+
+
+if __name__ == "__main__":
+    test_repeated_prompt_is_served_from_cache()
+    test_cache_lru_and_ttl()
+    test_cache_persists_to_disk()
+    test_concurrent_identical_prompts_share_one_call()
+    test_async_service_keeps_hundreds_of_calls_in_flight()
+    test_batch_endpoint_fans_out_in_order()
+    test_fake_provider_is_deterministic()
+    test_fake_server_speaks_chat_completions()
+    test_describe_and_audit_stream_tokens()
+    test_token_bucket_limits_rate()
+    test_retries_honor_retry_after()
+    test_circuit_breaker_fails_fast()
+    test_app_boots_without_azure_or_openai()
+    test_invalid_generation_profiles_fail_only_ai_requests()
+    test_status_endpoint()
+    test_async_job_writes_back_to_task()
+    test_pending_jobs_resume_after_restart()
+    test_local_classifier_skips_the_llm_when_confident()
+    test_effort_estimator_uses_similar_completed_tasks()
+    test_near_duplicate_tasks_reuse_answers()
+    test_structured_audit_uses_one_call_and_falls_back()
+    test_audit_mode_reaches_jobs_and_batches()
+    test_enrich_runs_independent_steps_in_parallel()
+    test_generation_profiles_and_usage_report()
+    print_separator("✅ TODAS LAS PRUEBAS COMPLETADAS")
@@ -0,0 +1,535 @@
+"""
+Pruebas locales del almacenamiento de tareas (TaskManager).
+
+No necesitan el servidor Flask corriendo: usan el cliente de pruebas de Flask
+y un tasks.json temporal. Ejecutar con:
+
+    python test_store.py
+    python -m pytest test_store.py
+"""
+import base64
+import builtins
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+from unittest import mock
+
+# Valores ficticios para poder importar las rutas de IA sin credenciales reales
+os.environ.setdefault('AZURE_OPENAI_API_KEY', 'test')
+os.environ.setdefault('AZURE_OPENAI_ENDPOINT', 'https://localhost')
+os.environ.setdefault('AZURE_OPENAI_DEPLOYMENT', 'test')
+os.environ.setdefault('AZURE_OPENAI_API_VERSION', '2024-12-01-preview')
+
+from app import create_app
+from managers.group_commit import _PendingOperation
+from managers.task_manager import TaskManager
+from models.task import Task
+
+SAMPLE_TASK = {
+    "title": "Tarea de Prueba",
+    "description": "Esto es una prueba automática",
+    "priority": "alta",
+    "effort_hours": 2.5,
+    "status": "pendiente",
+    "assigned_to": "Pablo"
+}
+
+
+def print_separator(title):
+    print(f"\n{'='*20} {title} {'='*20}")
+
+
+def setup_store():
+    """Apunta TaskManager a un tasks.json temporal y devuelve un cliente de pruebas."""
+    tmp_dir = tempfile.mkdtemp()
+    TaskManager.configure(os.path.join(tmp_dir, 'tasks.json'))
+    return create_app().test_client()
+
+
+def test_second_get_does_not_touch_disk():
+    print_separator("TEST: CACHÉ EN MEMORIA")
+    client = setup_store()
+    task_id = client.post('/tasks', json=SAMPLE_TASK).get_json()['id']
+
+    # Primer GET: puede leer el archivo
+    assert client.get(f'/tasks/{task_id}').status_code == 200
+
+    # Segundo GET: no debe abrir tasks.json
+    real_open = builtins.open
+    opened = []
+
+    def tracking_open(file, *args, **kwargs):
+        opened.append(os.fspath(file) if isinstance(file, (str, os.PathLike)) else file)
+        return real_open(file, *args, **kwargs)
+
+    with mock.patch('builtins.open', side_effect=tracking_open):
+        response = client.get(f'/tasks/{task_id}')
+        client.get('/tasks')
+
+    assert response.status_code == 200
+    assert TaskManager.tasks_file not in opened, f"Se abrió el archivo: {opened}"
+    print("✅ El segundo GET se sirvió desde memoria")
+
+
+def test_external_change_invalidates_cache():
+    print_separator("TEST: INVALIDACIÓN POR CAMBIO EXTERNO")
+    client = setup_store()
+    client.post('/tasks', json=SAMPLE_TASK)
+    assert len(client.get('/tasks').get_json()) == 1
+
+    # Otro proceso reescribe el almacén (snapshot vacío y sin journal)
+    with open(TaskManager.tasks_file, 'w', encoding='utf-8') as f:
+        f.write('[]')
+    os.utime(TaskManager.tasks_file, ns=(0, 0))
+    os.remove(TaskManager.tasks_file + '.journal')
+
+    assert client.get('/tasks').get_json() == []
+    assert len(TaskManager.reload()) == 0
+    print("✅ La caché se recarga al cambiar el archivo")
+
+
+def test_index_consistent_after_update_and_delete():
+    print_separator("TEST: ÍNDICE POR ID")
+    client = setup_store()
+    task_id = client.post('/tasks', json=SAMPLE_TASK).get_json()['id']
+
+    updated = dict(SAMPLE_TASK, title="Tarea Actualizada", status="completada")
+    assert client.put(f'/tasks/{task_id}', json=updated).status_code == 200
+    assert TaskManager.get_task(task_id).title == "Tarea Actualizada"
+
+    # Tras recargar de disco el índice sigue viendo el cambio
+    TaskManager.reload()
+    assert TaskManager.get_task(task_id).status == "completada"
+
+    assert client.delete(f'/tasks/{task_id}').status_code == 200
+    assert TaskManager.get_task(task_id) is None
+    assert client.delete(f'/tasks/{task_id}').status_code == 404
+    print("✅ El índice se mantiene en create/update/delete")
+
+
+def test_journal_replay_and_compaction():
+    print_separator("TEST: JOURNAL Y COMPACTACIÓN")
+    client = setup_store()
+    ids = [client.post('/tasks', json=SAMPLE_TASK).get_json()['id'] for _ in range(3)]
+    client.put(f'/tasks/{ids[0]}', json=dict(SAMPLE_TASK, title="Editada"))
+    client.delete(f'/tasks/{ids[1]}')
+
+    # Las escrituras solo han ido al journal
+    assert not os.path.exists(TaskManager.tasks_file)
+    journal_path = TaskManager.tasks_file + '.journal'
+    with open(journal_path, encoding='utf-8') as f:
+        assert len(f.readlines()) == 5
+
+    # Un arranque en frío reproduce el journal
+    TaskManager.invalidate_cache()
+    tasks = {t.id: t for t in TaskManager.load_tasks()}
+    assert list(tasks) == [ids[0], ids[2]]
+    assert tasks[ids[0]].title == "Editada"
+
+    # Tras compactar, el snapshot contiene todo y el journal queda vacío
+    TaskManager.compact()
+    assert os.path.getsize(journal_path) == 0
+    TaskManager.invalidate_cache()
+    assert [t.id for t in TaskManager.load_tasks()] == [ids[0], ids[2]]
+
+    # Una línea incompleta al final (escritura interrumpida) se ignora
+    with open(journal_path, 'a', encoding='utf-8') as f:
+        f.write('{"op": "delete", "id"')
+    TaskManager.invalidate_cache()
+    assert len(TaskManager.load_tasks()) == 2
+    client.post('/tasks', json=SAMPLE_TASK)
+    TaskManager.invalidate_cache()
+    assert len(TaskManager.load_tasks()) == 3
+    print("✅ El journal se reproduce y compacta correctamente")
+
+
+def test_background_compaction():
+    print_separator("TEST: COMPACTACIÓN EN SEGUNDO PLANO")
+    setup_store()
+    TaskManager.configure(TaskManager.tasks_file, journal_max_bytes=2048)
+    client = create_app().test_client()
+    for _ in range(20):
+        client.post('/tasks', json=SAMPLE_TASK)
+    TaskManager.wait_for_compaction()
+
+    assert os.path.getsize(TaskManager.tasks_file + '.journal') < 2048
+    TaskManager.invalidate_cache()
+    assert len(TaskManager.load_tasks()) == 20
+    print("✅ El journal se compacta al superar el umbral")
+
+
+def test_concurrent_creates_are_grouped():
+    print_separator("TEST: GROUP COMMIT")
+    setup_store()
+    appends = []
+    original_append = TaskManager._journal.append
+
+    def counting_append(records):
+        appends.append(len(records))
+        return original_append(records)
+
+    def worker():
+        for _ in range(10):
+            TaskManager.add_task(Task.from_dict(SAMPLE_TASK))
+
+    with mock.patch.object(TaskManager._journal, 'append', side_effect=counting_append):
+        threads = [threading.Thread(target=worker) for _ in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    # Ninguna alta se pierde y las escrituras se agrupan en lotes
+    assert sum(appends) == 160
+    assert len(appends) < 160
+    TaskManager.invalidate_cache()
+    assert len(TaskManager.load_tasks()) == 160
+    print(f"✅ 160 altas persistidas en {len(appends)} escrituras")
+
+
+def _stress_worker(tasks_file, worker_id, rounds):
+    """Proceso independiente que crea y borra tareas sobre el mismo almacén."""
+    TaskManager.configure(tasks_file, journal_max_bytes=4096)
+    kept = []
+    for i in range(rounds):
+        task = TaskManager.add_task(Task.from_dict(dict(SAMPLE_TASK, title=f"w{worker_id}-{i}")))
+        doomed = TaskManager.add_task(Task.from_dict(SAMPLE_TASK))
+        assert TaskManager.delete_task(doomed.id)
+        kept.append(task.id)
+    TaskManager.wait_for_compaction()
+    return kept
+
+
+def test_multiprocess_create_delete_loses_nothing():
+    print_separator("TEST: VARIOS PROCESOS (ESTRÉS)")
+    setup_store()
+    tasks_file = TaskManager.tasks_file
+    processes, rounds = 4, 30
+
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        results = pool.starmap(_stress_worker, [(tasks_file, w, rounds) for w in range(processes)])
+    expected = {task_id for kept in results for task_id in kept}
+
+    TaskManager.configure(tasks_file)
+    assert {t.id for t in TaskManager.load_tasks()} == expected
+    assert len(expected) == processes * rounds
+
+    # El snapshot siempre es JSON válido y, tras compactar, contiene todo
+    TaskManager.compact()
+    with open(tasks_file, encoding='utf-8') as f:
+        assert {item['id'] for item in json.load(f)} == expected
+    print(f"✅ {len(expected)} tareas de {processes} procesos, ninguna perdida")
+
+
+def test_corrupt_snapshot_is_an_error_not_empty():
+    print_separator("TEST: SNAPSHOT CORRUPTO")
+    client = setup_store()
+    with open(TaskManager.tasks_file, 'w', encoding='utf-8') as f:
+        f.write('[{"id": "a", "title": ')
+
+    response = client.get('/tasks')
+    assert response.status_code == 500
+    assert 'error' in response.get_json()
+    print("✅ Un tasks.json a medias devuelve error en vez de lista vacía")
+
+
+def test_query_filters_sort_and_pagination():
+    print_separator("TEST: FILTROS, ORDEN Y PAGINACIÓN")
+    client = setup_store()
+    people = ['Pablo', 'Juan']
+    priorities = ['alta', 'baja', 'media']
+    for i in range(30):
+        client.post('/tasks', json=dict(
+            SAMPLE_TASK,
+            title=f"Tarea {i}",
+            priority=priorities[i % 3],
+            assigned_to=people[i % 2],
+            effort_hours=i % 7
+        ))
+
+    # Una tarea cambia de estado: debe salir del índice 'pendiente'
+    first = client.get('/tasks').get_json()[0]
+    client.put(f"/tasks/{first['id']}", json=dict(first, status='completada'))
+
+    def fetch_all(query):
+        items, cursor = [], None
+        while True:
+            url = f"/tasks?{query}&limit=2" + (f"&cursor={cursor}" if cursor else "")
+            response = client.get(url)
+            assert response.status_code == 200
+            items += response.get_json()
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                return items
+
+    expected = [t for t in client.get('/tasks').get_json()
+                if t['priority'] == 'alta' and t['status'] == 'pendiente' and t['assigned_to'] == 'Pablo']
+    assert fetch_all("priority=alta&status=pendiente&assigned_to=Pablo") == expected
+    assert first['id'] not in [t['id'] for t in expected]
+
+    by_effort = fetch_all("assigned_to=Juan&sort=-effort_hours")
+    efforts = [t['effort_hours'] for t in by_effort]
+    assert efforts == sorted(efforts, reverse=True) and len(by_effort) == 15
+
+    assert client.get('/tasks?priority=urgente').status_code == 400
+    assert client.get('/tasks?sort=title').status_code == 400
+    assert client.get('/tasks?limit=2&cursor=basura').status_code == 400
+
+    # Cursores bien codificados con una clave que no corresponde al orden: 400, no 500
+    def cursor(key, sort):
+        payload = json.dumps({"key": key, "sort": sort, "desc": False})
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+    for key, sort in ((["a", 1], 'effort_hours'), (3, 'effort_hours'), ([1, 2, 3], 'effort_hours'),
+                      ([1.5, "x"], 'effort_hours'), ([0, 1], None), ("3", None), (True, None)):
+        query = f"limit=2&cursor={cursor(key, sort)}" + (f"&sort={sort}" if sort else "")
+        response = client.get(f"/tasks?{query}")
+        assert response.status_code == 400 and "error" in response.get_json()
+    assert client.get(f"/tasks?limit=2&sort=effort_hours&cursor={cursor([1.5, 3], 'effort_hours')}").status_code == 200
+    print("✅ Consultas paginadas coinciden con el filtrado completo")
+
+
+def test_streaming_responses_match_regular_json():
+    print_separator("TEST: GET /tasks EN STREAMING")
+    client = setup_store()
+    TaskManager.save_tasks([Task.from_dict(dict(SAMPLE_TASK, title=f"Tarea {i}")) for i in range(1200)])
+
+    regular = client.get('/tasks').get_json()
+    streamed = client.get('/tasks?stream=true')
+    assert streamed.is_streamed
+    assert json.loads(streamed.get_data(as_text=True)) == regular
+
+    ndjson = client.get('/tasks', headers={'Accept': 'application/x-ndjson'})
+    assert ndjson.mimetype == 'application/x-ndjson'
+    lines = ndjson.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == regular
+
+    empty = setup_store().get('/tasks?stream=true')
+    assert json.loads(empty.get_data(as_text=True)) == []
+    print("✅ Array JSON y NDJSON en streaming equivalen a la respuesta normal")
+
+
+def test_bulk_endpoints_single_write_and_item_errors():
+    print_separator("TEST: ENDPOINTS BULK")
+    client = setup_store()
+    appends = []
+    original_append = TaskManager._journal.append
+
+    def counting_append(records):
+        appends.append(len(records))
+        return original_append(records)
+
+    payload = [dict(SAMPLE_TASK, title=f"Importada {i}") for i in range(50)]
+    payload.insert(3, dict(SAMPLE_TASK, priority="urgente"))
+    with mock.patch.object(TaskManager._journal, 'append', side_effect=counting_append):
+        response = client.post('/tasks/bulk', json=payload)
+    body = response.get_json()
+    assert response.status_code == 201
+    assert len(body['created']) == 50 and appends == [50]
+    assert [error['index'] for error in body['errors']] == [3]
+
+    ids = [task['id'] for task in body['created']]
+    updates = [dict(SAMPLE_TASK, id=task_id, status="completada") for task_id in ids[:5]]
+    updates.append(dict(SAMPLE_TASK, id="no-existe"))
+    response = client.put('/tasks/bulk', json=updates)
+    assert len(response.get_json()['updated']) == 5
+    assert response.get_json()['errors'] == [{"index": 5, "errors": ["Tarea no encontrada"]}]
+    assert TaskManager.get_task(ids[0]).status == "completada"
+
+    # Un id que no es texto es un error de su elemento, no un 500 de todo el lote
+    response = client.put('/tasks/bulk', json=[dict(SAMPLE_TASK, id=[ids[5]]),
+                                               dict(SAMPLE_TASK, id=ids[5], status="en progreso")])
+    assert response.status_code == 200
+    assert [error['index'] for error in response.get_json()['errors']] == [0]
+    assert TaskManager.get_task(ids[5]).status == "en progreso"
+
+    response = client.delete('/tasks/bulk', json=ids[:10] + ["no-existe"])
+    assert len(response.get_json()['deleted']) == 10
+    assert len(TaskManager.load_tasks()) == 40
+    assert client.post('/tasks/bulk', json={"title": "no es una lista"}).status_code == 400
+    print("✅ Bulk create/update/delete con errores por elemento")
+
+
+def test_etags_and_conditional_requests():
+    print_separator("TEST: ETAG Y PETICIONES CONDICIONALES")
+    client = setup_store()
+    created = client.post('/tasks', json=SAMPLE_TASK)
+    task_id, task_etag = created.get_json()['id'], created.headers['ETag']
+
+    # Elemento: 304 si no cambió
+    response = client.get(f'/tasks/{task_id}')
+    assert response.headers['ETag'] == task_etag
+    assert client.get(f'/tasks/{task_id}', headers={'If-None-Match': task_etag}).status_code == 304
+
+    # Colección: 304 sin serializar mientras el almacén no cambie
+    listing = client.get('/tasks')
+    collection_etag = listing.headers['ETag']
+    with mock.patch.object(Task, 'to_dict', side_effect=AssertionError("no debe serializar")):
+        assert client.get('/tasks', headers={'If-None-Match': collection_etag}).status_code == 304
+    assert client.get('/tasks?status=pendiente').headers['ETag'] != collection_etag
+
+    # If-Match: la escritura con un ETag viejo falla con 412
+    updated = client.put(f'/tasks/{task_id}', json=dict(SAMPLE_TASK, title="v2"),
+                         headers={'If-Match': task_etag})
+    assert updated.status_code == 200 and updated.headers['ETag'] != task_etag
+    stale = client.put(f'/tasks/{task_id}', json=dict(SAMPLE_TASK, title="v3"),
+                       headers={'If-Match': task_etag})
+    assert stale.status_code == 412
+    assert client.delete(f'/tasks/{task_id}', headers={'If-Match': task_etag}).status_code == 412
+    assert client.get('/tasks', headers={'If-None-Match': collection_etag}).status_code == 200
+
+    assert client.delete(f'/tasks/{task_id}', headers={'If-Match': updated.headers['ETag']}).status_code == 200
+    print("✅ ETags, 304 e If-Match funcionan")
+
+
+def test_listeners_see_only_persisted_changes():
+    print_separator("TEST: LISTENERS DEL ALMACÉN")
+    client = setup_store()
+    seen = []
+
+    def rebuild(tasks):
+        seen[:] = [task.title for task in tasks]
+
+    failing = mock.Mock(**{'add.side_effect': TypeError("título no es texto")})
+    recording = mock.Mock(**{'add.side_effect': lambda task: seen.append(task.title),
+                             'rebuild.side_effect': rebuild})
+    TaskManager.add_listener(failing)
+    TaskManager.add_listener(recording)
+    try:
+        # Un listener que falla no convierte la escritura en un 500 ni la pierde
+        response = client.post('/tasks', json=dict(SAMPLE_TASK, title="Persistida"))
+        assert response.status_code == 201
+        assert TaskManager.reload()[0].title == "Persistida"
+        assert seen == ["Persistida"]
+
+        # Si el journal no se escribe, los listeners no se enteran
+        with mock.patch.object(TaskManager._journal, 'append', side_effect=IOError("disco lleno")):
+            assert client.post('/tasks', json=dict(SAMPLE_TASK, title="Perdida")).status_code == 500
+        assert seen == ["Persistida"]
+    finally:
+        TaskManager.remove_listener(failing)
+        TaskManager.remove_listener(recording)
+    print("✅ Los listeners solo reciben cambios ya escritos y sus errores no rompen la escritura")
+
+
+def test_failed_operation_only_affects_itself():
+    print_separator("TEST: FALLO AISLADO EN UN LOTE")
+    setup_store()
+    existing = TaskManager.add_task(Task.from_dict(SAMPLE_TASK))
+
+    def half_done():
+        # Prepara un borrado y una alta y luego falla: nada de eso debe quedar
+        TaskManager._stage_delete(existing.id)
+        TaskManager._stage_create(Task.from_dict(dict(SAMPLE_TASK, title="A medias")))
+        raise TypeError("fallo inesperado")
+
+    batch = [_PendingOperation(lambda: TaskManager._stage_create(Task.from_dict(dict(SAMPLE_TASK, title="Antes")))),
+             _PendingOperation(half_done),
+             _PendingOperation(lambda: TaskManager._stage_patch(existing.id, {"status": "completada"}))]
+    TaskManager._flush_batch(batch)
+
+    assert batch[0].error is None and isinstance(batch[1].error, TypeError)
+    assert batch[2].error is None and batch[2].result.status == "completada"
+    for tasks in (TaskManager.load_tasks(), TaskManager.reload()):
+        assert sorted(task.title for task in tasks) == ["Antes", "Tarea de Prueba"]
+        assert next(task for task in tasks if task.id == existing.id).status == "completada"
+    print("✅ Una operación que falla no arrastra al resto del lote ni deja cambios a medias")
+
+
+def test_readers_do_not_wait_for_journal_writes():
+    print_separator("TEST: LECTURAS DURANTE UNA ESCRITURA")
+    client = setup_store()
+    task_id = client.post('/tasks', json=SAMPLE_TASK).get_json()['id']
+    writing, release = threading.Event(), threading.Event()
+    original_append = TaskManager._journal.append
+
+    def slow_append(records):
+        writing.set()
+        release.wait(5)
+        return original_append(records)
+
+    with mock.patch.object(TaskManager._journal, 'append', side_effect=slow_append):
+        writer = threading.Thread(target=TaskManager.patch_task, args=(task_id, {"status": "completada"}))
+        writer.start()
+        try:
+            assert writing.wait(5)
+            # El fsync sigue en curso: se lee la última versión confirmada sin esperar
+            reads = {}
+            reader = threading.Thread(target=lambda: reads.update(
+                task=TaskManager.get_task(task_id), tasks=TaskManager.load_tasks(),
+                page=TaskManager.query_tasks({"status": "pendiente"})[0],
+                etag=client.get(f'/tasks/{task_id}').headers['ETag']))
+            reader.start()
+            reader.join(2)
+            assert not reader.is_alive(), "la lectura esperó a la escritura"
+            assert reads['task'].status == "pendiente" and len(reads['page']) == 1
+        finally:
+            release.set()
+            writer.join()
+
+    assert TaskManager.get_task(task_id).status == "completada"
+    assert client.get(f'/tasks/{task_id}').headers['ETag'] != reads['etag']
+    print("✅ Los lectores no esperan al fsync del journal")
+
+
+def test_sorted_pages_follow_writes():
+    print_separator("TEST: ORDEN POR ÍNDICE TRAS ESCRITURAS")
+    setup_store()
+    tasks = TaskManager.add_tasks([Task.from_dict(dict(SAMPLE_TASK, title=f"Tarea {i}", effort_hours=i % 5 + 1,
+                                                      assigned_to=['Pablo', 'Juan'][i % 2]))
+                                   for i in range(40)])
+
+    def fetch_all(filters, sort, descending, limit):
+        items, cursor = [], None
+        while True:
+            page, cursor = TaskManager.query_tasks(filters, sort, descending, limit, cursor)
+            items += page
+            if cursor is None:
+                return [task.id for task in items]
+
+    def matching(filters):
+        return {task.id for task in TaskManager.load_tasks()
+                if all(getattr(task, field) == value for field, value in filters.items())}
+
+    for _ in range(2):
+        for filters in ({}, {"assigned_to": "Juan"}):
+            for descending in (False, True):
+                ids = fetch_all(filters, 'effort_hours', descending, 3)
+                efforts = [TaskManager.get_task(task_id).effort_hours for task_id in ids]
+                assert efforts == sorted(efforts, reverse=descending)
+                assert len(ids) == len(set(ids)) and set(ids) == matching(filters)
+                # Empates en orden de alta, en ambos sentidos
+                order = {task.id: i for i, task in enumerate(TaskManager.load_tasks())}
+                for a, b in zip(ids, ids[1:]):
+                    if TaskManager.get_task(a).effort_hours == TaskManager.get_task(b).effort_hours:
+                        assert order[a] < order[b]
+        # Cambios sueltos: se incorporan al índice ordenado con bisect
+        TaskManager.patch_task(tasks[0].id, {"effort_hours": 99})
+        TaskManager.delete_task(tasks[1].id)
+        TaskManager.add_task(Task.from_dict(dict(SAMPLE_TASK, effort_hours=0.5, assigned_to="Juan")))
+
+    first, _ = TaskManager.query_tasks(sort='effort_hours', descending=True, limit=1)
+    assert first[0].id == tasks[0].id
+    print("✅ El orden paginado por índice sigue a altas, cambios y bajas")
+
+
+if __name__ == "__main__":
+    test_second_get_does_not_touch_disk()
+    test_external_change_invalidates_cache()
+    test_index_consistent_after_update_and_delete()
+    test_journal_replay_and_compaction()
+    test_background_compaction()
+    test_concurrent_creates_are_grouped()
+    test_multiprocess_create_delete_loses_nothing()
+    test_corrupt_snapshot_is_an_error_not_empty()
+    test_query_filters_sort_and_pagination()
+    test_streaming_responses_match_regular_json()
+    test_bulk_endpoints_single_write_and_item_errors()
+    test_etags_and_conditional_requests()
+    test_listeners_see_only_persisted_changes()
+    test_failed_operation_only_affects_itself()
+    test_readers_do_not_wait_for_journal_writes()
+    test_sorted_pages_follow_writes()
+    print_separator("✅ TODAS LAS PRUEBAS COMPLETADAS")